@@ -19,6 +19,15 @@ import traci
 import pandas as pd
 import xml.etree.ElementTree as ET
 import time
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from utils import checkpoint_utils as cpu
+from utils import e1_utils as e1u
+from utils import metrics_utils as mu
+from utils import registry_utils as ru
+from utils import section_utils as su
 
 # Record the start time
 py_start_time = time.time()
@@ -32,6 +41,10 @@ ATTACK_SCENARIO = True  # Set to True to enable the ego stop logic for attack sc
 INTERVAL_START = None  # Start time for data collection (shared between scenarios) None if attack scenario is enabled
 EGO_BREAKDOWN_DURATION = 36000  # Specify the time in seconds after which the ego vehicle is removed
 GUI = "sumo-gui"  # Use "sumo" for headless mode
+CHECKPOINT_PERIOD = 3600  # Simulation seconds between checkpoints of SUMO and the collected data (0 disables); --resume continues a crashed run, approximately (see checkpoint_utils)
+E1_MODE = "traci"  # "native" lets SUMO aggregate the detectors into E1_PERIOD intervals, re-binned after the run (no per-step work)
+E1_PERIOD = 10  # Native detector output period (s); bins are exact if it divides TIME_INTERVAL and INTERVAL_START is on its grid
+E1_OUTPUT_FILE = "e1_intervals.xml"  # Native detector output
 
 # Constants for LOS and SPI calculation
 ROAD_CAPACITY = 2200  # Maximum capacity of the road (veh/h per lane)
@@ -46,24 +59,16 @@ def precise_stop_control(ego_id, target_position, current_speed, current_pos):
         return max(0, current_speed - deceleration * traci.simulation.getDeltaT()), time_to_stop
     return 0, 0
 
-def determine_los(v_c_ratio):
-    """Determine Level of Service (LOS) based on V/C ratio."""
-    if 0 <= v_c_ratio <= 0.6:
-        return "A"
-    elif 0.6 < v_c_ratio <= 0.7:
-        return "B"
-    elif 0.7 < v_c_ratio <= 0.8:
-        return "C"
-    elif 0.8 < v_c_ratio <= 0.9:
-        return "D"
-    elif 0.9 < v_c_ratio < 1.0:
-        return "E"
-    else:
-        return "F"
-    
-def determine_spi(mean_speed):
-    """Determine SPI (Speed Performance Index)."""
-    return mean_speed / FREE_FLOW_SPEED if FREE_FLOW_SPEED > 0 else 0
+def detector_result(interval_start_time, detector_id, vehicles, mean_speed):
+    """Build the detector results row of one detector and interval from its vehicle count and mean speed (m/s). Flow rate, LOS and SPI are added after the run."""
+    return {
+        "time": interval_start_time,
+        "detector_id": detector_id,
+        "mean_speed": mean_speed * 2.23694,  # Convert mean speed to mph
+        "time_interval": TIME_INTERVAL,
+        "interval_unique_vehicles": vehicles,
+        "scenario": "attack" if ATTACK_SCENARIO else "base",
+    }
 
 def load_detectors_from_xml(detectors_file):
     """Load detector IDs from the XML file."""
@@ -72,78 +77,16 @@ def load_detectors_from_xml(detectors_file):
     detector_ids = [detector.get("id") for detector in root.findall("e1Detector")]
     return detector_ids
 
-def parse_cross_sections(detector_ids):
-    """Group detectors into edges by excluding the middle part of the detector ID."""
-    cross_section_map = {}
-    for detector_id in detector_ids:
-        # Extract edge and position by removing the middle part (e.g., E1_0_1000m -> E1_1000m)
-        parts = detector_id.split("_")
-        if len(parts) == 3:
-            edge = f"{parts[0]}_{parts[2]}"  # Combine the first and last parts
-        else:
-            edge = detector_id  # Fallback for unexpected formats
-        cross_section_map[detector_id] = edge
-    return cross_section_map
-
-def combine_cross_section_outputs(results, cross_section_map):
-    """Combine outputs for detectors along the same edge for each time interval."""
-    combined_results = {}
-
-    for result in results:
-        cross_section = cross_section_map.get(result["detector_id"], None)
-        time = result["time"]
-
-        if cross_section:
-            key = (time, cross_section)
-            if key not in combined_results:
-                combined_results[key] = {
-                    "time": time,
-                    "edge": cross_section,
-                    "total_vehicles": 0,
-                    "detector_speeds": [],  # Store detector mean speeds
-                    "lanes": len([k for k, v in cross_section_map.items() if v == cross_section]),
-                    "scenario": result["scenario"],
-                }
-
-            # Update total vehicle counts for the cross-section
-            combined_results[key]["total_vehicles"] += result["interval_unique_vehicles"]
-            # Append the mean speed of this detector to the list
-            combined_results[key]["detector_speeds"].append(result["mean_speed"])
-
-    cross_section_outputs = []
-    for (time, cross_section), data in combined_results.items():
-        # Calculate the mean speed as the simple average of detector speeds
-        mean_speed = sum(data["detector_speeds"]) / len(data["detector_speeds"]) if data["detector_speeds"] else 0
-
-        # Calculate flowrate as before
-        flowrate = (data["total_vehicles"] * 3600) / TIME_INTERVAL
-        road_capacity = ROAD_CAPACITY * data["lanes"]
-        v_c_ratio = flowrate / road_capacity
-        los_class = determine_los(v_c_ratio)
-        spi = determine_spi(mean_speed)
-
-        cross_section_outputs.append({
-            "time": time,
-            "edge": cross_section,
-            "mean_speed": round(mean_speed, 2),  # Simple mean of detector speeds
-            "flowrate": round(flowrate, 2),  # Flowrate remains unchanged
-            "LOS": los_class,
-            "SPI": round(spi, 2),
-            "lanes": data["lanes"],
-            "total_vehicles": data["total_vehicles"],  # Total vehicles from all detectors
-            "scenario": data["scenario"],
-        })
-
-    return cross_section_outputs
-
 def main():
     global INTERVAL_START
 
+    args = cpu.parse_checkpoint_args(CHECKPOINT_PERIOD)
+
     # Load detectors from XML file
     detector_ids = load_detectors_from_xml(DETECTORS_FILE)
 
-    # Generate cross-section mapping dynamically
-    cross_section_map = parse_cross_sections(detector_ids)
+    # Cross-section topology (lanes per section, order by distance), built once
+    cross_sections = su.CrossSections(DETECTORS_FILE)
 
     # Initialize variables for ego vehicle stop
     stopFlag = False
@@ -159,8 +102,21 @@ def main():
     ego2_stop_time = None
     ego2_stop_flag = False
 
+    # Checkpoints of this configuration (script, SUMO config and the net, route and detector files it lists).
+    # Native detector output is written by the SUMO process itself and cannot be continued, so only TraCI
+    # counting is checkpointed
+    checkpoints = cpu.Checkpointer(ru.run_key(ru.config_files(SUMO_CONFIG) + [__file__], "attack" if ATTACK_SCENARIO else "base", None),
+                                   args.checkpoint_period if E1_MODE == "traci" else 0, args.checkpoint_keep,
+                                   output_files=cpu.detector_output_files(DETECTORS_FILE))
+
     # Start the SUMO simulation
-    traci.start([GUI, "-c", SUMO_CONFIG])
+    sumo_cmd = [GUI, "-c", SUMO_CONFIG]
+    if E1_MODE == "native":
+        sumo_cmd += ["--additional-files", e1u.write_interval_detectors(DETECTORS_FILE, E1_OUTPUT_FILE, E1_PERIOD, "detectors_intervals.add.xml")]
+    if args.resume:
+        # SUMO truncates its outputs on start, keep those of the crashed run
+        checkpoints.keep_outputs()
+    traci.start(sumo_cmd + checkpoints.sumo_options())
 
     # Initialize data storage for CSV
     results = []
@@ -169,13 +125,25 @@ def main():
     detectors_data = {
         detector_id: {
             "total_unique_vehicles": 0,
-            "counted_vehicles": set(),
             "interval_unique_vehicles": 0,
             "interval_speeds": [],
             "interval_start_time": 0,
         }
         for detector_id in detector_ids
     }
+    tracker = e1u.DetectorTracker(detector_ids)  # Vehicles seen on each detector, forgotten shortly after they left it
+
+    # Continue a crashed run from its latest checkpoint
+    if args.resume:
+        state = checkpoints.restore()
+        if state:
+            results, detectors_data, tracker = state["results"], state["detectors_data"], state["tracker"]
+            stopFlag, ego_stop_time, INTERVAL_START = state["stopFlag"], state["ego_stop_time"], state["INTERVAL_START"]
+            ego2_stop_flag, ego2_stop_time = state["ego2_stop_flag"], state["ego2_stop_time"]
+            # Speeds set over TraCI are not part of the SUMO state: hold the stopped egos again
+            for vehicle_id, stopped in [(ego_id, stopFlag), (ego2_id, ego2_stop_flag)]:
+                if stopped and vehicle_id in traci.vehicle.getIDList():
+                    traci.vehicle.setSpeed(vehicle_id, 0)
 
     while traci.simulation.getTime() < SIMULATION_END_TIME:
         traci.simulationStep()
@@ -243,68 +211,70 @@ def main():
             traci.vehicle.remove(ego2_id)
             print(f"Ego2 removed at time: {current_time}s.")
 
-        # Process each detector
-        for detector_id in detector_ids:
-            data = detectors_data[detector_id]
-
-            # Start counting only after the INTERVAL_START
-            if INTERVAL_START is not None and current_time >= INTERVAL_START:
-                if data["interval_start_time"] == 0:
-                    data["interval_start_time"] = INTERVAL_START
-
-                vehicle_ids_on_detector = set(traci.inductionloop.getLastStepVehicleIDs(detector_id))
-
-                new_vehicles = vehicle_ids_on_detector - data["counted_vehicles"]
-
-                for vehicle_id in new_vehicles:
-                    # Retrieve speed of vehicles (m/s)
-                    speed = traci.vehicle.getSpeed(vehicle_id)
-                    data["interval_speeds"].append(speed)
-
-                data["total_unique_vehicles"] += len(new_vehicles)
-                data["interval_unique_vehicles"] += len(new_vehicles)
-                data["counted_vehicles"].update(new_vehicles)
-
-                # Check if interval has ended
-                if current_time >= data["interval_start_time"] + TIME_INTERVAL:
-                    # Calculate flow rate
-                    flowrate = data["interval_unique_vehicles"] * 3600 / TIME_INTERVAL
-
-                    # Calculate mean speed (convert to mph)
-                    if data["interval_speeds"]:
-                        mean_speed = sum(data["interval_speeds"]) / len(data["interval_speeds"]) * 2.23694
-                    else:
-                        mean_speed = 0.0
-
-                    # Calculate LOS and SPI
-                    v_c_ratio = flowrate / ROAD_CAPACITY
-                    los_class = determine_los(v_c_ratio)
-                    spi = determine_spi(mean_speed)
-
-                    # Append results for this interval
-                    results.append({
-                        "time": data["interval_start_time"],
-                        "detector_id": detector_id,
-                        "mean_speed": round(mean_speed, 2),
-                        "flowrate": round(flowrate, 2),
-                        "LOS": los_class,
-                        "SPI": round(spi, 2),
-                        "time_interval": TIME_INTERVAL,
-                        "interval_unique_vehicles": data["interval_unique_vehicles"],
-                        "scenario": "attack" if ATTACK_SCENARIO else "base",
-                    })
-
-                    # Reset interval data
-                    data["interval_unique_vehicles"] = 0
-                    data["interval_speeds"].clear()
-                    data["interval_start_time"] += TIME_INTERVAL
+        # Process each detector (in native mode SUMO aggregates the detectors instead)
+        if E1_MODE == "traci":
+            tracker.step(current_time, traci.simulation.getArrivedIDList())
+            for detector_id in detector_ids:
+                data = detectors_data[detector_id]
+
+                # Start counting only after the INTERVAL_START
+                if INTERVAL_START is not None and current_time >= INTERVAL_START:
+                    if data["interval_start_time"] == 0:
+                        data["interval_start_time"] = INTERVAL_START
+
+                    new_vehicles = tracker.new_vehicles(detector_id, traci.inductionloop.getLastStepVehicleIDs(detector_id), current_time)
+
+                    for vehicle_id in new_vehicles:
+                        # Retrieve speed of vehicles (m/s)
+                        speed = traci.vehicle.getSpeed(vehicle_id)
+                        data["interval_speeds"].append(speed)
+
+                    data["total_unique_vehicles"] += len(new_vehicles)
+                    data["interval_unique_vehicles"] += len(new_vehicles)
+
+                    # Check if interval has ended
+                    if current_time >= data["interval_start_time"] + TIME_INTERVAL:
+                        # Calculate mean speed (m/s)
+                        if data["interval_speeds"]:
+                            mean_speed = sum(data["interval_speeds"]) / len(data["interval_speeds"])
+                        else:
+                            mean_speed = 0.0
+
+                        # Append results for this interval
+                        results.append(detector_result(data["interval_start_time"], detector_id, data["interval_unique_vehicles"], mean_speed))
+
+                        # Reset interval data
+                        data["interval_unique_vehicles"] = 0
+                        data["interval_speeds"].clear()
+                        data["interval_start_time"] += TIME_INTERVAL
+
+        # Checkpoint SUMO and the collector state every checkpoint period
+        if checkpoints.due(current_time):
+            checkpoints.save(current_time, {"results": results, "detectors_data": detectors_data, "tracker": tracker,
+                                            "stopFlag": stopFlag, "ego_stop_time": ego_stop_time, "ego2_stop_flag": ego2_stop_flag,
+                                            "ego2_stop_time": ego2_stop_time, "INTERVAL_START": INTERVAL_START})
 
     traci.close()
+    checkpoints.merge_outputs()
+
+    # Re-bin the native detector output into the same intervals
+    if E1_MODE == "native":
+        intervals = e1u.read_intervals(E1_OUTPUT_FILE)
+        for interval_start_time, detector_id, vehicles, mean_speed in e1u.aggregate_intervals(intervals, detector_ids, INTERVAL_START, TIME_INTERVAL):
+            results.append(detector_result(interval_start_time, detector_id, vehicles, mean_speed))
+        # The generated detector file is only needed while SUMO runs
+        os.remove("detectors_intervals.add.xml")
+
+    # Flow rate, LOS and SPI of all detector rows at once
+    results = mu.detector_metrics(results, ROAD_CAPACITY, FREE_FLOW_SPEED)
 
     # Combine results by cross-section and append to the same file
-    cross_section_results = combine_cross_section_outputs(results, cross_section_map)
+    cross_section_results = cross_sections.combine(results, TIME_INTERVAL, ROAD_CAPACITY, FREE_FLOW_SPEED, weighted=False)
     handle_file_operations(results, cross_section_results, ATTACK_SCENARIO)
 
+    # The run finished, its checkpoints are no longer needed
+    checkpoints.clear()
+
 def save_results_to_csv(results, filename, append=False):
     """Save or append the simulation results to a CSV file."""
     df = pd.DataFrame(results)
@@ -17,6 +17,14 @@
 import traci
 import pandas as pd
 import xml.etree.ElementTree as ET
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from utils import checkpoint_utils as cpu
+from utils import metrics_utils as mu
+from utils import registry_utils as ru
+from utils import section_utils as su
 import time
 
 # Record the start time
@@ -31,6 +39,7 @@ ATTACK_SCENARIO = False  # Set to True to enable the ego stop logic for attack s
 INTERVAL_START = 55029.5  # Start time for data collection (shared between scenarios) None if attack scenario is enabled
 EGO_BREAKDOWN_DURATION = 36000  # Specify the time in seconds after which the ego vehicle is removed
 GUI = "sumo"  # Use "sumo" for headless mode
+CHECKPOINT_PERIOD = 3600  # Simulation seconds between checkpoints of SUMO and the collected data (0 disables); --resume continues a crashed run, approximately (see checkpoint_utils)
 
 # Constants for LOS and SPI calculation
 ROAD_CAPACITY = 2200  # Maximum capacity of the road (veh/h per lane)
@@ -45,25 +54,6 @@ def precise_stop_control(ego_id, target_position, current_speed, current_pos):
         return max(0, current_speed - deceleration * traci.simulation.getDeltaT()), time_to_stop
     return 0, 0
 
-def determine_los(v_c_ratio):
-    """Determine Level of Service (LOS) based on V/C ratio."""
-    if 0 <= v_c_ratio <= 0.6:
-        return "A"
-    elif 0.6 < v_c_ratio <= 0.7:
-        return "B"
-    elif 0.7 < v_c_ratio <= 0.8:
-        return "C"
-    elif 0.8 < v_c_ratio <= 0.9:
-        return "D"
-    elif 0.9 < v_c_ratio < 1.0:
-        return "E"
-    else:
-        return "F"
-    
-def determine_spi(mean_speed):
-    """Determine SPI (Speed Performance Index)."""
-    return mean_speed / FREE_FLOW_SPEED if FREE_FLOW_SPEED > 0 else 0
-
 def load_detectors_from_xml(detectors_file):
     """Load detector IDs from the XML file."""
     tree = ET.parse(detectors_file)
@@ -71,74 +61,16 @@ def load_detectors_from_xml(detectors_file):
     detector_ids = [detector.get("id") for detector in root.findall("e1Detector")]
     return detector_ids
 
-def parse_cross_sections(detector_ids):
-    """Group detectors into edges by excluding the middle part of the detector ID."""
-    cross_section_map = {}
-    for detector_id in detector_ids:
-        # Extract edge and position by removing the middle part (e.g., E1_0_1000m -> E1_1000m)
-        parts = detector_id.split("_")
-        if len(parts) == 3:
-            edge = f"{parts[0]}_{parts[2]}"  # Combine the first and last parts
-        else:
-            edge = detector_id  # Fallback for unexpected formats
-        cross_section_map[detector_id] = edge
-    return cross_section_map
-
-def combine_cross_section_outputs(results, cross_section_map):
-    """Combine outputs for detectors along the same edge for each time interval."""
-    combined_results = {}
-
-    for result in results:
-        cross_section = cross_section_map.get(result["detector_id"], None)
-        time = result["time"]
-
-        if cross_section:
-            key = (time, cross_section)
-            if key not in combined_results:
-                combined_results[key] = {
-                    "time": time,
-                    "edge": cross_section,
-                    "total_vehicles": 0,
-                    "weighted_speed_sum": 0,
-                    "lanes": len([k for k, v in cross_section_map.items() if v == cross_section]),
-                    "scenario": result["scenario"],
-                }
-
-            combined_results[key]["total_vehicles"] += result["interval_unique_vehicles"]
-            combined_results[key]["weighted_speed_sum"] += result["mean_speed"] * result["interval_unique_vehicles"]
-
-    cross_section_outputs = []
-    for (time, cross_section), data in combined_results.items():
-        total_vehicles = data["total_vehicles"]
-        mean_speed = data["weighted_speed_sum"] / total_vehicles if total_vehicles > 0 else 0
-        flowrate = (total_vehicles * 3600) / TIME_INTERVAL
-        road_capacity = ROAD_CAPACITY * data["lanes"]
-        v_c_ratio = flowrate / road_capacity
-        los_class = determine_los(v_c_ratio)
-        spi = determine_spi(mean_speed)
-
-        cross_section_outputs.append({
-            "time": time,
-            "edge": cross_section,
-            "mean_speed": round(mean_speed, 2),
-            "flowrate": round(flowrate, 2),
-            "LOS": los_class,
-            "SPI": round(spi, 2),
-            "lanes": data["lanes"],
-            "total_vehicles": total_vehicles,
-            "scenario": data["scenario"],
-        })
-
-    return cross_section_outputs
-
 def main():
     global INTERVAL_START
 
+    args = cpu.parse_checkpoint_args(CHECKPOINT_PERIOD)
+
     # Load detectors from XML file
     detector_ids = load_detectors_from_xml(DETECTORS_FILE)
 
-    # Generate cross-section mapping dynamically
-    cross_section_map = parse_cross_sections(detector_ids)
+    # Cross-section topology (lanes per section, order by distance), built once
+    cross_sections = su.CrossSections(DETECTORS_FILE)
 
     # Initialize variables for ego vehicle stop
     stopFlag = False
@@ -154,8 +86,16 @@ def main():
     ego2_stop_time = None
     ego2_stop_flag = False
 
+    # Checkpoints of this configuration (script, SUMO config and the net, route and detector files it lists)
+    checkpoints = cpu.Checkpointer(ru.run_key(ru.config_files(SUMO_CONFIG) + [__file__], "attack" if ATTACK_SCENARIO else "base", None),
+                                   args.checkpoint_period, args.checkpoint_keep,
+                                   output_files=cpu.detector_output_files(DETECTORS_FILE))
+
     # Start the SUMO simulation
-    traci.start([GUI, "-c", SUMO_CONFIG])
+    if args.resume:
+        # SUMO truncates its outputs on start, keep those of the crashed run
+        checkpoints.keep_outputs()
+    traci.start([GUI, "-c", SUMO_CONFIG] + checkpoints.sumo_options())
 
     # Initialize data storage for CSV
     results = []
@@ -172,6 +112,18 @@ def main():
         for detector_id in detector_ids
     }
 
+    # Continue a crashed run from its latest checkpoint
+    if args.resume:
+        state = checkpoints.restore()
+        if state:
+            results, detectors_data = state["results"], state["detectors_data"]
+            stopFlag, ego_stop_time, INTERVAL_START = state["stopFlag"], state["ego_stop_time"], state["INTERVAL_START"]
+            ego2_stop_flag, ego2_stop_time = state["ego2_stop_flag"], state["ego2_stop_time"]
+            # Speeds set over TraCI are not part of the SUMO state: hold the stopped egos again
+            for vehicle_id, stopped in [(ego_id, stopFlag), (ego2_id, ego2_stop_flag)]:
+                if stopped and vehicle_id in traci.vehicle.getIDList():
+                    traci.vehicle.setSpeed(vehicle_id, 0)
+
     while traci.simulation.getTime() < SIMULATION_END_TIME:
         traci.simulationStep()
 
@@ -260,28 +212,17 @@ def main():
 
                 # Check if interval has ended
                 if current_time >= data["interval_start_time"] + TIME_INTERVAL:
-                    # Calculate flow rate
-                    flowrate = data["interval_unique_vehicles"] * 3600 / TIME_INTERVAL
-
                     # Calculate mean speed (convert to mph)
                     if data["interval_speeds"]:
                         mean_speed = sum(data["interval_speeds"]) / len(data["interval_speeds"]) * 2.23694
                     else:
                         mean_speed = 0.0
 
-                    # Calculate LOS and SPI
-                    v_c_ratio = flowrate / ROAD_CAPACITY
-                    los_class = determine_los(v_c_ratio)
-                    spi = determine_spi(mean_speed)
-
-                    # Append results for this interval
+                    # Append results for this interval (flow rate, LOS and SPI are added after the run)
                     results.append({
                         "time": data["interval_start_time"],
                         "detector_id": detector_id,
-                        "mean_speed": round(mean_speed, 2),
-                        "flowrate": round(flowrate, 2),
-                        "LOS": los_class,
-                        "SPI": round(spi, 2),
+                        "mean_speed": mean_speed,
                         "time_interval": TIME_INTERVAL,
                         "interval_unique_vehicles": data["interval_unique_vehicles"],
                         "scenario": "attack" if ATTACK_SCENARIO else "base",
@@ -292,12 +233,25 @@ def main():
                     data["interval_speeds"].clear()
                     data["interval_start_time"] += TIME_INTERVAL
 
+        # Checkpoint SUMO and the collector state every checkpoint period
+        if checkpoints.due(current_time):
+            checkpoints.save(current_time, {"results": results, "detectors_data": detectors_data, "stopFlag": stopFlag,
+                                            "ego_stop_time": ego_stop_time, "ego2_stop_flag": ego2_stop_flag,
+                                            "ego2_stop_time": ego2_stop_time, "INTERVAL_START": INTERVAL_START})
+
     traci.close()
+    checkpoints.merge_outputs()
+
+    # Flow rate, LOS and SPI of all detector rows at once
+    results = mu.detector_metrics(results, ROAD_CAPACITY, FREE_FLOW_SPEED)
 
     # Combine results by cross-section and append to the same file
-    cross_section_results = combine_cross_section_outputs(results, cross_section_map)
+    cross_section_results = cross_sections.combine(results, TIME_INTERVAL, ROAD_CAPACITY, FREE_FLOW_SPEED)
     handle_file_operations(results, cross_section_results, ATTACK_SCENARIO)
 
+    # The run finished, its checkpoints are no longer needed
+    checkpoints.clear()
+
 def save_results_to_csv(results, filename, append=False):
     """Save or append the simulation results to a CSV file."""
     df = pd.DataFrame(results)
@@ -46,25 +46,6 @@ def precise_stop_control(ego_id, target_position, current_speed, current_pos):
         return max(0, current_speed - deceleration * traci.simulation.getDeltaT()), time_to_stop
     return 0, 0
 
-def determine_los(v_c_ratio):
-    """Determine Level of Service (LOS) based on V/C ratio."""
-    if 0 <= v_c_ratio <= 0.6:
-        return "A"
-    elif 0.6 < v_c_ratio <= 0.7:
-        return "B"
-    elif 0.7 < v_c_ratio <= 0.8:
-        return "C"
-    elif 0.8 < v_c_ratio <= 0.9:
-        return "D"
-    elif 0.9 < v_c_ratio < 1.0:
-        return "E"
-    else:
-        return "F"
-    
-def determine_spi(mean_speed):
-    """Determine SPI (Speed Performance Index)."""
-    return mean_speed / FREE_FLOW_SPEED if FREE_FLOW_SPEED > 0 else 0
-
 # def load_detectors_from_xml(detectors_file):
 #     """Load detector IDs from the XML file."""
 #     tree = ET.parse(detectors_file)
@@ -72,78 +53,15 @@ def determine_spi(mean_speed):
 #     detector_ids = [detector.get("id") for detector in root.findall("e1Detector")]
 #     return detector_ids
 
-# def parse_cross_sections(detector_ids):
-#     """Group detectors into edges by excluding the middle part of the detector ID."""
-#     cross_section_map = {}
-#     for detector_id in detector_ids:
-#         # Extract edge and position by removing the middle part (e.g., E1_0_1000m -> E1_1000m)
-#         parts = detector_id.split("_")
-#         if len(parts) == 3:
-#             edge = f"{parts[0]}_{parts[2]}"  # Combine the first and last parts
-#         else:
-#             edge = detector_id  # Fallback for unexpected formats
-#         cross_section_map[detector_id] = edge
-#     return cross_section_map
-
-def combine_cross_section_outputs(results, cross_section_map):
-    """Combine outputs for detectors along the same edge for each time interval."""
-    combined_results = {}
-
-    for result in results:
-        cross_section = cross_section_map.get(result["detector_id"], None)
-        time = result["time"]
-
-        if cross_section:
-            key = (time, cross_section)
-            if key not in combined_results:
-                combined_results[key] = {
-                    "time": time,
-                    "edge": cross_section,
-                    "total_vehicles": 0,
-                    "detector_speeds": [],  # Store detector mean speeds
-                    "lanes": len([k for k, v in cross_section_map.items() if v == cross_section]),
-                    "scenario": result["scenario"],
-                }
-
-            # Update total vehicle counts for the cross-section
-            combined_results[key]["total_vehicles"] += result["interval_unique_vehicles"]
-            # Append the mean speed of this detector to the list
-            combined_results[key]["detector_speeds"].append(result["mean_speed"])
-
-    cross_section_outputs = []
-    for (time, cross_section), data in combined_results.items():
-        # Calculate the mean speed as the simple average of detector speeds
-        mean_speed = sum(data["detector_speeds"]) / len(data["detector_speeds"]) if data["detector_speeds"] else 0
-
-        # Calculate flowrate as before
-        flowrate = (data["total_vehicles"] * 3600) / TIME_INTERVAL
-        road_capacity = ROAD_CAPACITY * data["lanes"]
-        v_c_ratio = flowrate / road_capacity
-        los_class = determine_los(v_c_ratio)
-        spi = determine_spi(mean_speed)
-
-        cross_section_outputs.append({
-            "time": time,
-            "edge": cross_section,
-            "mean_speed": round(mean_speed, 2),  # Simple mean of detector speeds
-            "flowrate": round(flowrate, 2),  # Flowrate remains unchanged
-            "LOS": los_class,
-            "SPI": round(spi, 2),
-            "lanes": data["lanes"],
-            "total_vehicles": data["total_vehicles"],  # Total vehicles from all detectors
-            "scenario": data["scenario"],
-        })
-
-    return cross_section_outputs
-
 def main():
     global INTERVAL_START
 
     # # Load detectors from XML file
     # detector_ids = load_detectors_from_xml(DETECTORS_FILE)
 
-    # # Generate cross-section mapping dynamically
-    # cross_section_map = parse_cross_sections(detector_ids)
+    # # Cross-section topology (lanes per section, order by distance), built once. The commented processing
+    # # needs utils on sys.path and 'from utils import metrics_utils as mu' / 'from utils import section_utils as su'
+    # cross_sections = su.CrossSections(DETECTORS_FILE)
 
     # Initialize variables for ego vehicle stop
     stopFlag = False
@@ -267,28 +185,17 @@ def main():
 
         #         # Check if interval has ended
         #         if current_time >= data["interval_start_time"] + TIME_INTERVAL:
-        #             # Calculate flow rate
-        #             flowrate = data["interval_unique_vehicles"] * 3600 / TIME_INTERVAL
-
         #             # Calculate mean speed (convert to mph)
         #             if data["interval_speeds"]:
         #                 mean_speed = sum(data["interval_speeds"]) / len(data["interval_speeds"]) * 2.23694
         #             else:
         #                 mean_speed = 0.0
 
-        #             # Calculate LOS and SPI
-        #             v_c_ratio = flowrate / ROAD_CAPACITY
-        #             los_class = determine_los(v_c_ratio)
-        #             spi = determine_spi(mean_speed)
-
-        #             # Append results for this interval
+        #             # Append results for this interval (flow rate, LOS and SPI are added after the run)
         #             results.append({
         #                 "time": data["interval_start_time"],
         #                 "detector_id": detector_id,
-        #                 "mean_speed": round(mean_speed, 2),
-        #                 "flowrate": round(flowrate, 2),
-        #                 "LOS": los_class,
-        #                 "SPI": round(spi, 2),
+        #                 "mean_speed": mean_speed,
         #                 "time_interval": TIME_INTERVAL,
         #                 "interval_unique_vehicles": data["interval_unique_vehicles"],
         #                 "scenario": "attack" if ATTACK_SCENARIO else "base",
@@ -301,8 +208,11 @@ def main():
 
     traci.close()
 
+    # Flow rate, LOS and SPI of all detector rows at once
+    # results = mu.detector_metrics(results, ROAD_CAPACITY, FREE_FLOW_SPEED)
+
     # Combine results by cross-section and append to the same file
-    # cross_section_results = combine_cross_section_outputs(results, cross_section_map)
+    # cross_section_results = cross_sections.combine(results, TIME_INTERVAL, ROAD_CAPACITY, FREE_FLOW_SPEED, weighted=False)
     # handle_file_operations(results, cross_section_results, ATTACK_SCENARIO)
 
 def save_results_to_csv(results, filename, append=False):
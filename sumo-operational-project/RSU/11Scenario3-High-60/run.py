@@ -5,20 +5,49 @@ import random
 import pandas as pd
 import shutil
 import os
-
-# Record the start time
-py_start_time = time.time()
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from utils import parallel_utils as pu
+from utils import vehicle_utils as vu
+from utils import command_utils as cu
+from utils import zone_utils as zu
+from utils import closure_utils as clu
+from utils import detector_utils as du
+from utils import event_utils as eu
+from utils import registry_utils as ru
+from utils import state_utils as stu
 
 # Generate unique random seeds between 1 and 23423
 num_seeds = 30
-seeds = random.sample(range(1, 23424), num_seeds)
-
-print("Generated random seeds:", seeds)
 
 SIMULATION_END_TIME = 7800
 scenarios = ["attack", "base"]
 ADDITIONAL_FILE = "lanedetectors.add.xml"
 EMERGENCY_BRAKE_THRESHOLD = -4.5
+TRAJECTORY_WINDOW = 0  # Seconds of trajectory before and after each emergency brake saved to trajectory/ (0 disables)
+# Scenarios are identical until VSL starts (600 s): simulated once per seed and loaded from a saved state (0 disables).
+# SUMO 1.18 does not load a state back bit for bit, so the branches differ slightly from runs simulated from 0
+PREFIX_TIME = 600
+RUN_INPUTS = ["RSU.sumocfg", "RSU.net.xml", "RSU.rou.xml", "e1detectors.add.xml", ADDITIONAL_FILE, __file__]  # Hashed for the prefix and run caches (run keys add the imported utils modules and the SUMO version)
+RUN_REGISTRY = ru.DEFAULT_REGISTRY_FILE  # Completed runs; a rerun of the folder skips them
+
+# Speed-control zones per scenario: CAVs on the edge between start_pos and end_pos get the
+# scheduled limit (mph) while begin < time <= end
+VSL_ZONES = {
+    "attack": [
+        {"edge": "E0", "start_pos": 3000, "end_pos": 4000, "vehicle_type": "CAV",
+         "schedule": [(600, 2400, 50), (2400, 4200, 40), (4200, 7800, 30)]},
+    ],
+}
+
+# Lane closures per scenario: vehicles of vehicle_type have to leave the lane before start_pos
+# (asked from merge_distance before it) while begin <= time < end (open-ended without end)
+LANE_CLOSURES = {
+    "attack": [
+        {"lane": "E0_0", "start_pos": 3500, "end_pos": 5000, "merge_distance": 500, "begin": 6000, "vehicle_type": "CAV"},
+    ],
+}
 
 os.makedirs("e1", exist_ok=True)
 
@@ -27,55 +56,6 @@ tree = ET.parse(ADDITIONAL_FILE)
 root = tree.getroot()
 lane_detectors = [elem.attrib["id"] for elem in root.findall("laneAreaDetector")]
 
-def VSL_control_ebraking(VSL):
-    """If vehicle type is CAV, set speed limit to 40 mph in E1"""
-    for vehicle in traci.vehicle.getIDList():
-        # print(f"vehicle speed: {traci.vehicle.getSpeed(vehicle) * 2.23694} mph, location: {traci.vehicle.getLanePosition(vehicle)}")
-        if "CAV" in traci.vehicle.getTypeID(vehicle):  # Handles CAV and CAV@xxx types
-            if traci.vehicle.getLanePosition(vehicle) > 3000 and traci.vehicle.getLanePosition(vehicle) < 4000:
-                traci.vehicle.setMaxSpeed(vehicle, VSL * 0.44704)  # Convert mph to m/s
-                
-            else:
-                traci.vehicle.setMaxSpeed(vehicle, 55.56)  # Restore default speed 
-
-def VSL_control(VSL):
-    """Gradually slow down CAVs in E1 within a specific location range using dynamic deceleration"""
-    MAX_DECELERATION = -3.0  # Maximum desired deceleration rate in m/s² (adjustable)
-    
-    for vehicle in traci.vehicle.getIDList():
-        current_speed = traci.vehicle.getSpeed(vehicle)  # Current speed (m/s)
-        current_position = traci.vehicle.getLanePosition(vehicle)  # Vehicle position on the lane
-
-        # print(f"Vehicle: {vehicle}, Speed: {current_speed * 2.23694:.2f} mph, Position: {current_position:.2f} m")
-
-        if "CAV" in traci.vehicle.getTypeID(vehicle):  # Handles CAV and CAV@xxx types
-            if 3000 < current_position < 4000:
-                target_speed = VSL * 0.44704  # Convert mph to m/s
-                
-                # Check if the vehicle needs to slow down
-                if current_speed > target_speed:
-                    # Compute required deceleration time
-                    deceleration_time = (current_speed - target_speed) / abs(MAX_DECELERATION)
-                    
-                    # Ensure a minimum time threshold to avoid excessive deceleration
-                    # deceleration_time = max(deceleration_time, 1.0)  # At least 1 second
-
-                    # Issue slow down command
-                    traci.vehicle.slowDown(vehicle, target_speed, deceleration_time)  
-                    slowing_vehicles[vehicle] = target_speed  # Mark vehicle as slowing down
-                    # print(f"Slowing down {vehicle} to {target_speed * 2.23694:.2f} mph over {deceleration_time:.2f} sec")
-                
-                else:
-                    # Vehicle has reached the target speed, keep it there
-                    traci.vehicle.setMaxSpeed(vehicle, target_speed)
-                    # print(f"{vehicle} maintaining speed of {target_speed * 2.23694:.2f} mph")
-            
-            else:
-                # Restore original max speed when leaving the zone
-                traci.vehicle.setMaxSpeed(vehicle, 55.56)  # Restore default speed
-                if vehicle in slowing_vehicles:
-                    del slowing_vehicles[vehicle]  # Remove from tracking once out of the zone
-
 def ego_brake():
     """Selects one CAV vehicle and applies emergency braking at a predefined position."""
     global attack_success, CAV_detected, chosen_vehicle
@@ -112,7 +92,7 @@ def ego_brake():
             current_speed = traci.vehicle.getSpeed(chosen_vehicle)
             # stopping_time = current_speed / emergency_decel
             # traci.vehicle.slowDown(chosen_vehicle, speed=0.0, duration=stopping_time)
-            traci.vehicle.setSpeed(chosen_vehicle, 0.0)
+            commands.set_speed(chosen_vehicle, 0.0)
             attack_success = True  # braking completed
             print(f"Emergency braking applied to {chosen_vehicle} at position {veh_pos:.2f}m, speed {current_speed * 2.23694:.2f} mph")
 
@@ -169,11 +149,11 @@ def ego_acceleration():
                 
                 if collided or distance_to_leader <= 0.5:  # collision or very close
                     traci.vehicle.setAcceleration(chosen_vehicle, 0, 0)
-                    traci.vehicle.setSpeed(chosen_vehicle, 0)
+                    commands.set_speed(chosen_vehicle, 0)
                     traci.vehicle.setSpeedMode(chosen_vehicle, -1)
                     traci.vehicle.setLaneChangeMode(chosen_vehicle, -1)
                     
-                    traci.vehicle.setSpeed(leader_id, 0)
+                    commands.set_speed(leader_id, 0)
                     traci.vehicle.setSpeedMode(leader_id, -1)
                     traci.vehicle.setLaneChangeMode(leader_id, -1)
                     
@@ -189,155 +169,203 @@ def ego_acceleration():
         print("Chosen vehicle exited the simulation without collision.")
         attack_success = True
 
-def lane_closure():
-    """Call this in your simulation loop once per timestep."""
-    for vehID in traci.vehicle.getIDList():
-        # Check if it's a CAV:
-        if "CAV" in traci.vehicle.getTypeID(vehID):
-            laneID = traci.vehicle.getLaneID(vehID)
-            pos    = traci.vehicle.getLanePosition(vehID)
-
-            # 1) If on the left lane (edgeX_0)
-            if laneID == "E0_0":
-
-                # A) Vehicle is between 3000 and 3500m
-                if 3000 <= pos < 3500:
-                    # Keep telling them to switch to lane 1 
-                    # while allowing them to move forward.
-                    traci.vehicle.changeLane(vehID, 1, 2)
-                    # no forced stop here, they can keep rolling
-
-                # B) Vehicle is at or beyond 3500m in lane 0
-                elif pos >= 3500:
-                    # Force them to stop
-                    traci.vehicle.setSpeed(vehID, 0.0)
-                    # Also keep issuing lane change commands so it merges
-                    traci.vehicle.changeLane(vehID, 1, 2)
-                    
-                    # If a gap appears, SUMO might allow the lane change *this* step
-                    # but the vehicle’s speed is already set to 0. On next step, 
-                    # we’ll see if it has moved to lane 1.
-
-            # 2) If they are NOT on left lane, let them drive normally
-            else:
-                # If they've merged into lane 1, ensure they can move
-                traci.vehicle.setSpeed(vehID, -1)  # free speed
-
-for scenario in scenarios:
-    for seed in seeds:
-        print(f"Running scenario: {scenario}, seed: {seed}")
-
-        data, eb_log, collision_log = [], [], []
-        detector_entry_log = {detector: set() for detector in lane_detectors}
-        slowing_vehicles = {}
-        CAV_detected = False
-        attack_success = False
-        chosen_vehicle = None
-        STEP_COUNTER = 1
-
-        # Prepare unique XML file for e1 detectors
-        original_xml = "e1detectors.add.xml"
-        modified_xml = f"e1detectors_{scenario}_{seed}.add.xml"
-        shutil.copy(original_xml, modified_xml)
-
-        # Modify XML detector output filename
-        tree = ET.parse(modified_xml)
-        root = tree.getroot()
-        for elem in root.findall("e1Detector"):
-            elem.set("file", f"e1/e1detectors_{scenario}_{seed}.xml")
-        tree.write(modified_xml)
-
-        # Start SUMO
-        sumoCmd = [
-            "sumo",
-            "-c", "RSU.sumocfg",
-            "--seed", str(seed),
-            "--additional-files", f"{modified_xml},{ADDITIONAL_FILE}"
-        ]
-        traci.start(sumoCmd)
-
-        while traci.simulation.getTime() < SIMULATION_END_TIME:
-            traci.simulationStep()
-            simtime = traci.simulation.getTime()
-
-            # Data collection every second
-            if STEP_COUNTER % 10 == 0:
-                for detector_id in lane_detectors:
-                    num_vehicles = traci.lanearea.getLastStepVehicleNumber(detector_id)
-
-                    density_veh_km = (num_vehicles / 100.0) * 1000
-
-                    data.append([simtime, detector_id, num_vehicles, density_veh_km, scenario, seed])
-
-            # VSL and Attack scenario handling
-            if scenario == "attack":
-                if 600 < simtime <= 2400:
-                    VSL_control_ebraking(50)
-                elif 2400 < simtime <= 4200:
-                    VSL_control_ebraking(40)
-                elif 4200 < simtime <= 7800:
-                    VSL_control_ebraking(30)
-
-                if simtime >= 6000 and not attack_success:
-                    lane_closure()
-
-
-            # Emergency brake detection
-            for veh_id in traci.vehicle.getIDList():
-                acceleration = traci.vehicle.getAcceleration(veh_id)
-                if acceleration < EMERGENCY_BRAKE_THRESHOLD:
-                    eb_log.append([simtime, veh_id, acceleration,
-                                   traci.vehicle.getSpeed(veh_id)*2.23694,
-                                   traci.vehicle.getLanePosition(veh_id), scenario, seed])
-
-            # Collision detection
-            collisions = traci.simulation.getCollisions()
-            for collision in collisions:
-                collision_log.append([
-                    simtime,
-                    collision.collider,
-                    collision.victim,
-                    collision.colliderType,
-                    collision.victimType,
-                    collision.colliderSpeed * 2.23694,
-                    collision.victimSpeed * 2.23694,
-                    collision.lane,
-                    collision.pos,
-                    scenario,
-                    seed
-                ])
-
-            STEP_COUNTER += 1
-
-        traci.close()
-
-        # Ensure directories exist
-        os.makedirs("data", exist_ok=True)
-        os.makedirs("emergency", exist_ok=True)
-        os.makedirs("collision", exist_ok=True)
-
-        # Saving data after each run
-        df = pd.DataFrame(data, columns=["Time (s)", "Detector ID", "Vehicle Count", "Density (veh/km)", "Scenario", "Seed"])
-        df.to_csv(f"data/data_{scenario}_{seed}.csv", index=False)
-
-        df_ebraking = pd.DataFrame(eb_log, columns=["Time (s)", "Vehicle ID", "Acceleration (m/s^2)",
-                                                    "Speed (mph)", "Position", "Scenario", "Seed"])
-        df_ebraking.to_csv(f"emergency/emergency_brake_{scenario}_{seed}.csv", index=False)
-
-        df_collision = pd.DataFrame(collision_log, columns=["Time (s)", "Collider ID", "Victim ID", "Collider Type",
-                                                            "Victim Type", "Collider Speed (mph)", "Victim Speed (mph)",
-                                                            "Lane", "Position (m)", "Scenario", "Seed"])
-        df_collision.to_csv(f"collision/collision_log_{scenario}_{seed}.csv", index=False)
-
-        # Delete additional files
-        os.remove(modified_xml)
-
-        print(f"Completed scenario: {scenario}, seed: {seed}")
-
-py_end_time = time.time()
-py_elapsed_time = py_end_time - py_start_time
-print(f"Script finished in {py_elapsed_time:.2f} seconds.")
-
-
-
-
+def prepare_run(name, seed):
+    """Writes the additional files unique to this run and returns (SUMO command, generated files)."""
+    # Prepare unique XML file for e1 detectors
+    original_xml = "e1detectors.add.xml"
+    modified_xml = f"e1detectors_{name}_{seed}.add.xml"
+    shutil.copy(original_xml, modified_xml)
+
+    # Modify XML detector output filename
+    tree = ET.parse(modified_xml)
+    root = tree.getroot()
+    for elem in root.findall("e1Detector"):
+        elem.set("file", f"e1/e1detectors_{name}_{seed}.xml")
+    tree.write(modified_xml)
+    additional_files = [modified_xml]
+
+    # SUMO command
+    sumoCmd = [
+        "sumo",
+        "-c", "RSU.sumocfg",
+        "--seed", str(seed),
+        "--additional-files", ",".join(additional_files + [ADDITIONAL_FILE])
+    ]
+    return sumoCmd, additional_files
+
+def simulate_until(end_time, scenario, seed, data, eb_log, collision_log, trajectory_log=None):
+    """Steps the running simulation to end_time, applying the scenario controls and logging detectors, emergency brakes and collisions."""
+    global registry, commands
+    # All vehicles are subscribed for the emergency brake detection. Synced from getIDList on the first step, also after a loaded state
+    registry = vu.VehicleRegistry(variables=eu.VEHICLE_VARIABLES)
+    data.subscribe()
+    commands = cu.CommandCache()  # Drops setter calls that repeat the last value sent
+    zones = [zu.SpeedZone(**zone) for zone in VSL_ZONES.get(scenario, [])]
+    closures = [clu.LaneClosure(**closure) for closure in LANE_CLOSURES.get(scenario, [])]
+    events = eu.EventCapture(EMERGENCY_BRAKE_THRESHOLD, scenario, seed, eb_log, collision_log, trajectory_log, TRAJECTORY_WINDOW)
+    STEP_COUNTER = round(traci.simulation.getTime() / traci.simulation.getDeltaT()) + 1
+
+    while traci.simulation.getTime() < end_time:
+        traci.simulationStep()
+        registry.update()
+        simtime = traci.simulation.getTime()
+        commands.step(simtime, registry.arrived)
+
+        # Data collection every second
+        if STEP_COUNTER % 10 == 0:
+            data.sample(simtime)
+
+        # VSL: speed limits are only sent when CAVs enter or leave a zone or the schedule changes
+        for zone in zones:
+            zone.apply(simtime, registry, commands)
+
+        # Attack scenario handling: lane closures only act when they open, close or CAVs reach them
+        for closure in closures:
+            closure.apply(simtime, registry, commands)
+
+
+        # Emergency brake and collision detection
+        events.update(simtime, registry)
+
+        STEP_COUNTER += 1
+
+    print(f"{scenario}, seed {seed}: {commands.summary()}")
+
+def run_prefix(seed, state_file, port=None):
+    """Simulates the first PREFIX_TIME seconds, shared by all scenarios of a seed, and saves the state."""
+    data = du.DensitySampler(lane_detectors, PREFIX_TIME)
+    eb_log, collision_log = [], []
+    sumoCmd, run_files = prepare_run("prefix", seed)
+    traci.start(sumoCmd + stu.SAVE_STATE_OPTIONS, port=port, label=f"prefix_{seed}")
+    simulate_until(PREFIX_TIME, "prefix", seed, data, eb_log, collision_log)
+    stu.save_state(state_file, ["RSU.rou.xml"])
+    traci.close()
+
+    # Keep the e1 intervals of the prefix next to the state
+    os.replace(f"e1/e1detectors_prefix_{seed}.xml", stu.sidecar_file(state_file, ".e1.xml"))
+    for file in run_files:
+        os.remove(file)
+    return {"data": data.to_dict(), "eb_log": eb_log, "collision_log": collision_log}
+
+def run_params(scenario):
+    """Returns the script settings that determine the outputs of a scenario."""
+    return {"end_time": SIMULATION_END_TIME, "prefix_time": PREFIX_TIME,
+            "eb_threshold": EMERGENCY_BRAKE_THRESHOLD, "trajectory_window": TRAJECTORY_WINDOW,
+            "vsl_zones": VSL_ZONES.get(scenario), "lane_closures": LANE_CLOSURES.get(scenario)}
+
+def run_key(scenario, seed):
+    """Hashes the inputs of one (scenario, seed) run, this script included."""
+    return ru.run_key(RUN_INPUTS, scenario, seed, run_params(scenario))
+
+def run_outputs(scenario, seed):
+    """Returns the output files of one (scenario, seed) run."""
+    outputs = [
+        f"data/data_{scenario}_{seed}.csv",
+        f"data/data_{scenario}_{seed}.npz",
+        f"emergency/emergency_brake_{scenario}_{seed}.csv",
+        f"collision/collision_log_{scenario}_{seed}.csv",
+        f"e1/e1detectors_{scenario}_{seed}.xml",
+    ]
+    if TRAJECTORY_WINDOW:
+        outputs.append(f"trajectory/trajectory_{scenario}_{seed}.csv")
+    return outputs
+
+def run_scenario(scenario, seed, port=None):
+    """Runs one (scenario, seed) simulation on its own TraCI connection and saves its outputs."""
+    global CAV_detected, attack_success, chosen_vehicle
+
+    print(f"Running scenario: {scenario}, seed: {seed}")
+
+    data = du.DensitySampler(lane_detectors, SIMULATION_END_TIME)
+    eb_log, collision_log, trajectory_log = [], [], []
+    CAV_detected = False
+    attack_success = False
+    chosen_vehicle = None
+
+    sumoCmd, run_files = prepare_run(scenario, seed)
+
+    # Continue from the saved state of the shared prefix instead of simulating it again
+    state_file = None
+    if PREFIX_TIME:
+        # The script is hashed too: it writes the cached prefix logs
+        key = stu.state_key(RUN_INPUTS, seed, PREFIX_TIME)
+        state_file, prefix_logs = stu.get_prefix(key, lambda state_file: run_prefix(seed, state_file, port))
+
+    # Start SUMO
+    traci.start(sumoCmd, port=port, label=f"{scenario}_{seed}")
+    if state_file and not stu.load_state(state_file):
+        # SUMO could not read the state back: simulate the whole run instead
+        traci.start(sumoCmd, port=port, label=f"{scenario}_{seed}")
+        state_file = None
+    if state_file:
+        data.extend(prefix_logs["data"]["times"], prefix_logs["data"]["counts"])
+        eb_log = [row[:-2] + [scenario, seed] for row in prefix_logs["eb_log"]]
+        collision_log = [row[:-2] + [scenario, seed] for row in prefix_logs["collision_log"]]
+
+    simulate_until(SIMULATION_END_TIME, scenario, seed, data, eb_log, collision_log, trajectory_log)
+    traci.close()
+
+    if state_file:
+        stu.merge_interval_output(stu.sidecar_file(state_file, ".e1.xml"), f"e1/e1detectors_{scenario}_{seed}.xml", PREFIX_TIME)
+
+    # Ensure directories exist
+    os.makedirs("data", exist_ok=True)
+    os.makedirs("emergency", exist_ok=True)
+    os.makedirs("collision", exist_ok=True)
+
+    # Saving data after each run
+    df = data.to_frame(scenario, seed)
+    df.to_csv(f"data/data_{scenario}_{seed}.csv", index=False)
+    data.save(f"data/data_{scenario}_{seed}.npz")
+
+    df_ebraking = pd.DataFrame(eb_log, columns=["Time (s)", "Vehicle ID", "Acceleration (m/s^2)",
+                                                "Speed (mph)", "Position", "Scenario", "Seed"])
+    df_ebraking.to_csv(f"emergency/emergency_brake_{scenario}_{seed}.csv", index=False)
+
+    df_collision = pd.DataFrame(collision_log, columns=["Time (s)", "Collider ID", "Victim ID", "Collider Type",
+                                                        "Victim Type", "Collider Speed (mph)", "Victim Speed (mph)",
+                                                        "Lane", "Position (m)", "Scenario", "Seed"])
+    df_collision.to_csv(f"collision/collision_log_{scenario}_{seed}.csv", index=False)
+
+    if TRAJECTORY_WINDOW:
+        os.makedirs("trajectory", exist_ok=True)
+        df_trajectory = pd.DataFrame(trajectory_log, columns=eu.TRAJECTORY_COLUMNS)
+        df_trajectory.to_csv(f"trajectory/trajectory_{scenario}_{seed}.csv", index=False)
+
+    # Delete additional files
+    for file in run_files:
+        os.remove(file)
+
+    # Recorded last, so a run that crashed before this point is simulated again
+    ru.RunRegistry(RUN_REGISTRY).record(f"{scenario}_{seed}", run_key(scenario, seed), run_outputs(scenario, seed), run_params(scenario))
+
+    print(f"Completed scenario: {scenario}, seed: {seed}")
+
+def main():
+    # Record the start time
+    py_start_time = time.time()
+
+    args = pu.parse_run_args()
+    run_registry = ru.RunRegistry(RUN_REGISTRY)
+
+    # Generate unique random seeds between 1 and 23423 (a rerun keeps the seeds of the last sweep)
+    seeds = args.seeds or run_registry.seeds(num_seeds) or random.sample(range(1, 23424), num_seeds)
+    print("Generated random seeds:", seeds)
+    run_registry.save_seeds(seeds)
+
+    # Runs completed with the same inputs are skipped; --only-missing skips every run with outputs, --force none
+    skip = None if args.force else lambda scenario, seed: run_registry.is_complete(
+        f"{scenario}_{seed}", run_key(scenario, seed), run_outputs(scenario, seed), only_missing=args.only_missing)
+
+    failures = pu.run_jobs(run_scenario, scenarios, seeds, workers=args.workers, base_port=args.base_port, skip=skip)
+
+    py_end_time = time.time()
+    py_elapsed_time = py_end_time - py_start_time
+    print(f"Script finished in {py_elapsed_time:.2f} seconds.")
+
+    # A sweep with failed runs exits non-zero, so wrappers and schedulers notice
+    if failures:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import os
+import shutil
+import subprocess
+import sys
+import xml.etree.ElementTree as ET
+
+import pytest
+
+PROJECT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+STEP_LENGTH = 0.1
+DURATION = 900
+
+pytestmark = pytest.mark.skipif(not (shutil.which("sumo") and shutil.which("netgenerate")), reason="SUMO is not installed")
+
+# A long run with checkpoints every 200 s and 100 s detector intervals, exiting without cleanup at --crash-at
+DRIVER = f"""
+import os
+import sys
+
+sys.path.append({PROJECT_DIR!r})
+import traci
+from utils import checkpoint_utils as cpu
+
+crash_at = float(sys.argv[sys.argv.index("--crash-at") + 1]) if "--crash-at" in sys.argv else None
+checkpoints = cpu.Checkpointer("run", 200, output_files=cpu.detector_output_files("detectors.add.xml"))
+if "--resume" in sys.argv:
+    checkpoints.keep_outputs()
+traci.start(["sumo", "-c", "run.sumocfg"] + checkpoints.sumo_options())
+if "--resume" in sys.argv:
+    checkpoints.restore()
+while traci.simulation.getTime() < {DURATION}:
+    traci.simulationStep()
+    time = traci.simulation.getTime()
+    if checkpoints.due(time):
+        checkpoints.save(time, {{}})
+    if crash_at is not None and time >= crash_at:
+        os._exit(1)
+traci.close()
+checkpoints.merge_outputs()
+checkpoints.clear()
+"""
+
+@pytest.fixture
+def scenario(tmp_path):
+    """A two-edge road with a random flow and one e1 detector writing detector_output.xml."""
+    subprocess.run(["netgenerate", "--grid", "--grid.x-number", "3", "--grid.y-number", "1", "--grid.length", "500",
+                    "--default.lanenumber", "2", "-o", "net.net.xml"], cwd=tmp_path, check=True, capture_output=True)
+    (tmp_path / "routes.rou.xml").write_text(
+        '<routes><route id="r" edges="A0B0 B0C0"/>'
+        f'<flow id="f" route="r" begin="0" end="{DURATION}" probability="0.4" departLane="random"/></routes>')
+    (tmp_path / "detectors.add.xml").write_text(
+        '<additional><e1Detector id="d" lane="B0C0_0" pos="10" period="100" file="detector_output.xml"/></additional>')
+    (tmp_path / "run.sumocfg").write_text(
+        '<configuration><input><net-file value="net.net.xml"/><route-files value="routes.rou.xml"/>'
+        '<additional-files value="detectors.add.xml"/></input><seed value="7"/>'
+        f'<time><begin value="0"/><end value="{DURATION}"/><step-length value="{STEP_LENGTH}"/></time>'
+        '<report><no-step-log value="true"/></report></configuration>')
+    (tmp_path / "driver.py").write_text(DRIVER)
+    return tmp_path
+
+def run_driver(directory, *args):
+    result = subprocess.run([sys.executable, "driver.py", *args], cwd=directory, capture_output=True, text=True)
+    return result.stdout
+
+def intervals(output_file):
+    return [(float(interval.get("begin")), float(interval.get("end")), interval.get("nVehContrib"))
+            for interval in ET.parse(output_file).getroot().iter("interval")]
+
+def test_resume_from_two_checkpoints_keeps_detector_output(scenario):
+    run_driver(scenario)
+    uninterrupted = intervals(scenario / "detector_output.xml")
+
+    # Crash after the 400 s checkpoint, resume from it and crash again after the 600 s one
+    run_driver(scenario, "--crash-at", "500")
+    assert "Resumed from checkpoint at 400.0s" in run_driver(scenario, "--resume", "--crash-at", "700")
+    assert "Resumed from checkpoint at 600.0s" in run_driver(scenario, "--resume")
+    resumed = intervals(scenario / "detector_output.xml")
+
+    # The crashed run's intervals before the first resume are kept as written
+    assert [interval for interval in resumed if interval[1] <= 400] == [interval for interval in uninterrupted if interval[1] <= 400]
+    # No empty 0..t interval of a resumed run, no overlaps, and gaps of at most the step where a run resumed
+    assert [interval for interval in resumed if interval[0] == 0] == resumed[:1]
+    for previous, current in zip(resumed, resumed[1:]):
+        assert 0 <= current[0] - previous[1] <= STEP_LENGTH + 1e-6
+    # The interval straddling the 600 s checkpoint (500.1-600.1) was written by the first resumed run and is kept
+    assert any(begin < 600 < end for begin, end, _ in resumed)
+    assert resumed[-1][1] == DURATION
+    assert not os.path.exists(scenario / "checkpoints" / "run")
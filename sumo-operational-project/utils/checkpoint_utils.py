@@ -0,0 +1,209 @@
+import argparse
+import glob
+import math
+import os
+import pickle
+import shutil
+import xml.etree.ElementTree as ET
+
+import traci
+
+from .state_utils import SAVE_STATE_OPTIONS, join_intervals, merge_interval_output
+
+DEFAULT_CHECKPOINT_DIR = "checkpoints"  # One subdirectory per run configuration, removed when the run finishes
+DEFAULT_CHECKPOINT_KEEP = 2  # Older checkpoints are deleted, the previous one stays in case the last is damaged
+DISCARDED_OUTPUTS = {"NUL", "/dev/null"}  # Detector file attributes that write nothing
+
+def parse_checkpoint_args(default_period):
+    """
+    Parse the checkpoint options of the long single-run scripts.
+
+    Args:
+    - default_period (float): Simulation seconds between checkpoints when --checkpoint-period is not given.
+
+    Returns:
+    - argparse.Namespace: Parsed arguments with 'resume', 'checkpoint_period' and 'checkpoint_keep'.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue from the latest checkpoint of this configuration instead of starting at 0")
+    parser.add_argument("--checkpoint-period", type=float, default=default_period,
+                        help="Simulation seconds between checkpoints (0 disables)")
+    parser.add_argument("--checkpoint-keep", type=int, default=DEFAULT_CHECKPOINT_KEEP,
+                        help="Number of checkpoints kept on disk")
+    return parser.parse_args()
+
+def detector_output_files(additional_file):
+    """Return the output files the detectors of an additional file write, relative to the working directory."""
+    directory = os.path.dirname(additional_file)
+    files = [elem.get("file") for elem in ET.parse(additional_file).getroot() if elem.get("file")]
+    return list(dict.fromkeys(os.path.join(directory, file) for file in files if file not in DISCARDED_OUTPUTS))
+
+def read_intervals(output_file):
+    """
+    Read the intervals of a detector output, up to where a crashed run cut it off.
+
+    Returns:
+    - tuple: Root tag and list of interval elements.
+    """
+    root_tag, intervals = None, []
+    try:
+        for event, elem in ET.iterparse(output_file, events=("start", "end")):
+            if event == "start" and root_tag is None:
+                root_tag = elem.tag
+            elif event == "end" and elem.tag == "interval":
+                intervals.append(elem)
+    except ET.ParseError:
+        pass
+    return root_tag or "detector", intervals
+
+class Checkpointer:
+    """
+    Periodic checkpoints of one long run: the SUMO state plus whatever the script collects
+    in Python (detector accumulators, interval counters, ego flags, results so far).
+
+    A checkpoint is the SUMO state file and a pickle of the collector state written after
+    it, so a pickle marks a complete checkpoint and a crash while saving leaves the previous
+    one usable. Checkpoints are taken on a fixed grid of simulation times (multiples of the
+    period), whether the run started at 0 or was resumed.
+
+    Resuming is approximate. SUMO 1.18's loadState does not restore a run bit for bit, not
+    even with a higher --save-state.precision, so a resumed run diverges from the uninterrupted
+    one from the checkpoint on, starting with the interval that spans it. SUMO also restarts
+    its detector intervals one step after the checkpoint. Use it to finish a long run that
+    crashed, not where results must match a run without interruption.
+
+    SUMO truncates its detector outputs when it starts, so a resumed run moves those of the
+    crashed run into the checkpoint directory (keep_outputs) and puts the intervals before the
+    checkpoint back in front of its own once it has finished (merge_outputs).
+    """
+
+    def __init__(self, key, period, keep=DEFAULT_CHECKPOINT_KEEP, checkpoint_dir=DEFAULT_CHECKPOINT_DIR, output_files=()):
+        """
+        Args:
+        - key (str): Identifies the run configuration (e.g. registry_utils.run_key), so a run never resumes from another configuration.
+        - period (float): Simulation seconds between checkpoints (0 disables).
+        - keep (int, optional): Number of checkpoints kept.
+        - checkpoint_dir (str, optional): Directory of the checkpoints of all configurations.
+        - output_files (list, optional): Interval outputs SUMO writes during the run (e.g. from detector_output_files), kept across a resume.
+        """
+        self.directory = os.path.join(checkpoint_dir, key)
+        self.period = period
+        self.keep = max(1, keep)
+        self.output_files = list(output_files)
+        self.next_time = None
+        self.resume_time = None
+
+    def sumo_options(self):
+        """Return the options to add to the SUMO command."""
+        return SAVE_STATE_OPTIONS if self.period else []
+
+    def due(self, time):
+        """Return True if a checkpoint should be saved at time, i.e. time has reached the next multiple of the period."""
+        if not self.period:
+            return False
+        if self.next_time is None:
+            self.next_time = self.grid_time(time)
+        return time >= self.next_time
+
+    def grid_time(self, time):
+        """Return the first multiple of the period after time."""
+        return (math.floor(time / self.period) + 1) * self.period
+
+    def save(self, time, collector_state):
+        """
+        Save a checkpoint of the running simulation and delete the oldest beyond keep.
+
+        Args:
+        - time (float): Current simulation time (s).
+        - collector_state (dict): Picklable Python state needed to continue the run.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        name = os.path.join(self.directory, f"checkpoint_{time:012.2f}")
+        traci.simulation.saveState(name + ".xml.gz")
+        # Written last and atomically: its presence marks a complete checkpoint
+        with open(name + ".pkl.tmp", "wb") as file:
+            pickle.dump({"time": time, "state": collector_state}, file)
+        os.replace(name + ".pkl.tmp", name + ".pkl")
+        print(f"\nCheckpoint saved at {time}s")
+
+        for old in self.checkpoints()[:-self.keep]:
+            os.remove(old + ".pkl")
+            if os.path.isfile(old + ".xml.gz"):
+                os.remove(old + ".xml.gz")
+        self.next_time = self.grid_time(time)
+
+    def checkpoints(self):
+        """Return the complete checkpoints (paths without extension), oldest first."""
+        return [pickle_file[:-len(".pkl")] for pickle_file in sorted(glob.glob(os.path.join(self.directory, "checkpoint_*.pkl")))
+                if os.path.isfile(pickle_file[:-len(".pkl")] + ".xml.gz")]
+
+    def kept_output(self, output_file):
+        """Return where the output of the crashed run is kept while the run is resumed."""
+        return os.path.join(self.directory, "outputs", os.path.basename(output_file))
+
+    def keep_outputs(self):
+        """
+        Move the detector outputs of the crashed run into the checkpoint directory. Call
+        before SUMO starts the resumed run, since SUMO truncates them.
+        """
+        if not self.checkpoints():
+            return
+        os.makedirs(os.path.join(self.directory, "outputs"), exist_ok=True)
+        previous_resume = self.load_resume_time()
+        for output_file in self.output_files:
+            if not os.path.isfile(output_file):
+                continue
+            root_tag, intervals = read_intervals(output_file)
+            kept_file = self.kept_output(output_file)
+            if previous_resume is not None and os.path.isfile(kept_file):
+                # Resumed before: the kept output has the intervals up to that resume, this one those after it
+                intervals = join_intervals(read_intervals(kept_file)[1], intervals, previous_resume)
+            root = ET.Element(root_tag)
+            root.extend(intervals)
+            ET.ElementTree(root).write(kept_file)
+
+    def load_resume_time(self):
+        """Return the checkpoint time the last resume of this configuration started from, or None."""
+        resume_file = os.path.join(self.directory, "outputs", "resume_time")
+        if not os.path.isfile(resume_file):
+            return None
+        with open(resume_file) as file:
+            return float(file.read())
+
+    def merge_outputs(self):
+        """Put the intervals the crashed run wrote before the checkpoint in front of the resumed run's outputs. Call after SUMO closed."""
+        if self.resume_time is None:
+            return
+        for output_file in self.output_files:
+            kept_file = self.kept_output(output_file)
+            if os.path.isfile(kept_file) and os.path.isfile(output_file):
+                merge_interval_output(kept_file, output_file, self.resume_time)
+
+    def restore(self):
+        """
+        Load the latest complete checkpoint into the running simulation.
+
+        Returns:
+        - dict: The collector state saved with it, or None if there is no checkpoint (the run starts from 0).
+        """
+        for name in reversed(self.checkpoints()):
+            try:
+                with open(name + ".pkl", "rb") as file:
+                    checkpoint = pickle.load(file)
+            except (OSError, EOFError, pickle.UnpicklingError) as exc:
+                print(f"Skipping damaged checkpoint {name}: {exc!r}")
+                continue
+            traci.simulation.loadState(name + ".xml.gz")
+            self.resume_time = checkpoint["time"]
+            if os.path.isdir(os.path.join(self.directory, "outputs")):
+                with open(os.path.join(self.directory, "outputs", "resume_time"), "w") as file:
+                    file.write(repr(self.resume_time))
+            print(f"Resumed from checkpoint at {checkpoint['time']}s (approximately: SUMO does not restore the run bit for bit)")
+            return checkpoint["state"]
+        print("No checkpoint to resume from, starting at 0")
+        return None
+
+    def clear(self):
+        """Delete the checkpoints of this configuration, once the run has finished."""
+        shutil.rmtree(self.directory, ignore_errors=True)
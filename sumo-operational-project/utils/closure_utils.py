@@ -0,0 +1,136 @@
+import traci
+
+CLOSED_CLASS = "custom1"  # Given to the closed vehicle type while the closure is active, so lane permissions can single it out
+LANE_CHANGE_DURATION = 2  # s, how long each lane change request holds (repeated by the CommandCache while needed)
+
+class LaneClosure:
+    """
+    A closed segment of one lane for one vehicle type during a time window.
+
+    If the segment covers the whole lane the closure is a lane permission change: the type
+    gets CLOSED_CLASS, that class is disallowed on the lane while the closure is active, and
+    SUMO's lane change model does the merging. Other lanes with restricted permissions allow
+    CLOSED_CLASS exactly where they allow the type's own class, so the change only affects
+    the closed lane, and everything is restored when the closure ends. This costs TraCI calls
+    when the closure opens and closes and none in between. The lane must not be one the type
+    departs on (e.g. departLane="0" on E0_0 in the RSU flows): SUMO quits on the departure.
+
+    A permission always applies to the whole lane, so a closure of part of a lane is enforced
+    per vehicle instead: vehicles of the type on the lane from merge_distance before the
+    segment are asked to change lanes, and vehicles that reach the segment still on the lane
+    are stopped until they have merged. Membership comes from a VehicleRegistry and the
+    commands go through a CommandCache, so only the changes are sent.
+    """
+
+    def __init__(self, lane, start_pos, end_pos, begin, end=None, vehicle_type="CAV", merge_distance=0, target_lane=None):
+        """
+        Args:
+        - lane (str): Closed lane, e.g. "E0_0".
+        - start_pos (float): Start of the closed segment (m).
+        - end_pos (float): End of the closed segment (m).
+        - begin (float): Time the closure starts (s).
+        - end (float, optional): Time the closure ends (s); None keeps it closed until the end of the run.
+        - vehicle_type (str, optional): Closed for vehicles whose type contains this.
+        - merge_distance (float, optional): Distance before start_pos from which vehicles are asked to leave the lane (m).
+        - target_lane (int, optional): Lane index to merge into. Defaults to the next lane to the left.
+        """
+        self.lane = lane
+        self.start_pos = start_pos
+        self.end_pos = end_pos
+        self.begin = begin
+        self.end = end
+        self.vehicle_type = vehicle_type
+        self.merge_distance = merge_distance
+        self.target_lane = target_lane if target_lane is not None else int(lane.rsplit("_", 1)[1]) + 1
+        self.native = None  # Decided on the first call, when the lane length is known
+        self.active = False
+        self.disallowed = None  # Lane permissions before the closure (native mode)
+        self.allowed = {}  # {lane_id: allowed classes} of the other lanes changed for CLOSED_CLASS (native mode)
+        self.vehicle_class = None  # Class of the closed type before the closure (native mode)
+        self.stopped = set()
+
+    def is_active(self, time):
+        """Return True if the closure is in force at time."""
+        return self.begin <= time and (self.end is None or time < self.end)
+
+    def apply(self, time, registry, commands):
+        """Open or close the lane as scheduled and steer the affected vehicles. Call once per step."""
+        if self.native is None:
+            self.native = self.start_pos <= 0 and self.end_pos >= traci.lane.getLength(self.lane)
+
+        active = self.is_active(time)
+        if self.native:
+            if active and not self.active:
+                self.close_lane(registry)
+            elif self.active and not active:
+                self.open_lane(registry)
+        elif active:
+            self.steer(registry, commands)
+        elif self.active:
+            self.release(registry, commands)
+        self.active = active
+
+    def close_lane(self, registry):
+        """Disallow CLOSED_CLASS on the lane and move the closed vehicle type into that class."""
+        self.vehicle_class = traci.vehicletype.getVehicleClass(self.vehicle_type)
+        self.set_vehicle_class(registry, CLOSED_CLASS)
+
+        # Lanes with an allow list (empty means all classes) must treat CLOSED_CLASS like the type's own class
+        self.allowed = {}
+        for lane_id in traci.lane.getIDList():
+            if lane_id == self.lane:
+                continue
+            allowed = list(traci.lane.getAllowed(lane_id))
+            if allowed and (self.vehicle_class in allowed) != (CLOSED_CLASS in allowed):
+                self.allowed[lane_id] = allowed
+                if self.vehicle_class in allowed:
+                    traci.lane.setAllowed(lane_id, allowed + [CLOSED_CLASS])
+                else:
+                    traci.lane.setAllowed(lane_id, [vehicle_class for vehicle_class in allowed if vehicle_class != CLOSED_CLASS])
+
+        self.disallowed = list(traci.lane.getDisallowed(self.lane))
+        traci.lane.setDisallowed(self.lane, self.disallowed + [CLOSED_CLASS])
+
+    def open_lane(self, registry):
+        """Restore the type's class and the lane permissions from before the closure."""
+        self.set_vehicle_class(registry, self.vehicle_class)
+        for lane_id, allowed in self.allowed.items():
+            traci.lane.setAllowed(lane_id, allowed)
+        traci.lane.setDisallowed(self.lane, self.disallowed)
+
+    def set_vehicle_class(self, registry, vehicle_class):
+        """Set the class of the closed type and of the vehicles that have their own copy of it."""
+        # Vehicles with a per-vehicle type copy (e.g. CAV@veh after a SpeedZone's setMaxSpeed) do not follow the
+        # original type. The copy is made after departure, so the registry's cached type does not show it
+        traci.vehicletype.setVehicleClass(self.vehicle_type, vehicle_class)
+        for vehicle_id in registry.ids_with_type(self.vehicle_type):
+            if traci.vehicle.getTypeID(vehicle_id) != self.vehicle_type:
+                traci.vehicle.setVehicleClass(vehicle_id, vehicle_class)
+
+    def steer(self, registry, commands):
+        """Ask the vehicles approaching or inside the segment to merge, and hold those inside until they have."""
+        blocked = set()
+        for vehicle_id in registry.ids_with_type(self.vehicle_type):
+            if registry.lane(vehicle_id) != self.lane:
+                continue
+            position = registry.position(vehicle_id)
+            if self.start_pos - self.merge_distance <= position < self.end_pos:
+                commands.change_lane(vehicle_id, self.target_lane, LANE_CHANGE_DURATION)
+                if position >= self.start_pos:
+                    blocked.add(vehicle_id)
+
+        for vehicle_id in blocked - self.stopped:
+            commands.set_speed(vehicle_id, 0.0)
+        # Vehicles that merged (or left the network) are released once
+        for vehicle_id in self.stopped - blocked:
+            if vehicle_id in registry.values:
+                commands.set_speed(vehicle_id, -1)
+
+        self.stopped = blocked
+
+    def release(self, registry, commands):
+        """Let the vehicles still held by the closure drive on after it ended."""
+        for vehicle_id in self.stopped:
+            if vehicle_id in registry.values:
+                commands.set_speed(vehicle_id, -1)
+        self.stopped = set()
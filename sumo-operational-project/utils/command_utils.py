@@ -0,0 +1,78 @@
+import traci
+
+class CommandCache:
+    """
+    Write-through layer for vehicle setters that drops commands repeating the last value
+    sent for the same (vehicle, command).
+
+    setMaxSpeed and setSpeed keep their value until it is changed, so a repeat is always a
+    no-op. changeLane only holds for its duration, so a repeated request is sent again
+    one step before the previous one expires. Anything that changes the same variables
+    outside this cache has to go through it too (or call forget), otherwise the cached
+    value is stale.
+    """
+
+    def __init__(self, step_length=None):
+        self.step_length = step_length if step_length is not None else traci.simulation.getDeltaT()
+        self.time = None
+        self.last = {}        # {vehicle_id: {command: (args, time sent)}}
+        self.sent = {}        # {command: count}
+        self.suppressed = {}  # {command: count}
+
+    def step(self, time, arrived=()):
+        """Set the current simulation time and drop the entries of vehicles that left the network."""
+        self.time = time
+        for vehicle_id in arrived:
+            self.forget(vehicle_id)
+
+    def forget(self, vehicle_id):
+        """Drop all cached values of a vehicle."""
+        self.last.pop(vehicle_id, None)
+
+    def send(self, command, vehicle_id, *args, duration=None):
+        """
+        Call command(vehicle_id, *args) unless it repeats the last value sent.
+
+        Args:
+        - command (callable): TraCI vehicle setter.
+        - vehicle_id (str): Vehicle ID.
+        - *args: Setter arguments.
+        - duration (float, optional): How long the command holds (s); None if it holds until changed.
+
+        Returns:
+        - bool: True if the command was sent.
+        """
+        name = command.__name__
+        vehicle_commands = self.last.setdefault(vehicle_id, {})
+        cached = vehicle_commands.get(name)
+        if cached is not None and cached[0] == args:
+            if duration is None or (cached[1] is not None and self.time < cached[1] + duration - self.step_length):
+                self.suppressed[name] = self.suppressed.get(name, 0) + 1
+                return False
+
+        command(vehicle_id, *args)
+        vehicle_commands[name] = (args, self.time)
+        self.sent[name] = self.sent.get(name, 0) + 1
+        return True
+
+    def set_max_speed(self, vehicle_id, speed):
+        """Cached traci.vehicle.setMaxSpeed."""
+        return self.send(traci.vehicle.setMaxSpeed, vehicle_id, speed)
+
+    def set_speed(self, vehicle_id, speed):
+        """Cached traci.vehicle.setSpeed."""
+        return self.send(traci.vehicle.setSpeed, vehicle_id, speed)
+
+    def change_lane(self, vehicle_id, lane_index, duration):
+        """Cached traci.vehicle.changeLane, repeated before the request expires."""
+        return self.send(traci.vehicle.changeLane, vehicle_id, lane_index, duration, duration=duration)
+
+    def summary(self):
+        """Return a one-line count of sent and suppressed commands per setter."""
+        names = sorted(set(self.sent) | set(self.suppressed))
+        parts = [f"{name}: {self.sent.get(name, 0)} sent, {self.suppressed.get(name, 0)} suppressed" for name in names]
+        total_sent = sum(self.sent.values())
+        total_suppressed = sum(self.suppressed.values())
+        total = total_sent + total_suppressed
+        share = total_suppressed / total if total else 0.0
+        return f"Commands {total_sent} sent, {total_suppressed} suppressed ({share:.1%}); " + "; ".join(parts)
@@ -0,0 +1,77 @@
+import math
+
+import numpy as np
+import pandas as pd
+import traci
+from traci import constants as tc
+
+DATA_COLUMNS = ["Time (s)", "Detector ID", "Vehicle Count", "Density (veh/km)", "Scenario", "Seed"]
+
+class DensitySampler:
+    """
+    Vehicle counts of a fixed set of lane area detectors, sampled into a preallocated
+    time x detector array.
+
+    All detectors are subscribed once, so a sample is one getAllSubscriptionResults call
+    instead of one getLastStepVehicleNumber call per detector. Densities are computed from
+    each detector's own length when the array is written out.
+    """
+
+    def __init__(self, detector_ids, end_time, period=1.0):
+        """
+        Args:
+        - detector_ids (list): Lane area detector IDs, in output order.
+        - end_time (float): Last simulation time that will be sampled (s), sizes the array.
+        - period (float, optional): Sampling period (s).
+        """
+        self.detector_ids = list(detector_ids)
+        capacity = math.ceil(end_time / period) + 1
+        self.times = np.zeros(capacity)
+        self.counts = np.zeros((capacity, len(self.detector_ids)), dtype=np.int32)
+        self.lengths = None
+        self.size = 0
+
+    def subscribe(self):
+        """Subscribe the detectors on the running simulation and read their lengths. Call after every start or loaded state."""
+        for detector_id in self.detector_ids:
+            traci.lanearea.subscribe(detector_id, [tc.LAST_STEP_VEHICLE_NUMBER])
+        self.lengths = np.array([traci.lanearea.getLength(detector_id) for detector_id in self.detector_ids])
+
+    def sample(self, time):
+        """Store the vehicle counts of the current step as the row for time."""
+        results = traci.lanearea.getAllSubscriptionResults()
+        self.times[self.size] = time
+        self.counts[self.size] = [results[detector_id][tc.LAST_STEP_VEHICLE_NUMBER] for detector_id in self.detector_ids]
+        self.size += 1
+
+    def extend(self, times, counts):
+        """Append rows sampled elsewhere, e.g. in the run that simulated a shared prefix."""
+        rows = len(times)
+        self.times[self.size:self.size + rows] = times
+        self.counts[self.size:self.size + rows] = counts
+        self.size += rows
+
+    def to_dict(self):
+        """Return the sampled rows as a JSON-serialisable dict (see extend)."""
+        return {"times": self.times[:self.size].tolist(), "counts": self.counts[:self.size].tolist()}
+
+    def density(self):
+        """Return the sampled densities (veh/km) as a time x detector array."""
+        return self.counts[:self.size] / self.lengths * 1000
+
+    def to_frame(self, scenario, seed):
+        """Return the samples in the long DATA_COLUMNS layout, one row per time and detector."""
+        detectors = len(self.detector_ids)
+        return pd.DataFrame({
+            DATA_COLUMNS[0]: np.repeat(self.times[:self.size], detectors),
+            DATA_COLUMNS[1]: np.tile(self.detector_ids, self.size),
+            DATA_COLUMNS[2]: self.counts[:self.size].ravel(),
+            DATA_COLUMNS[3]: self.density().ravel(),
+            DATA_COLUMNS[4]: scenario,
+            DATA_COLUMNS[5]: seed,
+        })
+
+    def save(self, file_name):
+        """Write the samples as columns (time, detector_id, length, vehicle_count, density) to a compressed .npz file."""
+        np.savez_compressed(file_name, time=self.times[:self.size], detector_id=np.array(self.detector_ids),
+                            length=self.lengths, vehicle_count=self.counts[:self.size], density=self.density())
@@ -0,0 +1,158 @@
+import math
+import xml.etree.ElementTree as ET
+
+def write_interval_detectors(detectors_file, output_file, period, file_name):
+    """
+    Write a copy of an e1 detector file whose detectors aggregate into SUMO interval output.
+
+    Args:
+    - detectors_file (str): Original detector file (e1Detector elements).
+    - output_file (str): Interval output file of all detectors.
+    - period (float): Aggregation period (s).
+    - file_name (str): Path of the copy to write.
+
+    Returns:
+    - str: file_name.
+    """
+    tree = ET.parse(detectors_file)
+    for elem in tree.getroot().findall("e1Detector"):
+        elem.set("period", str(period))
+        elem.set("file", output_file)
+    tree.write(file_name)
+    return file_name
+
+def read_intervals(output_file):
+    """
+    Read the interval output of e1 detectors.
+
+    Returns:
+    - list: (begin, end, detector_id, vehicles entered, vehicles contributing, mean speed (m/s, -1 if none)) tuples.
+    """
+    intervals = []
+    for _, elem in ET.iterparse(output_file):
+        if elem.tag == "interval":
+            intervals.append((float(elem.get("begin")), float(elem.get("end")), elem.get("id"),
+                              int(elem.get("nVehEntered")), int(float(elem.get("nVehContrib"))), float(elem.get("speed"))))
+        elem.clear()
+    return intervals
+
+def aggregate_intervals(intervals, detector_ids, interval_start, time_interval):
+    """
+    Re-bin detector intervals into time_interval bins starting at interval_start.
+
+    Each output interval is assigned to the bin containing its midpoint, so the bins are
+    exact when the detector period divides time_interval and interval_start lies on an
+    output interval boundary, and otherwise shifted by at most half a period. Only bins
+    that the simulation completed are returned, like the per-step aggregation.
+
+    Args:
+    - intervals (list): Rows from read_intervals.
+    - detector_ids (list): Detectors in output order.
+    - interval_start (float): Start of the first bin (s); None returns no bins.
+    - time_interval (float): Bin length (s).
+
+    Returns:
+    - list: (bin start, detector_id, vehicles, mean speed (m/s)) tuples ordered by bin and detector.
+    """
+    if interval_start is None or not intervals:
+        return []
+
+    # Bins the simulation completed, allowing for the half-period shift
+    last_end = max(interval[1] for interval in intervals)
+    half_period = (intervals[0][1] - intervals[0][0]) / 2
+    completed_bins = math.floor((last_end + half_period - interval_start) / time_interval)
+
+    bins = {}  # {(bin, detector_id): [vehicles, speed sum, contributing vehicles]}
+    for begin, end, detector_id, entered, contributing, speed in intervals:
+        midpoint = (begin + end) / 2
+        if midpoint < interval_start:
+            continue
+        index = math.floor((midpoint - interval_start) / time_interval)
+        if index >= completed_bins:
+            continue
+        values = bins.setdefault((index, detector_id), [0, 0.0, 0])
+        values[0] += entered
+        if speed >= 0 and contributing:
+            values[1] += speed * contributing
+            values[2] += contributing
+
+    rows = []
+    for index in range(max(completed_bins, 0)):
+        for detector_id in detector_ids:
+            vehicles, speed_sum, contributing = bins.get((index, detector_id), (0, 0.0, 0))
+            rows.append((interval_start + index * time_interval, detector_id, vehicles,
+                         speed_sum / contributing if contributing else 0.0))
+    return rows
+
+DEFAULT_TRACKER_TTL = 10  # s a vehicle is remembered by a detector after it was last on it
+
+class DetectorTracker:
+    """
+    Finds the vehicles that newly arrived on each induction loop, with memory bounded by
+    the traffic of the last ttl seconds instead of every vehicle of the run.
+
+    Vehicle IDs are mapped to integers while the vehicle is in the network. Each detector
+    keeps the vehicles it saw within the last ttl seconds with the time they were last on
+    it, so a vehicle standing on the loop is never counted twice, and it is forgotten once
+    it has left. The integers are never reused, so a forgotten vehicle cannot be confused
+    with a later one.
+    """
+
+    def __init__(self, detector_ids, ttl=DEFAULT_TRACKER_TTL):
+        """
+        Args:
+        - detector_ids (list): Induction loop IDs.
+        - ttl (float, optional): Seconds a vehicle is remembered after it was last on a detector.
+        """
+        self.ttl = ttl
+        self.indices = {}  # {vehicle_id: int} of the vehicles in the network
+        self.next_index = 0
+        self.seen = {detector_id: {} for detector_id in detector_ids}  # {detector_id: {int: last seen time}}
+        self.next_prune = None
+
+    def index_of(self, vehicle_id):
+        """Return the integer of a vehicle, assigning the next one on first use."""
+        index = self.indices.get(vehicle_id)
+        if index is None:
+            index = self.indices[vehicle_id] = self.next_index
+            self.next_index += 1
+        return index
+
+    def new_vehicles(self, detector_id, vehicle_ids, time):
+        """
+        Record the vehicles on a detector in the current step.
+
+        Args:
+        - detector_id (str): Detector ID.
+        - vehicle_ids (list): Vehicles on the detector in the current step.
+        - time (float): Current simulation time (s).
+
+        Returns:
+        - list: The vehicles that were not on the detector within the last ttl seconds.
+        """
+        seen = self.seen[detector_id]
+        new = []
+        for vehicle_id in vehicle_ids:
+            index = self.index_of(vehicle_id)
+            last_seen = seen.get(index)
+            if last_seen is None or time - last_seen > self.ttl:
+                new.append(vehicle_id)
+            seen[index] = time
+        return new
+
+    def step(self, time, arrived=()):
+        """Forget the vehicles that left the network, and every ttl seconds those that left a detector (memory only, new_vehicles checks the ttl itself). Call once per step."""
+        for vehicle_id in arrived:
+            self.indices.pop(vehicle_id, None)
+
+        if self.next_prune is None:
+            self.next_prune = time + self.ttl
+        elif time >= self.next_prune:
+            for seen in self.seen.values():
+                for index in [index for index, last_seen in seen.items() if time - last_seen > self.ttl]:
+                    del seen[index]
+            self.next_prune = time + self.ttl
+
+    def size(self):
+        """Return the number of remembered (detector, vehicle) entries."""
+        return sum(len(seen) for seen in self.seen.values())
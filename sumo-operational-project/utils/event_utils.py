@@ -0,0 +1,109 @@
+from collections import deque
+
+import numpy as np
+import traci
+from traci import constants as tc
+
+from .vehicle_utils import VEHICLE_VARIABLES as REGISTRY_VARIABLES
+
+MS_TO_MPH = 2.23694
+
+# Registry variables needed by EventCapture; subscribe every vehicle to these
+VEHICLE_VARIABLES = REGISTRY_VARIABLES + [tc.VAR_ACCELERATION]
+
+TRAJECTORY_COLUMNS = ["Time (s)", "Vehicle ID", "Acceleration (m/s^2)", "Speed (mph)", "Position", "Lane",
+                      "Event Time (s)", "Scenario", "Seed"]
+
+class EventCapture:
+    """
+    Emergency brakes and collisions of one run, appended to the eb_log and collision_log
+    rows of the RSU output files.
+
+    Accelerations come from the VehicleRegistry subscription (all vehicles subscribed to
+    VEHICLE_VARIABLES), so a step costs one threshold comparison over an array instead of
+    getIDList plus one getAcceleration call per vehicle. Collisions are the ones SUMO
+    reports for the step.
+
+    With a trajectory window, the speeds and positions of a braking vehicle from window
+    seconds before to window seconds after each emergency brake go to trajectory_log.
+    """
+
+    def __init__(self, threshold, scenario, seed, eb_log, collision_log, trajectory_log=None, window=0):
+        """
+        Args:
+        - threshold (float): Accelerations below this are emergency brakes (m/s^2).
+        - scenario (str): Scenario name written to the rows.
+        - seed (int): Seed written to the rows.
+        - eb_log (list): Emergency brake rows are appended here.
+        - collision_log (list): Collision rows are appended here.
+        - trajectory_log (list, optional): Trajectory rows are appended here (TRAJECTORY_COLUMNS).
+        - window (float, optional): Trajectory window before and after each brake (s); 0 disables.
+        """
+        self.threshold = threshold
+        self.scenario = scenario
+        self.seed = seed
+        self.eb_log = eb_log
+        self.collision_log = collision_log
+        self.trajectory_log = trajectory_log
+        self.window = window if trajectory_log is not None else 0
+        self.history = None    # (time, values) of the last window steps
+        self.following = {}    # {vehicle_id: [event time, steps left to record]}
+
+    def update(self, time, registry):
+        """Record the emergency brakes and collisions of the current step. Call once per step after registry.update()."""
+        values = registry.values
+        vehicle_ids = list(values)
+        acceleration = np.fromiter((values[vehicle_id][tc.VAR_ACCELERATION] for vehicle_id in vehicle_ids),
+                                   dtype=float, count=len(vehicle_ids))
+        braking = [vehicle_ids[index] for index in np.flatnonzero(acceleration < self.threshold)]
+
+        for vehicle_id in braking:
+            vehicle = values[vehicle_id]
+            self.eb_log.append([time, vehicle_id, vehicle[tc.VAR_ACCELERATION], vehicle[tc.VAR_SPEED] * MS_TO_MPH,
+                                vehicle[tc.VAR_LANEPOSITION], self.scenario, self.seed])
+
+        for collision in traci.simulation.getCollisions():
+            self.collision_log.append([
+                time,
+                collision.collider,
+                collision.victim,
+                collision.colliderType,
+                collision.victimType,
+                collision.colliderSpeed * MS_TO_MPH,
+                collision.victimSpeed * MS_TO_MPH,
+                collision.lane,
+                collision.pos,
+                self.scenario,
+                self.seed
+            ])
+
+        if self.window:
+            self.record_trajectories(time, values, braking)
+
+    def record_trajectories(self, time, values, braking):
+        """Write the window around new emergency brakes and continue the windows still open."""
+        if self.history is None:
+            self.history = deque(maxlen=max(1, round(self.window / traci.simulation.getDeltaT())))
+
+        for vehicle_id in braking:
+            if vehicle_id in self.following:
+                continue  # Still inside the window of an earlier brake of the same vehicle
+            for past_time, past_values in self.history:
+                if vehicle_id in past_values:
+                    self.trajectory_row(past_time, vehicle_id, past_values[vehicle_id], time)
+            self.following[vehicle_id] = [time, self.history.maxlen + 1]
+
+        for vehicle_id, window in list(self.following.items()):
+            if vehicle_id in values:
+                self.trajectory_row(time, vehicle_id, values[vehicle_id], window[0])
+            window[1] -= 1
+            if window[1] <= 0 or vehicle_id not in values:
+                del self.following[vehicle_id]
+
+        self.history.append((time, values))
+
+    def trajectory_row(self, time, vehicle_id, vehicle, event_time):
+        """Append one trajectory sample of a vehicle."""
+        self.trajectory_log.append([time, vehicle_id, vehicle[tc.VAR_ACCELERATION], vehicle[tc.VAR_SPEED] * MS_TO_MPH,
+                                    vehicle[tc.VAR_LANEPOSITION], vehicle[tc.VAR_LANE_ID], event_time,
+                                    self.scenario, self.seed])
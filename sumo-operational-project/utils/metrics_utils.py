@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+
+MS_TO_MPH = 2.23694
+
+LOS_CLASSES = np.array(["A", "B", "C", "D", "E", "F"])
+# Inclusive upper V/C bounds of LOS A-E; E ends just below 1.0, so a V/C of 1.0 is F
+VC_BOUNDS = np.array([0.6, 0.7, 0.8, 0.9, np.nextafter(1.0, 0)])
+# Inclusive upper density bounds of LOS A-E (veh/mi/ln, HCM basic freeway segments)
+DENSITY_BOUNDS = np.array([11, 18, 26, 35, 45])
+
+DETECTOR_COLUMNS = ["time", "detector_id", "mean_speed", "flowrate", "LOS", "SPI", "time_interval",
+                    "interval_unique_vehicles", "scenario"]
+RATIO_COLUMNS = ["time", "edge", "SPR", "FR", "mean_speed_attack", "mean_speed_base", "flowrate_attack", "flowrate_base"]
+
+def classify(values, bounds):
+    """
+    Classify values into LOS bands by a binary search over the band bounds.
+
+    Args:
+    - values (array-like): Values to classify.
+    - bounds (array-like): Inclusive upper bounds of LOS A-E, ascending.
+
+    Returns:
+    - np.ndarray: LOS letters; values above the last bound, negative or NaN are "F".
+    """
+    values = np.asarray(values, dtype=float)
+    los = LOS_CLASSES[np.searchsorted(bounds, values, side="left")]
+    los[values < 0] = "F"
+    return los
+
+def los_from_vc(v_c_ratio):
+    """Return the LOS of each V/C ratio."""
+    return classify(v_c_ratio, VC_BOUNDS)
+
+def density(flowrate, mean_speed, lanes=1):
+    """
+    Return the density (veh/mi/ln) of each flow rate (veh/h) and mean speed (mph) over lanes.
+
+    The detector speeds are time-mean speeds, so this is an estimate of the space-mean density.
+    No flow gives 0, flow without a positive speed gives NaN (undefined).
+    """
+    flowrate, divisor = np.broadcast_arrays(np.asarray(flowrate, dtype=float), np.asarray(mean_speed, dtype=float) * lanes)
+    return np.divide(flowrate, divisor, out=np.where(flowrate > 0, np.nan, 0.0), where=divisor > 0)
+
+def los_from_density(density):
+    """Return the LOS of each density in veh/mi/ln; an undefined (NaN) density gives an empty LOS."""
+    density = np.asarray(density, dtype=float)
+    los = classify(density, DENSITY_BOUNDS)
+    los[np.isnan(density)] = ""
+    return los
+
+def spi(mean_speed, free_flow_speed):
+    """Return the Speed Performance Index of each mean speed (same units as free_flow_speed)."""
+    mean_speed = np.asarray(mean_speed, dtype=float)
+    return mean_speed / free_flow_speed if free_flow_speed > 0 else np.zeros_like(mean_speed)
+
+def detector_metrics(results, road_capacity, free_flow_speed):
+    """
+    Add flow rate, LOS and SPI to detector results.
+
+    Args:
+    - results (list): Detector result dicts (time, detector_id, mean_speed (mph), time_interval,
+      interval_unique_vehicles, scenario).
+    - road_capacity (float): Capacity of one lane (veh/h).
+    - free_flow_speed (float): Free-flow speed (mph).
+
+    Returns:
+    - pd.DataFrame: Detector results (DETECTOR_COLUMNS), with mean_speed, flowrate and SPI rounded to 2 decimals.
+    """
+    df = pd.DataFrame(results, columns=["time", "detector_id", "mean_speed", "time_interval",
+                                        "interval_unique_vehicles", "scenario"])
+    flowrate = df["interval_unique_vehicles"].to_numpy() * 3600 / df["time_interval"].to_numpy(dtype=float)
+    mean_speed = df["mean_speed"].to_numpy(dtype=float)
+
+    df["mean_speed"] = np.round(mean_speed, 2)
+    df["flowrate"] = np.round(flowrate, 2)
+    df["LOS"] = los_from_vc(flowrate / road_capacity)
+    df["SPI"] = np.round(spi(mean_speed, free_flow_speed), 2)
+    return df[DETECTOR_COLUMNS]
+
+def scenario_ratios(data):
+    """
+    Compare attack and base cross-section results.
+
+    Args:
+    - data (pd.DataFrame): Cross-section results of both scenarios (time, edge, lanes, mean_speed, flowrate, scenario).
+
+    Returns:
+    - pd.DataFrame: Speed (SPR) and flow (FR) ratios of attack over base per time and edge (RATIO_COLUMNS), rounded to 2 decimals.
+    """
+    merged = pd.merge(
+        data[data["scenario"] == "attack"],
+        data[data["scenario"] == "base"],
+        on=["time", "edge", "lanes"],
+        suffixes=("_attack", "_base"),
+    )
+    merged["SPR"] = merged["mean_speed_attack"] / merged["mean_speed_base"]
+    merged["FR"] = merged["flowrate_attack"] / merged["flowrate_base"]
+    return merged[RATIO_COLUMNS].round(2)
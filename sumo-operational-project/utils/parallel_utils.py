@@ -0,0 +1,102 @@
+import argparse
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+DEFAULT_BASE_PORT = 9000  # First TraCI port handed out to workers (8813 is left free for ad-hoc runs)
+
+def parse_run_args(default_workers=None):
+    """
+    Parse the command line options shared by the batch run scripts.
+
+    Args:
+    - default_workers (int, optional): Worker count when --workers is not given. Defaults to all cores.
+
+    Returns:
+    - argparse.Namespace: Parsed arguments with 'workers', 'base_port', 'seeds' (None if not given), 'force' and 'only_missing'.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=default_workers or os.cpu_count() or 1,
+                        help="Number of SUMO runs executed at the same time (1 runs serially in this process)")
+    parser.add_argument("--base-port", type=int, default=DEFAULT_BASE_PORT,
+                        help="TraCI port of the first run; every (scenario, seed) gets its own port after it")
+    parser.add_argument("--seeds", type=int, nargs="+",
+                        help="Run these seeds instead of the script's own, e.g. to repeat a batch with another setting")
+    cache = parser.add_mutually_exclusive_group()
+    cache.add_argument("--force", action="store_true",
+                       help="Simulate every run, even those completed before with the same inputs")
+    cache.add_argument("--only-missing", action="store_true",
+                       help="Only simulate runs whose outputs are missing, even if the inputs changed since")
+    return parser.parse_args()
+
+def build_jobs(scenarios, seeds, base_port=DEFAULT_BASE_PORT):
+    """
+    Expand scenarios and seeds into (scenario, seed, port) jobs.
+
+    The order matches the serial 'for scenario in scenarios: for seed in seeds:' loop,
+    and every job gets a unique TraCI port so workers never race for the same socket.
+    """
+    jobs = []
+    for scenario in scenarios:
+        for seed in seeds:
+            jobs.append((scenario, seed, base_port + len(jobs)))
+    return jobs
+
+def report_failure(scenario, seed, exc, failures):
+    """Print the traceback of a failed run and add it to failures, so the remaining runs still go ahead."""
+    traceback.print_exception(type(exc), exc, exc.__traceback__)
+    print(f"Run failed for scenario: {scenario}, seed: {seed}: {exc!r}")
+    failures.append((scenario, seed))
+
+def run_jobs(run_func, scenarios, seeds, workers=None, base_port=DEFAULT_BASE_PORT, skip=None):
+    """
+    Run every (scenario, seed) combination through run_func, in parallel where possible.
+
+    run_func is called as run_func(scenario, seed, port) and must start its own labelled
+    TraCI connection on that port and write its own output files. It has to be a
+    module-level function so that it can be sent to the worker processes.
+
+    Args:
+    - run_func (callable): Function that simulates one (scenario, seed) pair.
+    - scenarios (list): Scenario names.
+    - seeds (list): Random seeds.
+    - workers (int, optional): Number of worker processes. Defaults to the number of cores.
+    - base_port (int, optional): Port of the first job.
+    - skip (callable, optional): skip(scenario, seed) returns True for runs that need not be simulated again.
+
+    Returns:
+    - list: (scenario, seed) pairs whose run raised an exception, in the serial and the parallel path alike.
+    """
+    jobs = build_jobs(scenarios, seeds, base_port)
+    if skip:
+        # Filtered after numbering, so a run keeps its port whatever else is skipped
+        skipped = {(scenario, seed) for scenario, seed, _ in jobs if skip(scenario, seed)}
+        jobs = [job for job in jobs if job[:2] not in skipped]
+        if skipped:
+            print(f"Skipping {len(skipped)} completed simulations")
+    workers = min(workers or os.cpu_count() or 1, len(jobs)) if jobs else 1
+    failures = []
+
+    print(f"Running {len(jobs)} simulations on {workers} worker(s)")
+    start_time = time.time()
+
+    if workers <= 1:
+        # Serial fallback keeps sumo-gui runs and debugging in the main process
+        for scenario, seed, port in jobs:
+            try:
+                run_func(scenario, seed, port)
+            except Exception as exc:
+                report_failure(scenario, seed, exc, failures)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(run_func, scenario, seed, port): (scenario, seed) for scenario, seed, port in jobs}
+            for future in as_completed(futures):
+                scenario, seed = futures[future]
+                try:
+                    future.result()
+                except Exception as exc:
+                    report_failure(scenario, seed, exc, failures)
+
+    print(f"All runs finished in {time.time() - start_time:.2f} seconds, {len(failures)} failed.")
+    return failures
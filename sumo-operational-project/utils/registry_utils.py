@@ -0,0 +1,117 @@
+import hashlib
+import json
+import os
+import time
+import xml.etree.ElementTree as ET
+
+from .state_utils import file_lock, sumo_version, utils_files
+
+DEFAULT_REGISTRY_FILE = "runs.json"  # Completed runs of a batch folder, safe to delete to start over
+
+def config_files(sumo_config):
+    """Return a SUMO config file and the net, route and additional files it lists."""
+    directory = os.path.dirname(sumo_config)
+    files = [sumo_config]
+    for option in ("net-file", "route-files", "additional-files"):
+        for elem in ET.parse(sumo_config).getroot().iter(option):
+            files += [os.path.join(directory, name.strip()) for name in elem.get("value").split(",")]
+    return list(dict.fromkeys(files))
+
+def run_key(input_files, scenario, seed, params=None, binary="sumo"):
+    """
+    Hash the inputs that determine the outputs of one run.
+
+    Besides input_files this covers the utils modules the script imported (they decide
+    the outputs as much as the script) and the SUMO version, so a change to either
+    invalidates the completed runs.
+
+    Args:
+    - input_files (list): Config, net, route and additional files, and the script itself.
+    - scenario (str): Scenario name.
+    - seed (int): SUMO random seed.
+    - params (dict, optional): Scenario parameters set in the script (JSON-serialisable).
+    - binary (str, optional): SUMO binary the runs are started with.
+
+    Returns:
+    - str: Hex key identifying the run configuration.
+    """
+    digest = hashlib.sha1()
+    for path in list(input_files) + utils_files():
+        with open(path, "rb") as file:
+            digest.update(file.read())
+    digest.update(json.dumps([scenario, seed, params, sumo_version(binary)], sort_keys=True, default=str).encode())
+    return digest.hexdigest()[:16]
+
+class RunRegistry:
+    """
+    Record of the completed runs of a batch, so a rerun only simulates what is missing or
+    was run with other inputs.
+
+    A run is recorded by the worker after all its outputs are written, so a sweep that
+    crashed resumes with the runs that did not finish. Parallel workers share the file
+    through a lock and every write replaces it atomically.
+    """
+
+    def __init__(self, registry_file=DEFAULT_REGISTRY_FILE):
+        """
+        Args:
+        - registry_file (str, optional): JSON file holding the registry.
+        """
+        self.registry_file = registry_file
+
+    def load(self):
+        """Return the registry contents ({"seeds": [...], "runs": {name: entry}})."""
+        if not os.path.isfile(self.registry_file):
+            return {"seeds": [], "runs": {}}
+        with open(self.registry_file) as file:
+            return json.load(file)
+
+    def update(self, change):
+        """Apply change(contents) to the registry under the lock and write it back."""
+        directory = os.path.dirname(self.registry_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with file_lock(self.registry_file + ".lock"):
+            contents = self.load()
+            change(contents)
+            with open(self.registry_file + ".tmp", "w") as file:
+                json.dump(contents, file, indent=2)
+            os.replace(self.registry_file + ".tmp", self.registry_file)
+
+    def seeds(self, count=None):
+        """Return the seeds of the last sweep (empty if none, or if count is given and differs), so a resumed sweep keeps them."""
+        seeds = self.load()["seeds"]
+        return seeds if count is None or len(seeds) == count else []
+
+    def save_seeds(self, seeds):
+        """Remember the seeds of the current sweep."""
+        def set_seeds(contents):
+            contents["seeds"] = list(seeds)
+        self.update(set_seeds)
+
+    def is_complete(self, name, key, outputs, only_missing=False):
+        """
+        Check whether a run can be skipped.
+
+        Args:
+        - name (str): Run name, e.g. "attack_746".
+        - key (str): Key from run_key for the current inputs.
+        - outputs (list): Files the run writes.
+        - only_missing (bool, optional): Skip whenever the outputs exist, even if the run was recorded with other inputs or not at all.
+
+        Returns:
+        - bool: True if all outputs exist and, unless only_missing, the run was recorded with key.
+        """
+        if not all(os.path.isfile(output) for output in outputs):
+            return False
+        if only_missing:
+            return True
+        entry = self.load()["runs"].get(name)
+        return entry is not None and entry["key"] == key
+
+    def record(self, name, key, outputs, params=None):
+        """Record a completed run. Call after all its outputs are written."""
+        def add_run(contents):
+            contents["runs"][name] = {"key": key, "outputs": list(outputs), "params": params,
+                                      "completed": time.strftime("%Y-%m-%d %H:%M:%S")}
+        self.update(add_run)
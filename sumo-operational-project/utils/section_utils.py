@@ -0,0 +1,108 @@
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import pandas as pd
+
+from . import metrics_utils as mu
+
+# density and LOS_density come last, so rows of a run appended to a file written before they existed keep the old columns in place
+CROSS_SECTION_COLUMNS = ["time", "edge", "mean_speed", "flowrate", "LOS", "SPI", "lanes", "total_vehicles", "scenario",
+                         "density", "LOS_density"]
+
+def section_of(detector_id):
+    """Return the cross-section of a detector by excluding the middle part of its ID (e.g., E1_0_1000m -> E1_1000m)."""
+    parts = detector_id.split("_")
+    if len(parts) == 3:
+        return f"{parts[0]}_{parts[2]}"
+    return detector_id  # Fallback for unexpected formats
+
+def section_distance(section, pos):
+    """Return the distance of a cross-section from its name suffix (e.g., E1_1000m -> 1000), else the detector position."""
+    suffix = section.rsplit("_", 1)[-1]
+    if suffix.endswith("m"):
+        try:
+            return float(suffix[:-1])
+        except ValueError:
+            pass
+    return pos
+
+class CrossSections:
+    """
+    Cross-section topology of an e1 detector file: which detectors (one per lane) form
+    each cross-section, its lane count and its distance along the road.
+
+    Built once per run, so combining detector results is a single groupby over the result
+    table instead of a dict update per row and a scan of all detectors per new section.
+    """
+
+    def __init__(self, detectors_file):
+        """
+        Args:
+        - detectors_file (str): Detector file (e1Detector elements).
+        """
+        self.detector_ids = []
+        self.section_map = {}  # {detector_id: cross-section}
+        distances = {}
+        for elem in ET.parse(detectors_file).getroot().findall("e1Detector"):
+            detector_id = elem.get("id")
+            section = section_of(detector_id)
+            self.detector_ids.append(detector_id)
+            self.section_map[detector_id] = section
+            distances.setdefault(section, section_distance(section, float(elem.get("pos", 0))))
+
+        self.lanes = pd.Series(self.section_map).value_counts()  # {cross-section: lanes}
+        # Cross-sections ordered by distance, ties in detector file order
+        self.sections = sorted(distances, key=distances.get)
+        self.distances = pd.Series(distances)[self.sections]
+
+    def combine(self, results, time_interval, road_capacity, free_flow_speed, weighted=True):
+        """
+        Combine detector results into cross-section results for each time interval.
+
+        Args:
+        - results (list or pd.DataFrame): Detector results (time, detector_id, interval_unique_vehicles, mean_speed, scenario).
+        - time_interval (float): Interval length (s).
+        - road_capacity (float): Capacity of one lane (veh/h).
+        - free_flow_speed (float): Free-flow speed (mph) for SPI.
+        - weighted (bool, optional): Mean speed weighted by detector vehicle counts; False averages the detector speeds.
+
+        Returns:
+        - pd.DataFrame: Cross-section results (CROSS_SECTION_COLUMNS), ordered by time and distance. LOS is
+          from the V/C ratio, LOS_density from the density per lane (veh/mi/ln).
+        """
+        df = pd.DataFrame(results, columns=["time", "detector_id", "interval_unique_vehicles", "mean_speed", "scenario"])
+        if df.empty:
+            return pd.DataFrame(columns=CROSS_SECTION_COLUMNS)
+        df["edge"] = pd.Categorical(df["detector_id"].map(self.section_map), categories=self.sections)
+        df["weighted_speed"] = df["mean_speed"] * df["interval_unique_vehicles"]
+
+        grouped = df.groupby(["time", "edge"], sort=True, observed=True).agg(
+            total_vehicles=("interval_unique_vehicles", "sum"),
+            speed_sum=("weighted_speed", "sum"),
+            mean_speed=("mean_speed", "mean"),
+            scenario=("scenario", "first"),
+        ).reset_index()
+
+        total_vehicles = grouped["total_vehicles"].to_numpy()
+        if weighted:
+            mean_speed = np.divide(grouped["speed_sum"].to_numpy(), total_vehicles,
+                                   out=np.zeros(len(grouped)), where=total_vehicles > 0)
+        else:
+            mean_speed = grouped["mean_speed"].to_numpy()
+        lanes = self.lanes[grouped["edge"].astype(str)].to_numpy()
+        flowrate = total_vehicles * 3600 / time_interval
+        density = mu.density(flowrate, mean_speed, lanes)
+
+        return pd.DataFrame({
+            "time": grouped["time"],
+            "edge": grouped["edge"].astype(str),
+            "mean_speed": np.round(mean_speed, 2),
+            "flowrate": np.round(flowrate, 2),
+            "LOS": mu.los_from_vc(flowrate / (road_capacity * lanes)),
+            "SPI": np.round(mu.spi(mean_speed, free_flow_speed), 2),
+            "lanes": lanes,
+            "total_vehicles": total_vehicles,
+            "scenario": grouped["scenario"],
+            "density": np.round(density, 2),
+            "LOS_density": mu.los_from_density(density),
+        }, columns=CROSS_SECTION_COLUMNS)
@@ -0,0 +1,193 @@
+import fcntl
+import functools
+import gzip
+import hashlib
+import json
+import os
+import re
+import subprocess
+import sys
+import xml.etree.ElementTree as ET
+from contextlib import contextmanager
+
+import traci
+
+DEFAULT_STATE_DIR = "states"  # Cached prefix states, safe to delete at any time
+
+# Has to be on the command line of the run that saves the state, otherwise the branches
+# continue with fresh random number generators and are no longer reproducible
+SAVE_STATE_OPTIONS = ["--save-state.rng"]
+
+@functools.lru_cache(maxsize=None)
+def sumo_version(binary="sumo"):
+    """Return the version of a SUMO binary as a tuple, e.g. (1, 18, 0)."""
+    output = subprocess.run([binary, "--version"], capture_output=True, text=True, check=True).stdout
+    match = re.search(r"(\d+)[._](\d+)[._](\d+)", output.splitlines()[0] if output else "")
+    if match is None:
+        raise RuntimeError(f"Could not read the SUMO version from '{binary} --version'")
+    return tuple(int(part) for part in match.groups())
+
+def utils_files():
+    """Return the source files of the utils modules imported by the running script, sorted."""
+    utils_dir = os.path.dirname(os.path.abspath(__file__))
+    return sorted({os.path.abspath(module.__file__) for module in list(sys.modules.values())
+                   if getattr(module, "__file__", None) and os.path.dirname(os.path.abspath(module.__file__)) == utils_dir})
+
+def state_key(input_files, seed, prefix_time, binary="sumo"):
+    """
+    Hash the inputs that determine a simulation prefix.
+
+    The utils modules the script imported and the SUMO version are hashed as well, since a
+    state saved by another SUMO version cannot be loaded.
+
+    Args:
+    - input_files (list): Net, route and additional files the run is started with, and the script.
+    - seed (int): SUMO random seed (None if the seed is set in one of the hashed config files).
+    - prefix_time (float): Simulation time at which the state is saved.
+    - binary (str, optional): SUMO binary the runs are started with.
+
+    Returns:
+    - str: Hex key identifying the cached state.
+    """
+    digest = hashlib.sha1()
+    for path in list(input_files) + utils_files():
+        with open(path, "rb") as file:
+            digest.update(file.read())
+    digest.update(f"{seed}:{prefix_time}:{sumo_version(binary)}".encode())
+    return digest.hexdigest()[:16]
+
+def sidecar_file(state_file, suffix):
+    """Return the path of a file stored next to a cached state, e.g. the prefix detector output."""
+    return state_file[:-len(".xml.gz")] + suffix
+
+@contextmanager
+def file_lock(lock_file):
+    """Hold an exclusive lock on lock_file, so parallel workers build each prefix only once."""
+    with open(lock_file, "w") as handle:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+def get_prefix(key, build_prefix, state_dir=DEFAULT_STATE_DIR):
+    """
+    Return the cached state of a simulation prefix, simulating it first if needed.
+
+    build_prefix(state_file) has to start its own SUMO run (with SAVE_STATE_OPTIONS),
+    simulate the shared prefix, call save_state(state_file), close the run and return a
+    JSON-serialisable object with whatever it logged during the prefix. That object is
+    stored next to the state so that every branch gets the prefix rows as well.
+
+    Args:
+    - key (str): Key from state_key.
+    - build_prefix (callable): Function simulating the prefix, see above.
+    - state_dir (str, optional): Directory of the cache.
+
+    Returns:
+    - tuple: (state_file, prefix logs returned by build_prefix).
+    """
+    os.makedirs(state_dir, exist_ok=True)
+    state_file = os.path.join(state_dir, f"{key}.xml.gz")
+    logs_file = sidecar_file(state_file, ".json")
+
+    with file_lock(sidecar_file(state_file, ".lock")):
+        if not (os.path.isfile(state_file) and os.path.isfile(logs_file)):
+            print(f"Simulating shared prefix {key}")
+            logs = build_prefix(state_file)
+            # Written last and atomically: its presence marks a complete cache entry
+            with open(logs_file + ".tmp", "w") as file:
+                json.dump(logs, file)
+            os.replace(logs_file + ".tmp", logs_file)
+        else:
+            print(f"Reusing shared prefix {key}")
+
+    with open(logs_file) as file:
+        return state_file, json.load(file)
+
+def save_state(state_file, route_files=()):
+    """
+    Save the state of the running simulation.
+
+    SUMO 1.18 writes the period of exp() flows as a negative number (the rate, rounded)
+    that its own loadState rejects, so those periods are written back as they are given in
+    route_files. Flows that are not found there get exp() of the saved rate.
+
+    Args:
+    - state_file (str): State file (.xml or .xml.gz).
+    - route_files (list, optional): Route files defining the flows of the run.
+    """
+    traci.simulation.saveState(state_file)
+
+    periods = {}
+    for route_file in route_files:
+        for flow in ET.parse(route_file).getroot().iter("flow"):
+            if flow.get("period"):
+                periods[flow.get("id")] = flow.get("period")
+
+    def repair(match):
+        flow_id = re.search(r' id="([^"]*)"', match.group(0)).group(1)
+        return f'{match.group(1)}period="{periods.get(flow_id, f"exp({match.group(2)})")}"'
+
+    open_state = gzip.open if state_file.endswith(".gz") else open
+    with open_state(state_file, "rt") as file:
+        state = file.read()
+    repaired = re.sub(r'(<flowState [^>]*?)period="-([0-9.]+)"', repair, state)
+    if repaired != state:
+        with open_state(state_file, "wt") as file:
+            file.write(repaired)
+
+def load_state(state_file):
+    """
+    Continue the running simulation from a saved state.
+
+    If SUMO cannot read the state back (e.g. it was saved by another SUMO version), the run
+    is closed, so the caller can start it again and simulate the prefix as well.
+
+    Returns:
+    - bool: True if the state was loaded, False if SUMO rejected it (connection closed).
+    """
+    try:
+        traci.simulation.loadState(state_file)
+        return True
+    except (traci.exceptions.TraCIException, traci.exceptions.FatalTraCIError) as exc:
+        print(f"Could not load state {state_file}, simulating from 0: {exc}")
+    try:
+        traci.close()
+    except traci.exceptions.FatalTraCIError:
+        pass  # SUMO already quit
+    return False
+
+def join_intervals(prefix_intervals, branch_intervals, prefix_time):
+    """
+    Join the detector intervals of a run and of a branch started from its state at prefix_time.
+
+    A branch started from a saved state restarts its detector intervals one step after
+    prefix_time and first writes one interval from 0 up to there without counts. So the
+    run's intervals that began before prefix_time are kept (including one that straddles
+    it) and the branch's from prefix_time on.
+
+    Returns:
+    - list: Interval elements in time order.
+    """
+    return ([interval for interval in prefix_intervals if float(interval.get("begin")) < prefix_time]
+            + [interval for interval in branch_intervals if float(interval.get("begin")) >= prefix_time])
+
+def merge_interval_output(prefix_file, output_file, prefix_time):
+    """
+    Prepend the prefix intervals of a detector output file to a branch's output (see join_intervals).
+
+    Args:
+    - prefix_file (str): Interval output written by the prefix run.
+    - output_file (str): Interval output written by the branch, updated in place.
+    - prefix_time (float): Simulation time at which the branch started.
+    """
+    prefix_tree = ET.parse(prefix_file)
+    output_tree = ET.parse(output_file)
+    output_root = output_tree.getroot()
+
+    intervals = join_intervals(prefix_tree.getroot().findall("interval"), output_root.findall("interval"), prefix_time)
+    for interval in output_root.findall("interval"):
+        output_root.remove(interval)
+    output_root.extend(intervals)
+    output_tree.write(output_file)
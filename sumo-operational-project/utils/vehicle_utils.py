@@ -0,0 +1,83 @@
+import traci
+from traci import constants as tc
+
+# Variables subscribed for every tracked vehicle
+VEHICLE_VARIABLES = [tc.VAR_LANEPOSITION, tc.VAR_SPEED, tc.VAR_LANE_ID]
+
+class VehicleRegistry:
+    """
+    Vehicles currently in the network, kept up to date from the departed and arrived
+    lists of every step instead of polling getIDList.
+
+    The type of each vehicle is fetched once when it departs and indexed, so controllers
+    can loop over e.g. the CAVs only. Vehicles whose type contains subscribe_filter (all
+    vehicles if None) are subscribed to variables (VEHICLE_VARIABLES by default), and
+    their values for the current step come from one getAllSubscriptionResults call.
+    """
+
+    def __init__(self, subscribe_filter=None, variables=VEHICLE_VARIABLES):
+        self.subscribe_filter = subscribe_filter
+        self.variables = variables
+        self.types = {}     # {vehicle_id: type_id}
+        self.type_ids = {}  # {type_id: {vehicle_id: None}}, dicts keep departure order
+        self.values = {}    # {vehicle_id: {variable: value}} of the current step
+        self.arrived = []   # Vehicles that left the network in the last step
+        self.synced = False
+
+    def add(self, vehicle_id):
+        """Register a vehicle that entered the network."""
+        type_id = traci.vehicle.getTypeID(vehicle_id)
+        self.types[vehicle_id] = type_id
+        self.type_ids.setdefault(type_id, {})[vehicle_id] = None
+        if self.subscribe_filter is None or self.subscribe_filter in type_id:
+            traci.vehicle.subscribe(vehicle_id, self.variables)
+
+    def remove(self, vehicle_id):
+        """Forget a vehicle that left the network."""
+        type_id = self.types.pop(vehicle_id, None)
+        if type_id is not None:
+            self.type_ids[type_id].pop(vehicle_id, None)
+
+    def sync(self):
+        """Rebuild the registry from getIDList, e.g. right after a saved state was loaded."""
+        self.types.clear()
+        self.type_ids.clear()
+        for vehicle_id in traci.vehicle.getIDList():
+            self.add(vehicle_id)
+        self.synced = True
+
+    def update(self):
+        """Apply the departures and arrivals of the last step and fetch the subscribed values. Call once per step."""
+        if not self.synced:
+            self.sync()
+        else:
+            for vehicle_id in traci.simulation.getDepartedIDList():
+                self.add(vehicle_id)
+            self.arrived = traci.simulation.getArrivedIDList()
+            for vehicle_id in self.arrived:
+                self.remove(vehicle_id)
+        self.values = traci.vehicle.getAllSubscriptionResults()
+
+    def ids_with_type(self, type_substring):
+        """Return the vehicles whose type contains type_substring (e.g. "CAV" for CAV and CAV@xxx), in departure order."""
+        vehicle_ids = []
+        for type_id, ids in self.type_ids.items():
+            if type_substring in type_id:
+                vehicle_ids.extend(vehicle_id for vehicle_id in ids if vehicle_id in self.values)
+        return vehicle_ids
+
+    def type_of(self, vehicle_id):
+        """Return the cached type of a vehicle."""
+        return self.types[vehicle_id]
+
+    def position(self, vehicle_id):
+        """Return the lane position (m) of a subscribed vehicle in the current step."""
+        return self.values[vehicle_id][tc.VAR_LANEPOSITION]
+
+    def speed(self, vehicle_id):
+        """Return the speed (m/s) of a subscribed vehicle in the current step."""
+        return self.values[vehicle_id][tc.VAR_SPEED]
+
+    def lane(self, vehicle_id):
+        """Return the lane ID of a subscribed vehicle in the current step."""
+        return self.values[vehicle_id][tc.VAR_LANE_ID]
@@ -0,0 +1,73 @@
+MPH_TO_MS = 0.44704
+DEFAULT_MAX_SPEED = 55.56  # m/s, restored when a vehicle leaves a zone
+
+class SpeedZone:
+    """
+    A lane-position range on one edge with a time schedule of speed limits for one vehicle type.
+
+    Membership is tracked from the positions in a VehicleRegistry (one batched subscription),
+    so only the vehicles currently inside are kept as state. update() turns membership into
+    enter and exit events, and apply() only sends commands on those transitions and when the
+    scheduled limit changes, instead of setting every vehicle on every step.
+    """
+
+    def __init__(self, edge, start_pos, end_pos, schedule, vehicle_type="CAV", default_speed=DEFAULT_MAX_SPEED):
+        """
+        Args:
+        - edge (str): Edge the zone is on (all lanes).
+        - start_pos (float): Zone start (m), exclusive.
+        - end_pos (float): Zone end (m), exclusive.
+        - schedule (list): (begin, end, speed in mph) windows, active for begin < time <= end.
+        - vehicle_type (str, optional): Controlled vehicles have a type containing this.
+        - default_speed (float, optional): Max speed (m/s) restored on exit.
+        """
+        self.edge = edge
+        self.start_pos = start_pos
+        self.end_pos = end_pos
+        self.schedule = schedule
+        self.vehicle_type = vehicle_type
+        self.default_speed = default_speed
+        self.inside = set()
+        self.active_limit = None
+
+    def speed_at(self, time):
+        """Return the scheduled limit (m/s) at time, or None outside all windows."""
+        for begin, end, speed in self.schedule:
+            if begin < time <= end:
+                return speed * MPH_TO_MS
+        return None
+
+    def contains(self, registry, vehicle_id):
+        """Return True if the vehicle is inside the zone in the current step."""
+        return (registry.lane(vehicle_id).rsplit("_", 1)[0] == self.edge
+                and self.start_pos < registry.position(vehicle_id) < self.end_pos)
+
+    def update(self, registry):
+        """
+        Update the zone membership from the registry.
+
+        Returns:
+        - tuple: (entered, exited) sets of vehicle IDs; vehicles that left the network are not reported.
+        """
+        now_inside = {vehicle_id for vehicle_id in registry.ids_with_type(self.vehicle_type)
+                      if self.contains(registry, vehicle_id)}
+        entered = now_inside - self.inside
+        exited = {vehicle_id for vehicle_id in self.inside - now_inside if vehicle_id in registry.values}
+        self.inside = now_inside
+        return entered, exited
+
+    def apply(self, time, registry, commands):
+        """Update the zone and set max speeds on enter/exit and on schedule changes. Call once per step."""
+        entered, exited = self.update(registry)
+        limit = self.speed_at(time)
+        if limit is None:
+            # Outside the schedule nothing is enforced, vehicles keep their current max speed
+            self.active_limit = None
+            return
+
+        targets = self.inside if limit != self.active_limit else entered
+        self.active_limit = limit
+        for vehicle_id in targets:
+            commands.set_max_speed(vehicle_id, limit)
+        for vehicle_id in exited:
+            commands.set_max_speed(vehicle_id, self.default_speed)
@@ -0,0 +1,117 @@
+"""
+Compares simulation steps per second of the traci (socket) and libsumo (in-process) backends.
+
+Every (input, backend) pair runs in its own Python process, because traci picks its
+implementation once when it is first imported. Each run goes through su.setup_sumo and
+su.run_simulation with a representative observer set: the batched subscription snapshot
+plus a per-vehicle getter loop, which is where the socket round trips of the traci backend
+add up. A run without observers is included as the bare stepping baseline.
+
+Usage:
+    python benchmark_backends.py --end 1800
+    python benchmark_backends.py --inputs fivebyfive --backends libsumo --output benchmark.csv
+"""
+import argparse
+import csv
+import json
+import subprocess
+import sys
+import time
+
+INPUTS = {
+    'fivebyfive': 'data/fivebyfive-1/inputs/fivebyfive.sumocfg',
+    'dublin-cc': 'data/dublin-cc/inputs/DCC_simulation.sumo.cfg',
+}
+BACKENDS = ['traci', 'libsumo']
+WORKLOADS = ['step', 'observers']
+
+def run_worker(backend, sumo_config_file, end_time, workload):
+    """Run one simulation on the given backend and print its timing as a JSON line."""
+    from utils import backend_utils as bu
+    bu.select_backend(backend)
+
+    import traci
+    from utils import sumo_utils as su
+    from utils import subscription_utils as subu
+
+    step_count = [0]
+
+    def count_steps():
+        step_count[0] += 1
+
+    def observe():
+        # Same access pattern as the data collection observers: one batched snapshot
+        # plus individual getters for every vehicle
+        step = traci.simulation.getTime()
+        subu.get_snapshot(step)
+        for vehicle_id in traci.vehicle.getIDList():
+            traci.vehicle.getSpeed(vehicle_id)
+            traci.vehicle.getLaneID(vehicle_id)
+
+    su.setup_sumo(sumo_gui=False, sumo_config_file=sumo_config_file)
+    su.register_observer(count_steps)
+    if workload == 'observers':
+        su.register_observer(observe)
+
+    start_time = time.perf_counter()
+    su.run_simulation(end_time)
+    runtime = time.perf_counter() - start_time
+
+    print(json.dumps({'backend': 'libsumo' if bu.is_libsumo() else 'traci',
+                      'steps': step_count[0], 'runtime': runtime}))
+
+def run_benchmark(inputs, backends, end_time):
+    """Run every input, backend and workload combination in a separate process and collect the results."""
+    results = []
+    for input_name in inputs:
+        for workload in WORKLOADS:
+            for backend in backends:
+                cmd = [sys.executable, __file__, '--worker', '--backends', backend, '--inputs', input_name,
+                       '--end', str(end_time), '--workload', workload]
+                completed = subprocess.run(cmd, capture_output=True, text=True)
+                if completed.returncode != 0:
+                    print(f"{input_name} / {backend} / {workload} failed:\n{completed.stderr}")
+                    continue
+
+                # The worker's result is the last line it prints, SUMO may print before it
+                result = json.loads(completed.stdout.strip().splitlines()[-1])
+                if result['backend'] != backend:
+                    print(f"{input_name} / {backend} / {workload}: ran on {result['backend']}, is {backend} installed?")
+                    continue
+
+                steps_per_second = result['steps'] / result['runtime'] if result['runtime'] > 0 else 0
+                results.append({'input': input_name, 'workload': workload, 'backend': backend,
+                                'steps': result['steps'], 'runtime': round(result['runtime'], 3),
+                                'steps_per_second': round(steps_per_second, 1)})
+                print(f"{input_name:<12} {workload:<10} {backend:<8} {result['steps']:>7} steps "
+                      f"{result['runtime']:>9.2f} s {steps_per_second:>10.1f} steps/s")
+    return results
+
+def print_speedups(results):
+    """Print the libsumo speed-up over traci for every input and workload."""
+    rates = {(r['input'], r['workload'], r['backend']): r['steps_per_second'] for r in results}
+    for (input_name, workload, backend), rate in rates.items():
+        if backend == 'libsumo' and rates.get((input_name, workload, 'traci')):
+            print(f"{input_name} / {workload}: libsumo is {rate / rates[(input_name, workload, 'traci')]:.2f}x traci")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--inputs', nargs='+', choices=list(INPUTS), default=list(INPUTS))
+    parser.add_argument('--backends', nargs='+', choices=BACKENDS, default=BACKENDS)
+    parser.add_argument('--end', type=int, default=1800, help="Simulation end time (s) of every run")
+    parser.add_argument('--output', help="Optional CSV file for the results")
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--workload', choices=WORKLOADS, default='observers', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.backends[0], INPUTS[args.inputs[0]], args.end, args.workload)
+    else:
+        results = run_benchmark(args.inputs, args.backends, args.end)
+        print_speedups(results)
+        if args.output and results:
+            with open(args.output, 'w', newline='') as file:
+                writer = csv.DictWriter(file, fieldnames=list(results[0]))
+                writer.writeheader()
+                writer.writerows(results)
+            print(f"Results saved to {args.output}")
@@ -6,24 +6,29 @@ If ego breakdown feature is enabled, it also registers observers to stop egos an
 After running the simulation, it writes the edges near stopped egos to a file.
 Finally, it post-processes simulation results including plotting and visualization.
 """
+import configparser
+from utils import backend_utils as bu
+
+# Read settings from config.ini
+config = configparser.ConfigParser()
+config.read('config.ini')
+
+# The backend has to be chosen before any module imports traci
+SUMO_GUI = config.getboolean('Simulation', 'sumo_gui')
+BACKEND = bu.select_backend(config.get('Simulation', 'backend', fallback='traci'), SUMO_GUI) # 'traci' (socket) or 'libsumo' (in-process, no GUI)
+
 from utils import sumo_utils as su
 from utils import vehicle_utils as vu
 from utils import visualization_utils as visu
 from utils import data_utils as du
 from utils import detector_utils as detu
-import configparser
 import sumolib
 import traci
 
-# Read settings from config.ini
-config = configparser.ConfigParser()
-config.read('config.ini')
-
 # Simulation settings
 EDGE_DETECTION = config.getboolean('Simulation', 'edge_detection') # this is a new setting for edge detection only
 
 SCENARIO = config['Simulation']['scenario']
-SUMO_GUI = config.getboolean('Simulation', 'sumo_gui')
 WARMUP_TIME = int(config['Simulation']['warmup_time'])
 SIMULATION_END_TIME = int(config['Simulation']['end_time'])
 RADIUS = int(config['Simulation']['radius'])
@@ -34,6 +39,14 @@ ego_BREAKDOWN_TIME = int(config['Simulation']['ego_breakdown_time'])
 ego_BREAKDOWN_DURATION = int(config['Simulation']['ego_breakdown_duration'])
 ego_TYPE = config['Simulation']['ego_type']
 PARTIAL_INCLUSION = config.getboolean('Simulation', 'partial_edge_inclusion')
+DETECTOR_MODE = config.get('Simulation', 'detector_mode', fallback='python') # 'python' (virtual detectors) or 'native' (SUMO E1/E2)
+DETECTOR_PERIOD = config.getint('Simulation', 'detector_period', fallback=300) # aggregation period of native detectors
+METRICS_PERIOD = config.getint('Simulation', 'metrics_period', fallback=0) # sample lane metrics every n seconds (0 = every step)
+UPSTREAM_PERIOD = config.getint('Simulation', 'upstream_period', fallback=5) # recompute the upstream area of stopped egos every n seconds (0 disables)
+PROFILE = config.getboolean('Simulation', 'profile', fallback=False) # time every observer and write a JSON profile
+CPROFILE_OBSERVER = config.get('Simulation', 'cprofile_observer', fallback='') # observer name to run under cProfile
+CPROFILE_START = config.getint('Simulation', 'cprofile_start', fallback=0)
+CPROFILE_END = config.getint('Simulation', 'cprofile_end', fallback=SIMULATION_END_TIME)
 
 # Files settings
 PROJECT = config['Files']['Project']
@@ -45,7 +58,8 @@ CONFIG_FILE = config['Files']['Config_File_Path'] # read the value of the "Confi
 PLOT_SMOOTHING = config.getboolean('Visualization', 'Smoothing')
 PLOT_INTERVAL = int(config['Visualization']['Interval'])
 
-accumulated_data = {}
+virtual_detectors = None
+native_detector_map = None
 
 # print to terminal to identify attack/ baseline scenario
 if EDGE_DETECTION:
@@ -57,10 +71,27 @@ else:
     else:
         print("Running baseline scenario")
         BASELINE_SCENARIO = True
+FILENAME_PREFIX = 'attack_' if ego_BREAKDOWN_ENABLED else 'base_'
+
+def load_detectors() -> dict:
+    """Calculates the detector positions on the upstream edges and saves them to detectors.xml."""
+    edge_ids = detu.get_edge_ids_from_xml(f'data/{PROJECT}/outputs/{SCENARIO}/upstream_edges.xml')
+    detectors = detu.calculate_detector_positions(net, edge_ids, 50) 
+    detu.save_detectors_to_xml(detectors, scenario=SCENARIO, project=PROJECT) 
+    return detectors
 
 def setup_simulation() -> None:
     """Initializes the SUMO environment."""
-    su.setup_sumo(sumo_gui=SUMO_GUI, sumo_config_file=CONFIG_FILE)
+    global native_detector_map
+    additional_files = []
+
+    # In native detector mode SUMO measures the detectors itself from a generated additional file
+    if not EDGE_DETECTION and DETECTOR_MODE == 'native':
+        additional_file, native_detector_map = detu.save_detectors_as_additional(
+            load_detectors(), net, scenario=SCENARIO, project=PROJECT, period=DETECTOR_PERIOD, prefix=FILENAME_PREFIX)
+        additional_files.append(additional_file)
+
+    su.setup_sumo(sumo_gui=SUMO_GUI, sumo_config_file=CONFIG_FILE, additional_files=additional_files)
 
 def run_main_simulation() -> None:
     """
@@ -70,15 +101,21 @@ def run_main_simulation() -> None:
     If ego breakdown feature is enabled, it also registers observers to stop egos and identify nearby edges.
     After running the simulation, it writes the edges near stopped egos to a file.
     """
+    global virtual_detectors
     nearby_edges = set()
+
+    if PROFILE:
+        profile_prefix = 'edge_detection_' if EDGE_DETECTION else FILENAME_PREFIX
+        su.enable_profiling(f'data/{PROJECT}/outputs/{SCENARIO}/{profile_prefix}profile.json',
+                            cprofile_observer=CPROFILE_OBSERVER or None, cprofile_start=CPROFILE_START, cprofile_end=CPROFILE_END)
     
 
     # Egde detection only
     if EDGE_DETECTION:
         
         # Register observer for edge detection
-        su.register_observer(lambda: vu.stop_all_egos_at_current_position(ego_BREAKDOWN_TIME, ego_BREAKDOWN_TIME + 60, ego_TYPE))
-        su.register_observer(lambda: nearby_edges.update(vu.get_edges_near_stopped_egos(RADIUS, ego_TYPE)))
+        su.register_observer(lambda: vu.stop_all_egos_at_current_position(ego_BREAKDOWN_TIME, ego_BREAKDOWN_TIME + 60, ego_TYPE), start=ego_BREAKDOWN_TIME, name='stop_all_egos')
+        su.register_observer(lambda: nearby_edges.update(vu.get_edges_near_stopped_egos(RADIUS, ego_TYPE, net)), start=ego_BREAKDOWN_TIME, name='edges_near_stopped_egos')
     
         # Run the simulation
         su.run_simulation(ego_BREAKDOWN_TIME + 60) # run for 60 seconds after the ego breakdown
@@ -98,23 +135,31 @@ def run_main_simulation() -> None:
 
     else:
     
+        # Flush the buffered CSV outputs when the simulation closes
+        su.register_close_handler(du.csv_sink.close)
+
         # Register common observer for both cases
-        su.register_observer(lambda: du.collect_and_save_mean_speeds(radius=RADIUS, warmup_time=WARMUP_TIME, baseline=BASELINE_SCENARIO, scenario=SCENARIO, project=PROJECT))
-        su.register_observer(lambda: du.collect_and_save_vehicle_count(radius=RADIUS, warmup_time=WARMUP_TIME, baseline=BASELINE_SCENARIO, scenario=SCENARIO, project=PROJECT))
-        su.register_observer(lambda: du.collect_and_save_mean_edge_delays_over_simulation(radius=RADIUS, warmup_time=WARMUP_TIME, baseline=BASELINE_SCENARIO, last_sim_step=SIMULATION_END_TIME, scenario=SCENARIO, project=PROJECT, ego_type=ego_TYPE))
-        su.register_observer(lambda: du.collect_and_save_lane_metrics(radius=RADIUS, warmup_time=WARMUP_TIME, last_sim_step=SIMULATION_END_TIME, baseline=BASELINE_SCENARIO, scenario=SCENARIO, input_capacity=CAPACITY_PER_HOUR, project=PROJECT))
-        su.register_observer(lambda: du.get_gridlocked_edges(stop_time=ego_BREAKDOWN_TIME, warmup_time=WARMUP_TIME, scenario=SCENARIO, project=PROJECT))
-        su.register_observer(lambda: detu.simulate_detectors(detectors, accumulated_data, traci.simulation.getTime()))
+        su.register_observer(lambda: du.collect_and_save_mean_speeds(radius=RADIUS, warmup_time=WARMUP_TIME, baseline=BASELINE_SCENARIO, scenario=SCENARIO, project=PROJECT), start=WARMUP_TIME, name='mean_speeds')
+        su.register_observer(lambda: du.collect_and_save_vehicle_count(radius=RADIUS, warmup_time=WARMUP_TIME, baseline=BASELINE_SCENARIO, scenario=SCENARIO, project=PROJECT), start=WARMUP_TIME, name='vehicle_count')
+        su.register_observer(lambda: du.collect_and_save_mean_edge_delays_over_simulation(radius=RADIUS, warmup_time=WARMUP_TIME, baseline=BASELINE_SCENARIO, last_sim_step=SIMULATION_END_TIME, scenario=SCENARIO, project=PROJECT, ego_type=ego_TYPE), start=WARMUP_TIME, name='edge_delays')
+        su.register_observer(lambda: du.collect_and_save_lane_metrics(radius=RADIUS, warmup_time=WARMUP_TIME, last_sim_step=SIMULATION_END_TIME, baseline=BASELINE_SCENARIO, scenario=SCENARIO, input_capacity=CAPACITY_PER_HOUR, project=PROJECT),
+                             start=WARMUP_TIME, period=METRICS_PERIOD, phase=SIMULATION_END_TIME, name='lane_metrics') # phase keeps the last step, where the means are saved
+        su.register_observer(lambda: du.get_gridlocked_edges(stop_time=ego_BREAKDOWN_TIME, warmup_time=WARMUP_TIME, scenario=SCENARIO, project=PROJECT), start=WARMUP_TIME, name='gridlocked_edges')
+        if DETECTOR_MODE != 'native':
+            su.register_observer(lambda: virtual_detectors.update(traci.simulation.getTime()), name='virtual_detectors')
 
         if ego_BREAKDOWN_ENABLED:
             # Register observers for stopping egos and identifying nearby edges
-            su.register_observer(lambda: vu.stop_all_egos_at_current_position(ego_BREAKDOWN_TIME, ego_BREAKDOWN_DURATION, ego_TYPE))
+            su.register_observer(lambda: vu.stop_all_egos_at_current_position(ego_BREAKDOWN_TIME, ego_BREAKDOWN_DURATION, ego_TYPE), start=ego_BREAKDOWN_TIME, name='stop_all_egos')
+            if UPSTREAM_PERIOD:
+                # Single-pass search from all stopped egos, rerun as they stop and drive off again
+                su.register_observer(lambda: du.collect_and_save_upstream_area(ego_TYPE, net, distance_limit=UPSTREAM, partial_inclusion=PARTIAL_INCLUSION, baseline=BASELINE_SCENARIO, scenario=SCENARIO, project=PROJECT),
+                                     start=ego_BREAKDOWN_TIME, period=UPSTREAM_PERIOD, name='upstream_area')
             # su.register_observer(lambda: nearby_edges.update(vu.get_edges_near_stopped_egos(RADIUS)))
 
-        # Adding detectors
-        edge_ids = detu.get_edge_ids_from_xml(f'data/{PROJECT}/outputs/{SCENARIO}/upstream_edges.xml')
-        detectors = detu.calculate_detector_positions(net, edge_ids, 50) 
-        detu.save_detectors_to_xml(detectors, scenario=SCENARIO, project=PROJECT) 
+        # Adding detectors (native detectors were already loaded into SUMO by setup_simulation)
+        if DETECTOR_MODE != 'native':
+            virtual_detectors = detu.VirtualDetectorArray(load_detectors(), SIMULATION_END_TIME, traci.simulation.getDeltaT())
 
         # Run the simulation
         su.run_simulation(SIMULATION_END_TIME)
@@ -126,10 +171,15 @@ def run_main_simulation() -> None:
 def post_process_results() -> None: 
     """Post-processes simulation results including plotting and visualization."""
     if not EDGE_DETECTION:
-        if ego_BREAKDOWN_ENABLED:
-            detu.write_detector_data_to_csv(accumulated_data, f'data/{PROJECT}/outputs/{SCENARIO}/attack_detector_data.csv')
+        output_filename = f'data/{PROJECT}/outputs/{SCENARIO}/{FILENAME_PREFIX}detector_data.csv'
+        if DETECTOR_MODE == 'native':
+            output_directory = f'data/{PROJECT}/outputs/{SCENARIO}'
+            accumulated_data = detu.read_native_detector_data(native_detector_map,
+                                                              f'{output_directory}/{FILENAME_PREFIX}e1_output.xml',
+                                                              f'{output_directory}/{FILENAME_PREFIX}e2_output.xml')
+            detu.write_detector_data_to_csv(accumulated_data, output_filename)
         else:
-            detu.write_detector_data_to_csv(accumulated_data, f'data/{PROJECT}/outputs/{SCENARIO}/base_detector_data.csv')
+            virtual_detectors.write_to_csv(output_filename)
 
 if __name__ == '__main__':
     setup_simulation()
@@ -1,8 +1,20 @@
+import argparse
+import ast
 import configparser
+import functools
+import hashlib
+import json
 import subprocess
 import time
 import shutil
 import os
+import xml.etree.ElementTree as ET
+
+REGISTRY_FILE = 'run_registry.json'  # Completed runs of a scenario folder, safe to delete to rerun everything
+# Options that do not change the outputs of a run
+UNHASHED_OPTIONS = {'sumo_gui', 'backend', 'profile', 'cprofile_observer', 'cprofile_start', 'cprofile_end'}
+# Options edge detection depends on (it stops the egos and searches the network around them)
+EDGE_DETECTION_OPTIONS = ['scenario', 'ego_breakdown_time', 'radius', 'upstream', 'ego_type', 'partial_edge_inclusion']
 
 def run_simulation(config):
     # Update the 'config.ini' file with new settings
@@ -22,9 +34,118 @@ def run_simulation(config):
         return
 
     start_time = time.time()
-    subprocess.run(['python', main_py_path])
+    result = subprocess.run(['python', main_py_path])
     end_time = time.time()
     print(f"Scenario time taken: {end_time - start_time} seconds")
+    return result.returncode == 0
+
+def output_dir(config):
+    return f"data/{config['Files']['Project']}/outputs/{config['Simulation']['Scenario']}"
+
+def run_name(config):
+    # Same naming as main.py: edge detection, or the attack/ base run
+    if config.getboolean('Simulation', 'Edge_Detection'):
+        return 'edge_detection'
+    return 'attack' if config.getboolean('Simulation', 'ego_Breakdown_Enabled') else 'base'
+
+def run_outputs(config):
+    # Files main.py writes last in each mode, so their presence marks a finished run
+    name = run_name(config)
+    if name == 'edge_detection':
+        files = ['upstream_edges.xml', 'upstream_edge_tags.xml', 'stopped_vehicles.csv', 'radius_edges.xml']
+    else:
+        files = [f'{name}_detector_data.csv']
+    return [os.path.join(output_dir(config), file) for file in files]
+
+def utils_files(script, utils_dir='utils'):
+    # The utils modules a script imports, directly or through other utils modules
+    files, pending = set(), [script]
+    while pending:
+        path = pending.pop()
+        for node in ast.walk(ast.parse(open(path).read(), path)):
+            if not isinstance(node, ast.ImportFrom):
+                continue
+            if node.module == 'utils' and node.level == 0 or node.module is None and node.level == 1:
+                names = [alias.name for alias in node.names]
+            elif node.level == 1 or node.level == 0 and node.module.startswith('utils.'):
+                names = [node.module.split('.')[-1]]
+            else:
+                continue
+            for name in names:
+                module_file = os.path.join(utils_dir, name + '.py')
+                if os.path.isfile(module_file) and module_file not in files:
+                    files.add(module_file)
+                    pending.append(module_file)
+    return sorted(files)
+
+@functools.lru_cache(maxsize=None)
+def sumo_version():
+    # First line of 'sumo --version' for the binary main.py starts (see sumo_utils.setup_sumo)
+    virtual_env = os.environ.get('VIRTUAL_ENV')
+    binary = os.path.join(virtual_env, 'bin', 'sumo') if virtual_env else os.path.join('/home/don/.local/bin', 'sumo')
+    if not os.path.exists(binary):
+        binary = 'sumo'
+    try:
+        output = subprocess.run([binary, '--version'], capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    return output.splitlines()[0] if output else 'unknown'
+
+def run_inputs(config):
+    # main.py and the utils modules it imports, the SUMO config and the net, route and additional files it lists
+    sumo_config = config['Files']['Config_File_Path']
+    files = ['main.py'] + utils_files('main.py') + [sumo_config, config['Files']['Net_File_Path']]
+    for option in ('net-file', 'route-files', 'additional-files'):
+        for elem in ET.parse(sumo_config).getroot().iter(option):
+            files += [os.path.join(os.path.dirname(sumo_config), name.strip()) for name in elem.get('value').split(',')]
+    if run_name(config) != 'edge_detection':
+        # The detectors are placed on the edges found by edge detection
+        files.append(os.path.join(output_dir(config), 'upstream_edges.xml'))
+    return list(dict.fromkeys(files))
+
+def run_key(config):
+    # Hash of the input files, the SUMO version and the options the run depends on
+    if run_name(config) == 'edge_detection':
+        options = {option: config['Simulation'][option] for option in EDGE_DETECTION_OPTIONS}
+    else:
+        options = {option: value for option, value in config['Simulation'].items() if option not in UNHASHED_OPTIONS}
+    options['project'] = config['Files']['Project']
+    options['sumo_version'] = sumo_version()
+
+    digest = hashlib.sha1()
+    for path in run_inputs(config):
+        if os.path.isfile(path):
+            with open(path, 'rb') as file:
+                digest.update(file.read())
+        else:
+            digest.update(f'missing:{path}'.encode())
+    digest.update(json.dumps(options, sort_keys=True).encode())
+    return digest.hexdigest()[:16]
+
+def load_registry(config):
+    registry_path = os.path.join(output_dir(config), REGISTRY_FILE)
+    if not os.path.exists(registry_path):
+        return {}
+    with open(registry_path) as file:
+        return json.load(file)
+
+def record_run(config, key):
+    # Written after each run, so a sweep that crashed resumes with the runs that did not finish
+    registry = load_registry(config)
+    registry[run_name(config)] = {'key': key, 'completed': time.strftime('%Y-%m-%d %H:%M:%S')}
+    registry_path = os.path.join(output_dir(config), REGISTRY_FILE)
+    with open(registry_path + '.tmp', 'w') as file:
+        json.dump(registry, file, indent=2)
+    os.replace(registry_path + '.tmp', registry_path)
+
+def is_complete(config, key, only_missing=False):
+    # All outputs exist and, unless only_missing, the run was recorded with the same inputs
+    if not all(os.path.exists(path) for path in run_outputs(config)):
+        return False
+    if only_missing:
+        return True
+    entry = load_registry(config).get(run_name(config))
+    return entry is not None and entry['key'] == key
 
 def save_config_file(config_file_path, output_dir):
     # Ensure the output directory exists
@@ -38,6 +159,12 @@ def save_config_file(config_file_path, output_dir):
     print(f"Config file saved to: {destination_path}")
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    cache = parser.add_mutually_exclusive_group()
+    cache.add_argument('--force', action='store_true', help='Run every scenario, even those completed before with the same inputs')
+    cache.add_argument('--only-missing', action='store_true', help='Only run scenarios whose outputs are missing, even if the inputs changed since')
+    args = parser.parse_args()
+
     start_total_time = time.time()
     print("Starting simulation counter...")
 
@@ -63,8 +190,15 @@ if __name__ == '__main__':
         config['Simulation']['Edge_Detection'] = scenario['Edge_Detection']
         config['Simulation']['ego_Breakdown_Enabled'] = scenario['ego_Breakdown_Enabled']
 
+        # Skip runs completed with the same inputs (edge detection is only redone when its inputs change)
+        key = run_key(config)
+        if not args.force and is_complete(config, key, only_missing=args.only_missing):
+            print(f"Skipping {run_name(config)}: completed with the same inputs")
+            continue
+
         # Run the simulation
-        run_simulation(config)
+        if run_simulation(config) and all(os.path.exists(path) for path in run_outputs(config)):
+            record_run(config, key)
 
     end_total_time = time.time()
     print(f"Total time for all simulations: {end_total_time - start_total_time} seconds")
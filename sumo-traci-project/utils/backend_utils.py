@@ -0,0 +1,65 @@
+import os
+import sys
+
+# This module must not import traci: the backend is picked by setting LIBSUMO_AS_TRACI,
+# which traci only reads when it is imported for the first time
+BACKENDS = ('traci', 'libsumo')
+
+def select_backend(backend, sumo_gui=False):
+    """
+    Choose the TraCI implementation used by every module that imports traci.
+
+    With 'libsumo' SUMO runs inside this Python process and traci calls become plain
+    function calls instead of socket round trips. libsumo has no GUI, so a GUI run
+    always falls back to the socket backend.
+
+    Args:
+    - backend (str): 'traci' or 'libsumo'.
+    - sumo_gui (bool): Whether the run uses sumo-gui.
+
+    Returns:
+    - str: The backend that will actually be used.
+    """
+    if backend not in BACKENDS:
+        sys.exit(f"Unknown SUMO backend '{backend}', expected one of {', '.join(BACKENDS)}.")
+    if 'traci' in sys.modules:
+        print(f"Warning: traci was imported before the backend was selected, '{backend}' may not take effect")
+
+    if backend == 'libsumo' and sumo_gui:
+        print("libsumo cannot run sumo-gui, using the traci backend instead")
+        backend = 'traci'
+
+    if backend == 'libsumo':
+        os.environ['LIBSUMO_AS_TRACI'] = '1'
+    else:
+        os.environ.pop('LIBSUMO_AS_TRACI', None)
+    return backend
+
+def is_libsumo():
+    """Return True if the imported traci module is libsumo."""
+    import traci
+    return getattr(traci, 'isLibsumo', lambda: False)()
+
+def start(sumo_cmd, port=None, label=None):
+    """
+    Start SUMO on whichever backend traci resolves to.
+
+    libsumo runs a single in-process simulation, so the socket options (port, label)
+    only apply to the traci backend and are ignored otherwise.
+
+    Args:
+    - sumo_cmd (list): SUMO command line, starting with the binary.
+    - port (int, optional): TraCI port.
+    - label (str, optional): TraCI connection label.
+    """
+    import traci
+    if is_libsumo():
+        traci.start(sumo_cmd)
+        return
+
+    kwargs = {}
+    if port is not None:
+        kwargs['port'] = port
+    if label is not None:
+        kwargs['label'] = label
+    traci.start(sumo_cmd, **kwargs)
@@ -0,0 +1,79 @@
+import atexit
+import csv
+import os
+import time
+
+class BufferedCsvSink:
+    """
+    Keeps one open handle per CSV file for the whole run and writes rows in bulk.
+
+    Rows are buffered in memory and flushed when the number of buffered rows reaches
+    max_rows, when flush_interval seconds (wall clock) have passed since the last
+    flush, or when close() is called. close() is also registered with atexit so that
+    buffered rows are not lost if the run ends with an exception.
+    """
+
+    def __init__(self, max_rows=10000, flush_interval=30.0):
+        self.max_rows = max_rows
+        self.flush_interval = flush_interval
+        self.files = {}    # {filename: (file handle, csv.DictWriter)}
+        self.buffers = {}  # {filename: [row, ...]}
+        self.buffered_rows = 0
+        self.last_flush = time.monotonic()
+        atexit.register(self.close)
+
+    def configure(self, max_rows=None, flush_interval=None):
+        """Change the flush thresholds."""
+        if max_rows is not None:
+            self.max_rows = max_rows
+        if flush_interval is not None:
+            self.flush_interval = flush_interval
+
+    def write(self, filename, fieldnames, rows):
+        """Buffer rows for filename, opening it (and writing the header if new) on first use."""
+        if filename not in self.files:
+            file_exists = os.path.isfile(filename)
+            handle = open(filename, 'a', newline='')
+            writer = csv.DictWriter(handle, fieldnames=fieldnames)
+            if not file_exists:
+                writer.writeheader()
+            self.files[filename] = (handle, writer)
+            self.buffers[filename] = []
+
+        buffer = self.buffers[filename]
+        buffer.extend(rows)
+        self.buffered_rows += len(rows)
+
+        if self.buffered_rows >= self.max_rows or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Write all buffered rows to their files."""
+        for filename, rows in self.buffers.items():
+            if rows:
+                handle, writer = self.files[filename]
+                writer.writerows(rows)
+                handle.flush()
+                rows.clear()
+        self.buffered_rows = 0
+        self.last_flush = time.monotonic()
+
+    def release(self, filename):
+        """Flush and close a single file, e.g. before it is overwritten."""
+        if filename in self.files:
+            handle, writer = self.files.pop(filename)
+            rows = self.buffers.pop(filename)
+            writer.writerows(rows)
+            self.buffered_rows -= len(rows)
+            handle.close()
+
+    def close(self):
+        """Flush everything and close all file handles."""
+        self.flush()
+        for handle, _ in self.files.values():
+            handle.close()
+        self.files.clear()
+        self.buffers.clear()
+
+# Sink shared by all data collection observers
+csv_sink = BufferedCsvSink()
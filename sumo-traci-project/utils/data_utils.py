@@ -1,13 +1,17 @@
 import traci
+from traci import constants as tc
 import numpy as np
 import csv
 import os
-from .vehicle_utils import get_edges_near_stopped_egos
+from .vehicle_utils import get_edges_near_stopped_egos, get_upstream_area_of_stopped_egos
+from . import subscription_utils as subu
+from .csv_utils import csv_sink
 import xml.etree.ElementTree as ET
 
 # Initialize dictionaries outside the function to maintain state between function calls
 cumulative_metrics_all = {}
 cumulative_metrics_in_radius = {}
+edges_of_interest_cache = {}  # {filename: (mtime, frozenset of edge ids)} shared by all observers
 
 # Traffic data collection functions
 def collect_and_save_mean_speeds(radius, warmup_time, baseline=False, scenario=None, project=None):
@@ -17,14 +21,13 @@ def collect_and_save_mean_speeds(radius, warmup_time, baseline=False, scenario=N
     if step < warmup_time:
         return
 
-    vehicle_ids = traci.vehicle.getIDList()
-    speeds_all = get_speeds_of_vehicles(vehicle_ids)
+    vehicles = subu.get_snapshot(step)['vehicles']
+    speeds_all = [values[tc.VAR_SPEED] * 3.6 for values in vehicles.values()]
     mean_speed_all = np.mean(speeds_all) if speeds_all else 0
 
-    edges_of_interest = read_edges_from_xml(f'data/{project}/outputs/{scenario}/radius_edges.xml')
+    edges_of_interest = get_edges_of_interest(project, scenario)
     # edges_of_interest = read_edges_from_file(f'data/{project}/outputs/{scenario}/edges_near_stopped_egos.txt')
-    vehicles_in_radius = [veh_id for veh_id in vehicle_ids if traci.vehicle.getRoadID(veh_id) in edges_of_interest]
-    speeds_in_radius = get_speeds_of_vehicles(vehicles_in_radius)
+    speeds_in_radius = [values[tc.VAR_SPEED] * 3.6 for values in vehicles.values() if values[tc.VAR_ROAD_ID] in edges_of_interest]
     mean_speed_in_radius = np.mean(speeds_in_radius) if speeds_in_radius else 0
 
     # Modify the filename based on baseline value
@@ -45,12 +48,12 @@ def collect_and_save_vehicle_count(radius, warmup_time, baseline=False, scenario
     if step < warmup_time:
         return
 
-    vehicle_ids = traci.vehicle.getIDList()
-    count_all = len(vehicle_ids)
+    vehicle_roads = subu.get_vehicle_roads(step)
+    count_all = len(vehicle_roads)
 
-    edges_of_interest = read_edges_from_xml(f'data/{project}/outputs/{scenario}/radius_edges.xml')
+    edges_of_interest = get_edges_of_interest(project, scenario)
     # edges_of_interest = read_edges_from_file(f'data/{project}/outputs/{scenario}/edges_near_stopped_egos.txt')
-    count_in_radius = get_vehicle_count_on_edges(vehicle_ids, edges_of_interest)
+    count_in_radius = sum(1 for road_id in vehicle_roads.values() if road_id in edges_of_interest)
 
     # Modify the filename based on baseline value
     filename_prefix = 'base' if baseline else 'attack'
@@ -64,6 +67,25 @@ def collect_and_save_vehicle_count(radius, warmup_time, baseline=False, scenario
         ['Step', 'Count_All', 'Count_In_Radius'],
         [{'Step': step, 'Count_All': count_all, 'Count_In_Radius': count_in_radius}]
     )
+def collect_and_save_upstream_area(ego_type, net, distance_limit, partial_inclusion, baseline=False, scenario=None, project=None):
+    """Save the edges upstream of the currently stopped egos, with their distance to the nearest one."""
+
+    step = traci.simulation.getTime()
+    upstream_area = get_upstream_area_of_stopped_egos(ego_type, net, distance_limit, partial_inclusion)
+    if not upstream_area:
+        return
+
+    filename_prefix = 'base' if baseline else 'attack'
+    output_directory = os.path.join('data', project, 'outputs', scenario)
+    ensure_directory_exists(output_directory)
+    output_filename = os.path.join(output_directory, f'{filename_prefix}_upstream_area.csv')
+
+    save_to_csv(
+        output_filename,
+        ['Step', 'Edge', 'Distance', 'Incident'],
+        [{'Step': step, 'Edge': edge_id, 'Distance': distance, 'Incident': incident_id}
+         for edge_id, (distance, incident_id) in upstream_area.items()]
+    )
 def collect_and_save_mean_edge_delays_over_simulation(radius, warmup_time, baseline=False, last_sim_step=None, scenario=None, project=None, ego_type='ego'):
     """Collect cumulative edge delays over the simulation and save the means at the end."""
     
@@ -75,22 +97,25 @@ def collect_and_save_mean_edge_delays_over_simulation(radius, warmup_time, basel
     cumulative_delays_all = {}
     cumulative_delays_in_radius = {}
     
-    # Collect the edge IDs and filter out internal edges (part of intersections)
-    edge_ids = [edge_id for edge_id in traci.edge.getIDList() if not edge_id.startswith(":")]
+    # Collect the edge IDs (subscribed edges exclude internal edges, part of intersections)
+    snapshot = subu.get_snapshot(step)
+    edge_ids = snapshot['edges'].keys()
 
-    edges_of_interest = read_edges_from_xml(f'data/{project}/outputs/{scenario}/radius_edges.xml')
+    edges_of_interest = get_edges_of_interest(project, scenario)
     # edges_of_interest = read_edges_from_file(f'data/{project}/outputs/{scenario}/edges_near_stopped_egos.txt')
 
+    # Group vehicle speeds by edge from the batched snapshot
+    speeds_by_edge = {}
+    for values in snapshot['vehicles'].values():
+        speeds_by_edge.setdefault(values[tc.VAR_ROAD_ID], []).append(values[tc.VAR_SPEED])
+
     for edge_id in edge_ids:
         # Get the first lane of the edge
         lane_id = edge_id + "_0"  # Assuming lane indexing starts at 0
-        edge_speed_limit = traci.lane.getMaxSpeed(lane_id)
-        
-        # Get vehicles on this edge
-        vehicles_on_edge = traci.edge.getLastStepVehicleIDs(edge_id)
+        edge_speed_limit = subu.get_lane_max_speed(lane_id)
         
         # Calculate delay for each vehicle on the edge
-        delays_on_edge = [max(0, edge_speed_limit - traci.vehicle.getSpeed(veh_id)) for veh_id in vehicles_on_edge if traci.vehicle.getSpeed(veh_id) is not None]
+        delays_on_edge = [max(0, edge_speed_limit - speed) for speed in speeds_by_edge.get(edge_id, [])]
 
         
         # Update cumulative delays and counts
@@ -140,7 +165,7 @@ def collect_and_save_lane_metrics(radius, warmup_time, last_sim_step=None, basel
     if step < warmup_time:
         return
 
-    edges_of_interest = read_edges_from_xml(f'data/{project}/outputs/{scenario}/radius_edges.xml')
+    edges_of_interest = get_edges_of_interest(project, scenario)
     # edges_of_interest = read_edges_from_file(f'data/{project}/outputs/{scenario}/edges_near_stopped_egos.txt')
     
     # Get all edges (excluding those that start with ":")
@@ -241,17 +266,17 @@ def get_gridlocked_edges(stop_time, warmup_time, scenario=None, project=None):
 
     gridlocked_edges = {}
 
-    # Collect the edge IDs and filter out internal edges (part of intersections)
-    edge_ids = [edge_id for edge_id in traci.edge.getIDList() if not edge_id.startswith(":")]
+    # Batched edge data (subscribed edges exclude internal edges, part of intersections)
+    edge_data = subu.get_snapshot(step)['edges']
 
     data_to_save = []
 
-    for edge_id in edge_ids:
-        num_vehicles = traci.edge.getLastStepVehicleNumber(edge_id)
+    for edge_id, values in edge_data.items():
+        num_vehicles = values[tc.LAST_STEP_VEHICLE_NUMBER]
         
         # Check if the edge has vehicles
         if num_vehicles > 0:
-            mean_speed = traci.edge.getLastStepMeanSpeed(edge_id)
+            mean_speed = values[tc.LAST_STEP_MEAN_SPEED]
 
             # If the mean speed is below the threshold, consider this lane as gridlocked
             if mean_speed < GRIDLOCK_SPEED_THRESHOLD:
@@ -289,19 +314,23 @@ def read_edges_from_file(filename):
     with open(filename, 'r') as file:
         return [line.strip().split(":")[1] for line in file]
 def save_to_csv(filename, fieldnames, data, append=True):
-    """Save data to a CSV file."""
+    """
+    Save data to a CSV file.
+
+    Appended rows go through the shared buffered sink, which keeps the file open for
+    the whole run and writes in bulk; call csv_sink.close() (done by su.run_simulation
+    through its close handlers) to flush them. With append=False the file is rewritten
+    immediately.
+    """
+    if append:
+        csv_sink.write(filename, fieldnames, data)
+        return
 
-    # Check if file exists
-    file_exists = os.path.isfile(filename)
-    mode = 'a' if append else 'w'  # Use append mode if append=True, otherwise use write mode
+    csv_sink.release(filename)
 
-    with open(filename, mode, newline='') as csvfile:
+    with open(filename, 'w', newline='') as csvfile:
         writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        
-        # Write the header only if we're not appending, or if the file didn't exist before
-        if not append or (append and not file_exists):
-            writer.writeheader()
-        
+        writer.writeheader()
         for row in data:
             writer.writerow(row)
 def get_average_lane_speed(lane_id):
@@ -317,6 +346,21 @@ def get_vc_ratio(lane_id, capacity):
     flow = get_average_lane_speed(lane_id) * get_lane_density(lane_id)
     return flow / capacity
 
+def get_edges_of_interest(project, scenario):
+    """
+    Return the radius edges of a scenario as a set for O(1) membership tests.
+
+    The radius_edges.xml file is parsed once per run and only re-parsed if its
+    modification time changes (e.g. when edge detection rewrites it).
+    """
+    filename = f'data/{project}/outputs/{scenario}/radius_edges.xml'
+    mtime = os.path.getmtime(filename)
+    cached = edges_of_interest_cache.get(filename)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, frozenset(read_edges_from_xml(filename)))
+        edges_of_interest_cache[filename] = cached
+    return cached[1]
+
 # read edges from file - but its xml!
 def read_edges_from_xml(filename):
     """Read edges from an XML file."""
@@ -1,6 +1,9 @@
 import xml.etree.ElementTree as ET
 import traci
+from traci import constants as tc
+import numpy as np
 import csv, os
+from . import subscription_utils as subu
 
 def get_edge_ids_from_xml(file_path):
     tree = ET.parse(file_path)
@@ -76,6 +79,86 @@ def simulate_detectors(detectors, accumulated_data, current_time):
             detector_key = f"{edge_id}_{pos}"
             store_detector_data(accumulated_data, detector_key, current_time, flow, density, avg_speed)
 
+class VirtualDetectorArray:
+    """
+    Vectorized replacement for simulate_detectors.
+
+    Each step the positions and speeds of the vehicles on every detector edge are taken
+    from the shared subscription snapshot (no per-vehicle or per-detector TraCI calls),
+    sorted once per edge, and binned against all detector windows of that edge with
+    np.searchsorted. Vehicle counts and speed sums are stored in preallocated
+    detectors x time arrays.
+    """
+
+    def __init__(self, detectors, end_time, step_length, half_window=50):
+        self.half_window = half_window
+        self.step_length = step_length
+        self.keys = []         # Detector keys, same format as simulate_detectors ("<edge>_<pos>")
+        self.edge_windows = {} # {edge_id: (first row, window starts, window ends)}
+
+        for edge_id, positions in detectors.items():
+            positions = np.asarray(positions, dtype=float)
+            self.edge_windows[edge_id] = (len(self.keys), positions - half_window, positions + half_window)
+            self.keys.extend(f"{edge_id}_{pos}" for pos in detectors[edge_id])
+
+        n_steps = int(round(end_time / step_length)) + 2
+        self.times = np.zeros(n_steps)
+        self.counts = np.zeros((len(self.keys), n_steps), dtype=np.int32)
+        self.speed_sums = np.zeros((len(self.keys), n_steps))
+        self.n_records = 0
+
+    def _grow(self):
+        """Double the time dimension if the run is longer than expected."""
+        self.times = np.concatenate([self.times, np.zeros_like(self.times)])
+        self.counts = np.concatenate([self.counts, np.zeros_like(self.counts)], axis=1)
+        self.speed_sums = np.concatenate([self.speed_sums, np.zeros_like(self.speed_sums)], axis=1)
+
+    def update(self, current_time):
+        """Observer: record all detectors for the current step."""
+        if self.n_records == self.times.shape[0]:
+            self._grow()
+        column = self.n_records
+        self.times[column] = current_time
+
+        # Group vehicle positions and speeds by detector edge
+        positions_by_edge = {}
+        speeds_by_edge = {}
+        for values in subu.get_snapshot(current_time)['vehicles'].values():
+            edge_id = values[tc.VAR_ROAD_ID]
+            if edge_id in self.edge_windows:
+                positions_by_edge.setdefault(edge_id, []).append(values[tc.VAR_LANEPOSITION])
+                speeds_by_edge.setdefault(edge_id, []).append(values[tc.VAR_SPEED])
+
+        for edge_id, positions in positions_by_edge.items():
+            first_row, window_starts, window_ends = self.edge_windows[edge_id]
+            positions = np.asarray(positions)
+            order = np.argsort(positions)
+            sorted_positions = positions[order]
+            cumulative_speeds = np.concatenate(([0.0], np.cumsum(np.asarray(speeds_by_edge[edge_id])[order])))
+
+            # Windows are inclusive on both ends: pos - 50 <= vehicle_pos <= pos + 50
+            lower = np.searchsorted(sorted_positions, window_starts, side='left')
+            upper = np.searchsorted(sorted_positions, window_ends, side='right')
+            rows = slice(first_row, first_row + len(window_starts))
+            self.counts[rows, column] = upper - lower
+            self.speed_sums[rows, column] = cumulative_speeds[upper] - cumulative_speeds[lower]
+
+        self.n_records += 1
+
+    def write_to_csv(self, filename):
+        """Write the same columns as write_detector_data_to_csv."""
+        counts = self.counts[:, :self.n_records]
+        flows = counts * 3600 / self.step_length
+        densities = counts / 0.1  # Assuming lane width of 0.1
+        average_speeds = np.divide(self.speed_sums[:, :self.n_records], counts, out=np.zeros(counts.shape), where=counts > 0)
+        times = self.times[:self.n_records].tolist()
+
+        with open(filename, 'w', newline='') as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(['detector', 'time', 'flow', 'density', 'average_speed'])
+            for row, detector in enumerate(self.keys):
+                writer.writerows(zip([detector] * len(times), times, flows[row].tolist(), densities[row].tolist(), average_speeds[row].tolist()))
+
 def calculate_traffic_parameters(speeds):
     flow = len(speeds) * 3600 / traci.simulation.getDeltaT()
     density = len(speeds) / 0.1  # Assuming lane width of 0.1
@@ -161,3 +244,96 @@ def save_detectors_to_xml(detectors, scenario, project):
     tree = ET.ElementTree(root)
     tree.write(file_name)
 
+
+
+def save_detectors_as_additional(detectors, net, scenario, project, period=300, half_window=50, prefix=''):
+    """
+    Writes the detector positions as a SUMO additional file with real detectors.
+
+    For every detector position an inductionLoop (E1) and a laneAreaDetector (E2)
+    covering pos +/- half_window are placed on every lane of the edge, so SUMO does the
+    measuring itself and writes aggregated interval output every 'period' seconds.
+
+    Returns:
+    - tuple: (path of the additional file, detector map) where the detector map is
+      {detector key: {'e1': [ids], 'e2': [ids], 'length': e2 length in m}} and the
+      detector key has the same "<edge>_<pos>" format as simulate_detectors.
+    """
+    output_directory = f'data/{project}/outputs/{scenario}'
+    os.makedirs(output_directory, exist_ok=True)
+    file_name = os.path.join(output_directory, f'{prefix}native_detectors.add.xml')
+
+    root = ET.Element("additional")
+    detector_map = {}
+
+    for edge_id, positions in detectors.items():
+        edge = net.getEdge(edge_id)
+        edge_length = edge.getLength()
+        for pos in positions:
+            detector_key = f"{edge_id}_{pos}"
+            start_pos = max(0.0, pos - half_window)
+            end_pos = min(edge_length, pos + half_window)
+            entry = {'e1': [], 'e2': [], 'length': end_pos - start_pos}
+
+            for lane in edge.getLanes():
+                lane_id = lane.getID()
+                e1_id = f"e1_{detector_key}_{lane.getIndex()}"
+                e2_id = f"e2_{detector_key}_{lane.getIndex()}"
+                ET.SubElement(root, "inductionLoop", id=e1_id, lane=lane_id, pos=str(min(pos, lane.getLength())),
+                              period=str(period), file=f'{prefix}e1_output.xml', friendlyPos="true")
+                ET.SubElement(root, "laneAreaDetector", id=e2_id, lane=lane_id, pos=str(start_pos), endPos=str(end_pos),
+                              period=str(period), file=f'{prefix}e2_output.xml', friendlyPos="true")
+                entry['e1'].append(e1_id)
+                entry['e2'].append(e2_id)
+
+            detector_map[detector_key] = entry
+
+    tree = ET.ElementTree(root)
+    tree.write(file_name)
+    return file_name, detector_map
+
+def read_interval_output(file_name):
+    """Read a SUMO detector interval output into {(detector id, begin): attributes}."""
+    intervals = {}
+    for _, elem in ET.iterparse(file_name):
+        if elem.tag == 'interval':
+            intervals[(elem.get('id'), float(elem.get('begin')))] = elem.attrib
+        elem.clear()
+    return intervals
+
+def read_native_detector_data(detector_map, e1_file, e2_file):
+    """
+    Convert SUMO's own E1/E2 interval outputs into the accumulated_data format of
+    simulate_detectors, so write_detector_data_to_csv produces the same columns.
+
+    Per detector and interval: flow is the summed E1 flow over all lanes (veh/h),
+    density is the summed mean E2 vehicle number per km of detector length, and
+    average_speed is the E2 mean speed weighted by the sampled vehicle seconds.
+    """
+    e1_intervals = read_interval_output(e1_file)
+    e2_intervals = read_interval_output(e2_file)
+    interval_starts = sorted({begin for _, begin in e1_intervals})
+
+    accumulated_data = {}
+    for detector_key, entry in detector_map.items():
+        for begin in interval_starts:
+            flow = sum(float(e1_intervals[(e1_id, begin)]['flow']) for e1_id in entry['e1'] if (e1_id, begin) in e1_intervals)
+
+            vehicle_number = 0.0
+            sampled_seconds = 0.0
+            speed_sum = 0.0
+            for e2_id in entry['e2']:
+                interval = e2_intervals.get((e2_id, begin))
+                if interval is None:
+                    continue
+                vehicle_number += float(interval['meanVehicleNumber'])
+                seconds = float(interval['sampledSeconds'])
+                if seconds > 0:
+                    sampled_seconds += seconds
+                    speed_sum += float(interval['meanSpeed']) * seconds
+
+            density = vehicle_number / (entry['length'] / 1000) if entry['length'] > 0 else 0
+            avg_speed = speed_sum / sampled_seconds if sampled_seconds > 0 else 0
+            store_detector_data(accumulated_data, detector_key, begin, flow, density, avg_speed)
+
+    return accumulated_data
@@ -0,0 +1,110 @@
+import cProfile
+import io
+import json
+import math
+import os
+import pstats
+
+HISTOGRAM_BUCKETS = 32  # bucket i counts calls taking [2^(i-1), 2^i) microseconds
+
+class StepProfiler:
+    """
+    Per-observer timing counters for run_simulation.
+
+    Every timed call adds to a call count, a total, a maximum and a log2 histogram of
+    its duration, so the cost per call is a few additions regardless of run length.
+    Optionally one observer is run under cProfile while the simulation time is inside
+    a chosen window.
+    """
+
+    def __init__(self, output_file=None, cprofile_observer=None, cprofile_start=None, cprofile_end=None):
+        self.output_file = output_file
+        self.stats = {}  # {name: [calls, total seconds, max seconds, histogram]}
+        self.steps = 0
+        self.runtime = 0.0
+
+        self.cprofile_observer = cprofile_observer
+        self.cprofile_start = cprofile_start
+        self.cprofile_end = cprofile_end
+        self.cprofile = cProfile.Profile() if cprofile_observer else None
+        self.cprofile_calls = 0
+
+    def record(self, name, seconds):
+        """Add one timed call of name."""
+        entry = self.stats.get(name)
+        if entry is None:
+            entry = self.stats[name] = [0, 0.0, 0.0, [0] * HISTOGRAM_BUCKETS]
+        entry[0] += 1
+        entry[1] += seconds
+        if seconds > entry[2]:
+            entry[2] = seconds
+        bucket = math.frexp(seconds * 1e6)[1] if seconds > 0 else 0
+        entry[3][min(max(bucket, 0), HISTOGRAM_BUCKETS - 1)] += 1
+
+    def wants_cprofile(self, name, sim_time):
+        """Return True if this call of name should run under cProfile."""
+        if self.cprofile is None or name != self.cprofile_observer:
+            return False
+        if self.cprofile_start is not None and sim_time < self.cprofile_start:
+            return False
+        if self.cprofile_end is not None and sim_time > self.cprofile_end:
+            return False
+        return True
+
+    def run_cprofiled(self, func):
+        """Call func under the cProfile collector."""
+        self.cprofile_calls += 1
+        self.cprofile.runcall(func)
+
+    def percentile(self, histogram, fraction):
+        """Upper bound (seconds) of the histogram bucket holding the given fraction of calls."""
+        target = fraction * sum(histogram)
+        cumulative = 0
+        for bucket, count in enumerate(histogram):
+            cumulative += count
+            if count and cumulative >= target:
+                return 2 ** bucket / 1e6
+        return 0.0
+
+    def summary(self):
+        """Return {name: summary dict} sorted by total time, largest first."""
+        summary = {}
+        for name, (calls, total, maximum, histogram) in sorted(self.stats.items(), key=lambda item: -item[1][1]):
+            summary[name] = {
+                'calls': calls,
+                'total_s': total,
+                'mean_ms': total / calls * 1e3 if calls else 0.0,
+                'p50_ms': min(self.percentile(histogram, 0.5), maximum) * 1e3,
+                'p95_ms': min(self.percentile(histogram, 0.95), maximum) * 1e3,
+                'max_ms': maximum * 1e3,
+                'share': total / self.runtime if self.runtime else 0.0,
+                'histogram_us': {2 ** bucket: count for bucket, count in enumerate(histogram) if count},
+            }
+        return summary
+
+    def print_summary(self):
+        """Print the timing table of the simulation step and all observers."""
+        print(f"\n{'Observer':<40} {'Calls':>8} {'Total s':>9} {'Mean ms':>9} {'p95 ms':>9} {'Max ms':>9} {'Share':>7}")
+        for name, row in self.summary().items():
+            print(f"{name[:40]:<40} {row['calls']:>8} {row['total_s']:>9.2f} {row['mean_ms']:>9.3f} "
+                  f"{row['p95_ms']:>9.3f} {row['max_ms']:>9.3f} {row['share']:>7.1%}")
+        print(f"{self.steps} steps in {self.runtime:.2f} s")
+
+    def close(self, runtime, steps):
+        """Print the summary and write the JSON profile (and the cProfile stats, if any)."""
+        self.runtime = runtime
+        self.steps = steps
+        self.print_summary()
+
+        if self.output_file:
+            os.makedirs(os.path.dirname(self.output_file) or '.', exist_ok=True)
+            with open(self.output_file, 'w') as file:
+                json.dump({'runtime_s': runtime, 'steps': steps, 'observers': self.summary()}, file, indent=2)
+            print(f"Profile saved to: {self.output_file}")
+
+        if self.cprofile_calls:
+            stream = io.StringIO()
+            pstats.Stats(self.cprofile, stream=stream).sort_stats('cumulative').print_stats(20)
+            print(f"\ncProfile of {self.cprofile_observer} ({self.cprofile_calls} calls):\n{stream.getvalue()}")
+            if self.output_file:
+                self.cprofile.dump_stats(os.path.splitext(self.output_file)[0] + '.prof')
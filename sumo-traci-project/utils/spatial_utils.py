@@ -0,0 +1,85 @@
+import math
+
+# Indexes built from a sumolib net, cached per net object for the whole run
+lane_indexes = {}
+reverse_edge_maps = {}
+
+class LaneGridIndex:
+    """
+    Uniform grid over the centre lines of the first lane ("_0") of every non-internal edge.
+
+    Every shape segment is stored in each grid cell its bounding box touches, so a radius
+    query only has to look at the segments in the cells around the query point. Distances
+    are measured from the point to the segment, not only to the shape points, so an edge
+    passing close to the point mid-lane is also found.
+    """
+
+    def __init__(self, net, cell_size=50.0):
+        self.cell_size = cell_size
+        self.segments = []  # [(edge_id, x1, y1, x2, y2), ...]
+        self.cells = {}     # {(cell_x, cell_y): [segment index, ...]}
+
+        for edge in net.getEdges(withInternal=False):
+            shape = edge.getLane(0).getShape()
+            if len(shape) == 1:
+                shape = [shape[0], shape[0]]
+            for (x1, y1), (x2, y2) in zip(shape, shape[1:]):
+                segment_index = len(self.segments)
+                self.segments.append((edge.getID(), x1, y1, x2, y2))
+                for cell in self._cells_in_box(min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)):
+                    self.cells.setdefault(cell, []).append(segment_index)
+
+    def _cells_in_box(self, x_min, y_min, x_max, y_max):
+        """Yield the grid cells overlapping an axis-aligned box."""
+        for cell_x in range(math.floor(x_min / self.cell_size), math.floor(x_max / self.cell_size) + 1):
+            for cell_y in range(math.floor(y_min / self.cell_size), math.floor(y_max / self.cell_size) + 1):
+                yield (cell_x, cell_y)
+
+    def edges_within(self, x, y, radius):
+        """Return the set of edges whose first lane passes within radius of (x, y)."""
+        nearby_edges = set()
+        checked = set()
+        for cell in self._cells_in_box(x - radius, y - radius, x + radius, y + radius):
+            for segment_index in self.cells.get(cell, ()):
+                if segment_index in checked:
+                    continue
+                checked.add(segment_index)
+                edge_id, x1, y1, x2, y2 = self.segments[segment_index]
+                if edge_id not in nearby_edges and distance_point_to_segment(x, y, x1, y1, x2, y2) <= radius:
+                    nearby_edges.add(edge_id)
+        return nearby_edges
+
+def distance_point_to_segment(x, y, x1, y1, x2, y2):
+    """Return the distance from point (x, y) to the segment (x1, y1)-(x2, y2)."""
+    dx, dy = x2 - x1, y2 - y1
+    length_squared = dx * dx + dy * dy
+    if length_squared == 0:
+        return math.hypot(x - x1, y - y1)
+    t = max(0.0, min(1.0, ((x - x1) * dx + (y - y1) * dy) / length_squared))
+    return math.hypot(x - (x1 + t * dx), y - (y1 + t * dy))
+
+def build_reverse_edge_map(net):
+    """
+    Map every non-internal edge to the edge running in the opposite direction
+    between the same two nodes, where one exists.
+    """
+    reverse_edges = {}
+    for edge in net.getEdges(withInternal=False):
+        for candidate in edge.getToNode().getOutgoing():
+            if candidate.getToNode() == edge.getFromNode() and not candidate.getID().startswith(':'):
+                reverse_edges[edge.getID()] = candidate.getID()
+                break
+    return reverse_edges
+
+def get_lane_index(net, cell_size=50.0):
+    """Return the LaneGridIndex of a net, building it on first use."""
+    key = (id(net), cell_size)
+    if key not in lane_indexes:
+        lane_indexes[key] = LaneGridIndex(net, cell_size)
+    return lane_indexes[key]
+
+def get_reverse_edge_map(net):
+    """Return the reverse-edge map of a net, building it on first use."""
+    if id(net) not in reverse_edge_maps:
+        reverse_edge_maps[id(net)] = build_reverse_edge_map(net)
+    return reverse_edge_maps[id(net)]
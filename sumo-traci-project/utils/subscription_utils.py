@@ -0,0 +1,82 @@
+import traci
+from traci import constants as tc
+
+# Variables subscribed for every vehicle and every (non-internal) edge
+VEHICLE_VARIABLES = [tc.VAR_SPEED, tc.VAR_ROAD_ID, tc.VAR_LANEPOSITION]
+EDGE_VARIABLES = [tc.LAST_STEP_VEHICLE_NUMBER, tc.LAST_STEP_MEAN_SPEED]
+
+# Batched results of the current simulation step, shared by all observers
+snapshot = {
+    'time': None,
+    'vehicles': {},  # {vehicle_id: {VAR_SPEED: ..., VAR_ROAD_ID: ..., VAR_LANEPOSITION: ...}}
+    'edges': {},     # {edge_id: {LAST_STEP_VEHICLE_NUMBER: ..., LAST_STEP_MEAN_SPEED: ...}}
+}
+subscribed_edges = set()
+lane_max_speeds = {}
+step_length = None
+
+def reset():
+    """Forget the snapshot, subscriptions and cached lane speeds of a previous run. Called when SUMO starts."""
+    global step_length
+    snapshot['time'] = None
+    snapshot['vehicles'] = {}
+    snapshot['edges'] = {}
+    subscribed_edges.clear()
+    lane_max_speeds.clear()
+    step_length = None
+
+def subscribe_new_vehicles():
+    """Subscribe vehicles that entered the network during the last step."""
+    for vehicle_id in traci.simulation.getDepartedIDList():
+        traci.vehicle.subscribe(vehicle_id, VEHICLE_VARIABLES)
+
+def subscribe_all_vehicles():
+    """Subscribe every vehicle currently in the network."""
+    for vehicle_id in traci.vehicle.getIDList():
+        traci.vehicle.subscribe(vehicle_id, VEHICLE_VARIABLES)
+
+def subscribe_edges():
+    """Subscribe all non-internal edges once per run."""
+    for edge_id in traci.edge.getIDList():
+        if not edge_id.startswith(":") and edge_id not in subscribed_edges:
+            traci.edge.subscribe(edge_id, EDGE_VARIABLES)
+            subscribed_edges.add(edge_id)
+
+def get_snapshot(step):
+    """
+    Return the batched vehicle and edge data for a simulation step.
+
+    The first observer asking for a given step refreshes the snapshot with two
+    getAllSubscriptionResults calls; every other observer in that step reuses it.
+
+    Args:
+    - step (float): Current simulation time, as already read by the observer.
+
+    Returns:
+    - dict: Snapshot with 'time', 'vehicles' and 'edges' entries.
+    """
+    global step_length
+
+    if snapshot['time'] != step:
+        if not subscribed_edges:
+            subscribe_edges()
+            step_length = traci.simulation.getDeltaT()
+        if snapshot['time'] is None or step - snapshot['time'] > step_length + 1e-6:
+            # Collection just started (e.g. after warm-up) or skipped steps: departures were missed
+            subscribe_all_vehicles()
+        else:
+            subscribe_new_vehicles()
+        snapshot['vehicles'] = traci.vehicle.getAllSubscriptionResults()
+        snapshot['edges'] = traci.edge.getAllSubscriptionResults()
+        snapshot['time'] = step
+    return snapshot
+
+def get_vehicle_roads(step):
+    """Return {vehicle_id: edge_id} for all vehicles in the network."""
+    return {veh_id: values[tc.VAR_ROAD_ID] for veh_id, values in get_snapshot(step)['vehicles'].items()}
+
+def get_lane_max_speed(lane_id):
+    """Return the (static) speed limit of a lane, fetched once and cached."""
+    if lane_id not in lane_max_speeds:
+        lane_max_speeds[lane_id] = traci.lane.getMaxSpeed(lane_id)
+    return lane_max_speeds[lane_id]
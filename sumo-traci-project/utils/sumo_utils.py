@@ -1,25 +1,129 @@
 import traci
 import os
+import heapq
+import itertools
+import math
 import sys
 import time
 import shutil
+import xml.etree.ElementTree as ET
+from . import backend_utils as bu
+from . import profile_utils as pru
+from . import subscription_utils as subu
 
-# List of handler functions to be executed at every simulation step
+# Registered observers in registration order, each a dict with the function and its timing
 observers = []
 
-def register_observer(func):
-    """Add a function to the observers list."""
-    observers.append(func)
+# Heap of (due step, registration order, observer) dispatched by run_simulation
+schedule = []
+registration_counter = itertools.count()
+
+# Step length and current step index of the running simulation (None when not running)
+step_length = None
+current_step = None
+
+# List of handler functions to be executed when the simulation is closed
+close_handlers = []
+
+# Optional per-observer timing (see enable_profiling)
+profiler = None
+
+def register_observer(func, start=None, end=None, period=None, phase=0, name=None):
+    """
+    Add a function to the observers list.
+
+    Without timing arguments the observer is called at every simulation step, as before.
+    The timing arguments let run_simulation skip the observer entirely outside its window
+    and between its periods, instead of the observer returning early on its own check.
+
+    Args:
+    - func (callable): Function called without arguments before the step is simulated.
+    - start (float, optional): First simulation time (s) at which the observer is called.
+    - end (float, optional): Last simulation time (s) at which the observer is called.
+    - period (float, optional): Call the observer every period seconds instead of every step.
+    - phase (float, optional): Offset (s) of the periodic calls, e.g. the end time so that
+      the last step of the run is always included.
+    - name (str, optional): Name used in the profiling report. Defaults to the function name.
+    """
+    observer = {'func': func, 'name': name or func.__name__, 'start': start, 'end': end, 'period': period, 'phase': phase,
+                'order': next(registration_counter), 'active': True}
+    observers.append(observer)
+    if current_step is not None:
+        # Registered while the simulation is running: due from the current step on
+        schedule_observer(observer, current_step)
 
 def unregister_observer(func):
     """Remove a function from the observers list."""
-    observers.remove(func)
+    for observer in observers:
+        if observer['func'] is func:
+            observer['active'] = False  # its pending schedule entry is dropped when popped
+            observers.remove(observer)
+            return
+    raise ValueError(f"{func} is not a registered observer")
 
 def clear_observers():
     """Clears all registered observer functions."""
+    for observer in observers:
+        observer['active'] = False
     observers.clear()
+    schedule.clear()
+
+def next_due_step(observer, from_step):
+    """
+    Return the first step index >= from_step at which the observer is due, or None if
+    its window has ended. Times are converted to whole steps to avoid float drift.
+    """
+    due_step = from_step
+    if observer['start'] is not None:
+        due_step = max(due_step, math.ceil(observer['start'] / step_length - 1e-9))
+
+    if observer['period']:
+        period_steps = max(1, round(observer['period'] / step_length))
+        phase_steps = round(observer['phase'] / step_length) % period_steps
+        due_step += (phase_steps - due_step) % period_steps
+
+    if observer['end'] is not None and due_step > math.floor(observer['end'] / step_length + 1e-9):
+        return None
+    return due_step
+
+def schedule_observer(observer, from_step):
+    """Push the next call of an observer onto the schedule."""
+    due_step = next_due_step(observer, from_step)
+    if due_step is not None:
+        heapq.heappush(schedule, (due_step, observer['order'], observer))
+
+def register_close_handler(func):
+    """Add a function to be called before traci.close(), also when the run fails."""
+    close_handlers.append(func)
+
+def enable_profiling(output_file=None, cprofile_observer=None, cprofile_start=None, cprofile_end=None):
+    """
+    Time every observer call and every simulation step in the next run_simulation.
+
+    A summary table is printed and a JSON profile is written to output_file when the
+    simulation closes.
 
-def setup_sumo(sumo_gui, sumo_config_file): # this function needs to be refactored 
+    Args:
+    - output_file (str, optional): Path of the JSON profile.
+    - cprofile_observer (str, optional): Name of one observer to run under cProfile.
+    - cprofile_start (float, optional): Simulation time from which the observer is cProfiled.
+    - cprofile_end (float, optional): Simulation time until which the observer is cProfiled.
+    """
+    global profiler
+    profiler = pru.StepProfiler(output_file, cprofile_observer, cprofile_start, cprofile_end)
+
+def get_config_additional_files(sumo_config_file):
+    """Return the additional files listed in a SUMO config, with paths resolved relative to the config."""
+    config_dir = os.path.dirname(sumo_config_file)
+    additional_files = []
+    for elem in ET.parse(sumo_config_file).getroot().iter('additional-files'):
+        for path in elem.get('value', '').split(','):
+            path = path.strip()
+            if path:
+                additional_files.append(path if os.path.isabs(path) else os.path.join(config_dir, path))
+    return additional_files
+
+def setup_sumo(sumo_gui, sumo_config_file, additional_files=None): # this function needs to be refactored 
     try:
         sumo_home = os.environ['SUMO_HOME']
     except KeyError:
@@ -31,19 +135,33 @@ def setup_sumo(sumo_gui, sumo_config_file): # this function needs to be refactor
     binary_name = 'sumo-gui' if sumo_gui else 'sumo'
     virtual_env = os.environ.get('VIRTUAL_ENV')
 
-    if virtual_env:
+    if bu.is_libsumo():
+        # libsumo runs SUMO in this process, the binary is only the first word of the command line
+        sumo_binary = binary_name
+    elif virtual_env:
         sumo_binary = os.path.join(virtual_env, 'bin', binary_name)
     else:
         sumo_binary = os.path.join("/home/don/.local/bin", binary_name)
         if not os.path.exists(sumo_binary):
             sys.exit(f"The SUMO binary was not found. Please set the 'SUMO_BINARY' environment variable or install SUMO.")
 
-    traci.start([sumo_binary, "-c", sumo_config_file])
+    sumo_cmd = [sumo_binary, "-c", sumo_config_file]
+    if additional_files:
+        # --additional-files replaces the config's list, so keep the config's files too
+        all_additional_files = get_config_additional_files(sumo_config_file) + list(additional_files)
+        sumo_cmd += ["--additional-files", ",".join(all_additional_files)]
+
+    bu.start(sumo_cmd)
+    subu.reset()  # Subscriptions belong to the previous connection
 
 def run_simulation(simulation_end_time):
     """
     Runs a SUMO simulation until the specified end time is reached.
 
+    Only the observers due at a step are called, in registration order. When no observer
+    is due for a while (e.g. during warm-up) SUMO is advanced to the next due step with a
+    single simulationStep call.
+
     Args:
         simulation_end_time (float): The time at which the simulation should end.
 
@@ -54,19 +172,57 @@ def run_simulation(simulation_end_time):
         >>> run_simulation(3600)
         Simulation runtime: 3600.123 seconds
     """
+    global step_length, current_step
     start_time = time.time()  # Record the start time
-    
-    while traci.simulation.getTime() <= simulation_end_time:
-        for observer in observers:
-            observer()
-        traci.simulationStep()
-
-    end_time = time.time()  # Record the end time
-    runtime = end_time - start_time  # Calculate the runtime
+    perf_counter = time.perf_counter
+    step_count = 0
 
-    print(f"\nSimulation runtime: {runtime:.3f} seconds")  # Output the runtime
+    step_length = traci.simulation.getDeltaT()
+    current_step = round(traci.simulation.getTime() / step_length)
+    end_step = math.floor(simulation_end_time / step_length + 1e-9)
 
-    traci.close()
+    schedule.clear()
+    for observer in observers:
+        schedule_observer(observer, current_step)
+    
+    try:
+        while current_step <= end_step:
+            while schedule and schedule[0][0] <= current_step:
+                _, _, observer = heapq.heappop(schedule)
+                if observer['active']:
+                    if profiler is None:
+                        observer['func']()
+                    elif profiler.wants_cprofile(observer['name'], current_step * step_length):
+                        profiler.run_cprofiled(observer['func'])
+                    else:
+                        call_start = perf_counter()
+                        observer['func']()
+                        profiler.record(observer['name'], perf_counter() - call_start)
+                    schedule_observer(observer, current_step + 1)
+
+            next_step = min(schedule[0][0], end_step + 1) if schedule else end_step + 1
+            call_start = perf_counter()
+            if next_step > current_step + 1:
+                traci.simulationStep(next_step * step_length)
+            else:
+                traci.simulationStep()
+            if profiler is not None:
+                profiler.record('simulationStep', perf_counter() - call_start)
+            step_count += next_step - current_step
+            current_step = round(traci.simulation.getTime() / step_length)
+
+        end_time = time.time()  # Record the end time
+        runtime = end_time - start_time  # Calculate the runtime
+
+        print(f"\nSimulation runtime: {runtime:.3f} seconds")  # Output the runtime
+    finally:
+        current_step = None
+        if profiler is not None:
+            profiler.close(time.time() - start_time, step_count)
+        # Flush buffered outputs even if an observer or SUMO raised
+        for handler in close_handlers:
+            handler()
+        traci.close()
 
 def save_config_file(config_file_path, output_dir):
     # Ensure the output directory exists
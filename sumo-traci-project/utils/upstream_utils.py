@@ -0,0 +1,136 @@
+import heapq
+from collections import deque
+
+# Search engines built from a sumolib net, cached per net object for the whole run
+upstream_searches = {}
+
+class UpstreamSearch:
+    """
+    Upstream network search on a compact reverse adjacency built once from a sumolib net.
+
+    Edges and nodes are mapped to integers; edge lengths, end nodes and the incoming
+    (non-internal) edges of every edge's from-node are kept in plain lists, so a search
+    never touches sumolib objects. Build it once per run and reuse it for every incident
+    and every re-run (e.g. every few seconds while a queue grows).
+    """
+
+    def __init__(self, net):
+        edges = net.getEdges(withInternal=True)
+        node_index = {}
+
+        self.edge_ids = [edge.getID() for edge in edges]
+        self.edge_index = {edge_id: i for i, edge_id in enumerate(self.edge_ids)}
+        self.lengths = [edge.getLength() for edge in edges]
+        self.from_nodes = [node_index.setdefault(edge.getFromNode().getID(), len(node_index)) for edge in edges]
+        self.to_nodes = [node_index.setdefault(edge.getToNode().getID(), len(node_index)) for edge in edges]
+
+        # Incoming normal edges of each edge's from-node, in sumolib order (keeps the tags stable)
+        self.incoming = [
+            [self.edge_index[incoming.getID()] for incoming in edge.getFromNode().getIncoming()
+             if not incoming.getID().startswith(':')]
+            for edge in edges
+        ]
+
+    def search(self, edge_id, position_on_lane, distance_limit, partial_inclusion):
+        """
+        Breadth-first search upstream from one incident.
+
+        Args:
+        - edge_id (str): Edge the incident is on.
+        - position_on_lane (float): Distance of the incident from the start of the edge.
+        - distance_limit (float): Maximum upstream distance to search.
+        - partial_inclusion (bool): Include edges that are only partly within the distance limit.
+
+        Returns:
+        - tuple: ({edge_id: distance from incident}, {edge_id: tag}) where the tag encodes
+          the branch of the search tree ("0", "0_0", "0_1", "0_0_0", ...).
+        """
+        lengths, incoming = self.lengths, self.incoming
+        from_nodes, to_nodes = self.from_nodes, self.to_nodes
+
+        start = self.edge_index[edge_id]
+        visited = {start}
+        upstream_edges = {edge_id: position_on_lane}
+        edge_tags = {edge_id: "0"}
+        queue = deque([(start, position_on_lane, "0")])
+
+        while queue:
+            current, distance_from_incident, current_tag = queue.popleft()
+            if distance_from_incident >= distance_limit:
+                continue
+
+            sub_edge_count = 0  # Counter for edges at the same level
+            for upstream in incoming[current]:
+                # Skip visited edges and the U-turn edge coming back from our own to-node
+                if upstream in visited or from_nodes[upstream] == to_nodes[current]:
+                    continue
+
+                visited.add(upstream)
+                upstream_id = self.edge_ids[upstream]
+                new_tag = f"{current_tag}_{sub_edge_count}"
+                edge_tags[upstream_id] = new_tag
+                sub_edge_count += 1
+                new_distance_from_incident = distance_from_incident + lengths[upstream]
+
+                # With partial inclusion the edge is added as soon as its downstream end is within
+                # the limit (always true here), otherwise only if its upstream end is within it too
+                if partial_inclusion or new_distance_from_incident <= distance_limit:
+                    upstream_edges[upstream_id] = new_distance_from_incident
+
+                if new_distance_from_incident <= distance_limit:
+                    queue.append((upstream, new_distance_from_incident, new_tag))
+
+        return upstream_edges, edge_tags
+
+    def search_all(self, sources, distance_limit, partial_inclusion=True):
+        """
+        Multi-source Dijkstra upstream from several incidents in a single pass.
+
+        Every edge gets the shortest upstream distance to its nearest incident, which is
+        what is needed when the affected area is recomputed repeatedly as queues grow.
+
+        Args:
+        - sources (iterable): (incident_id, edge_id, position_on_lane) tuples.
+        - distance_limit (float): Maximum upstream distance to search.
+        - partial_inclusion (bool): Include edges that are only partly within the distance limit.
+
+        Returns:
+        - dict: {edge_id: (distance from nearest incident, incident_id)}.
+        """
+        lengths, incoming = self.lengths, self.incoming
+        from_nodes, to_nodes = self.from_nodes, self.to_nodes
+
+        best = {}
+        heap = []
+        for incident_id, edge_id, position_on_lane in sources:
+            start = self.edge_index[edge_id]
+            if start not in best or position_on_lane < best[start][0]:
+                best[start] = (position_on_lane, incident_id)
+                heapq.heappush(heap, (position_on_lane, start, incident_id))
+
+        settled = set()
+        while heap:
+            distance_from_incident, current, incident_id = heapq.heappop(heap)
+            if current in settled:
+                continue
+            settled.add(current)
+            if distance_from_incident >= distance_limit:
+                continue
+
+            for upstream in incoming[current]:
+                if from_nodes[upstream] == to_nodes[current]:
+                    continue
+                new_distance_from_incident = distance_from_incident + lengths[upstream]
+                if not partial_inclusion and new_distance_from_incident > distance_limit:
+                    continue
+                if upstream not in best or new_distance_from_incident < best[upstream][0]:
+                    best[upstream] = (new_distance_from_incident, incident_id)
+                    heapq.heappush(heap, (new_distance_from_incident, upstream, incident_id))
+
+        return {self.edge_ids[index]: result for index, result in best.items()}
+
+def get_upstream_search(net):
+    """Return the UpstreamSearch of a net, building it on first use."""
+    if id(net) not in upstream_searches:
+        upstream_searches[id(net)] = UpstreamSearch(net)
+    return upstream_searches[id(net)]
@@ -7,6 +7,8 @@ import sumolib
 import sys
 import pandas as pd
 import xml.etree.ElementTree as ET
+from . import spatial_utils as spu
+from . import upstream_utils as upu
 
 issued_slowdown = {}  # Dictionary to track vehicles for which slowdown was issued and their timestamp
 vehicle_stop_data = []  # Global list to store data about stopped vehicles
@@ -91,33 +93,28 @@ def write_stopped_vehicles_to_file(scenario, project):
             })
     
     return output_path
-# Supporting function for get_edges_near_stopped_egos - works only for fivebyfive scenario
-def get_opposite_edge(edge):
-    """Returns the opposite edge given the naming convention.
-        only works for fivebyfive scenario!
+# Get edges within specified radius stopped egos
+def get_edges_near_stopped_egos(radius, ego_type, net):
     """
-    return edge[2:] + edge[:2]
-# Get edges within specified radius stopped egos - needs improvement!
-def get_edges_near_stopped_egos(radius, ego_type):
-    """
-    This function gets first lane on an edge ("_0") and checks if the distance between the stopped ego 
-    and the lane is less than the radius. The coordinates returned are the coordinates of the lane centre 
-    line starting point and ending point. The function checks if either end of the lane is within the radius.
-    The edge cases that are not captured are:
-     - if the ego is stopped on midway on a lane and the radius is less than half of the lane length
-       in close proximity to the ego, then the lane will not be captured. This would typically be the 
-       opposite lane of the ego. (this is issue is rectified for fivebyfive scenario through
-       get opposite edge function, but not for other scenarios since the opposite edge is not known)
-    
     Returns all edges within a given radius of all stopped egos.
+
+    The first lane ("_0") of every edge is looked up in a grid index built once from the
+    sumolib net, and the distance is measured from the ego to each lane segment. Egos
+    stopped midway on a long lane therefore also capture the opposite lane, which used to
+    be missed when only the lane end points were checked. The edge running opposite to
+    the ego's edge is added from a reverse-edge map derived from the net.
     
     Args:
     - radius (float): The distance radius to consider.
+    - ego_type (str): The vehicle type of the egos.
+    - net (sumolib.net.Net): The network, used to build the spatial index on first call.
     
     Returns:
     - set: A set of nearby edges.
     """
     nearby_edges = set()
+    lane_index = spu.get_lane_index(net)
+    reverse_edges = spu.get_reverse_edge_map(net)
     
     for vehicle_id in traci.vehicle.getIDList():
         if traci.vehicle.getTypeID(vehicle_id) == ego_type and traci.vehicle.isStopped(vehicle_id):
@@ -127,20 +124,11 @@ def get_edges_near_stopped_egos(radius, ego_type):
             nearby_edges.add(current_edge)
             
             # Add the opposite edge of the stopped ego to the set
-            opposite_edge = get_opposite_edge(current_edge)
-            nearby_edges.add(opposite_edge)
+            if current_edge in reverse_edges:
+                nearby_edges.add(reverse_edges[current_edge])
             
-            position = traci.vehicle.getPosition(vehicle_id)
-            x, y = position
-            # print (f"Vehicle {vehicle_id} is stopped at position ({x}, {y})")
-            for edge in traci.edge.getIDList():
-                if edge[0] != ':':
-                    for lane_pos in traci.lane.getShape(edge + "_0"):
-                        # print(f"lane_pos = {lane_pos}")
-                        distance = ((x - lane_pos[0])**2 + (y - lane_pos[1])**2)**0.5
-                        # print(f"x = {lane_pos[0]}, y = {lane_pos[1]}")
-                        if distance <= radius:
-                            nearby_edges.add(edge)
+            x, y = traci.vehicle.getPosition(vehicle_id)
+            nearby_edges.update(lane_index.edges_within(x, y, radius))
                                                   
     return nearby_edges
 def save_radius_edges_as_xml(nearby_edges, scenario, project):
@@ -233,71 +221,45 @@ def save_radius_edges_as_xml(nearby_edges, scenario, project):
 
 # Updated by removing unnecessary internal edge handling - current working version
 def get_upstream_edges_with_distance(file_path, net, distance_limit, partial_inclusion):
+    """
+    Finds the upstream edges of every stopped vehicle (incident) in file_path.
+
+    The search runs on the cached reverse adjacency of upstream_utils.UpstreamSearch,
+    which is built once per net and reused for every incident.
+
+    Returns:
+    - tuple: ({incident_id: {edge_id: distance}}, {incident_id: {edge_id: tag}})
+    """
     df = pd.read_csv(file_path)
+    upstream_search = upu.get_upstream_search(net)
 
     all_incidents_upstream_edges = {}
     all_incidents_edge_tags = {}  # Dictionary to store edge tags
 
-    for _, row in df.iterrows():
-        incident_id = row['vehicle_id']
-        edge_id = row['edge_id']
-        position_on_lane = row['position_on_lane']
-        print(edge_id, position_on_lane)
-
-        visited_edges = set([edge_id])
-
-        all_upstream_edges = {edge_id: position_on_lane}
-        all_edge_tags = {edge_id: "0"}  # Tagging the incident edge as level 0
-        queue = [(edge_id, position_on_lane, "0")]  # Adding initial depth tag
-        print("queue:", queue)
-
-        while queue:
-            current_edge_id, distance_from_incident, current_tag = queue.pop(0)
-            current_edge = net.getEdge(current_edge_id)
-            print("current_edge:", current_edge)
-            current_from_node = current_edge.getFromNode()
-            print("current_from_node:", current_from_node)
-            current_to_node = current_edge.getToNode()
-            print("current_to_node:", current_to_node)
-
-            if distance_from_incident < distance_limit:
-                sub_edge_count = 0  # Counter for edges at the same level
-                for incoming_edge in current_from_node.getIncoming():
-                    incoming_edge_id = incoming_edge.getID()
-                    incoming_edge_from_node = incoming_edge.getFromNode()
-                    print("incoming_edge_id:", incoming_edge_id, "incoming_edge_from_node:", incoming_edge_from_node)
-
-                    if (incoming_edge_id not in visited_edges 
-                        and not incoming_edge_id.startswith(':') 
-                        and incoming_edge_from_node != current_to_node):
-                        
-                        visited_edges.add(incoming_edge_id)
-                        new_tag = f"{current_tag}_{sub_edge_count}"
-                        all_edge_tags[incoming_edge_id] = new_tag
-                        sub_edge_count += 1
-                        new_distance_from_incident = distance_from_incident + incoming_edge.getLength()
-                        print("visited_edges:", visited_edges)
-
-                        if partial_inclusion:
-                            # Add edge if any part of it is within the distance limit
-                            if new_distance_from_incident - incoming_edge.getLength() < distance_limit:
-                                all_upstream_edges[incoming_edge_id] = new_distance_from_incident
-                                print("all_upstream_edges:", all_upstream_edges)
-                        else:
-                            # Add edge only if its end is within the distance limit
-                            if new_distance_from_incident <= distance_limit:
-                                all_upstream_edges[incoming_edge_id] = new_distance_from_incident
-
-                        if new_distance_from_incident <= distance_limit:
-                            queue.append((incoming_edge_id, new_distance_from_incident, new_tag))
-                            print("queue:", queue)
-
-        all_incidents_upstream_edges[incident_id] = all_upstream_edges
-        all_incidents_edge_tags[incident_id] = all_edge_tags
-        print("all_incidents_upstream_edges:", all_incidents_upstream_edges)
-        print("all_incidents_edge_tags:", all_incidents_edge_tags)
+    for row in df.itertuples(index=False):
+        upstream_edges, edge_tags = upstream_search.search(row.edge_id, row.position_on_lane, distance_limit, partial_inclusion)
+        all_incidents_upstream_edges[row.vehicle_id] = upstream_edges
+        all_incidents_edge_tags[row.vehicle_id] = edge_tags
+        print(f"Incident {row.vehicle_id} on {row.edge_id}: {len(upstream_edges)} upstream edges within {distance_limit} m")
 
     return all_incidents_upstream_edges, all_incidents_edge_tags
+def get_upstream_area_of_stopped_egos(ego_type, net, distance_limit, partial_inclusion):
+    """
+    Finds the upstream area of all currently stopped egos in a single multi-source search.
+
+    Unlike get_upstream_edges_with_distance (one search per incident, once after edge
+    detection) this is meant to be rerun periodically during the attack run, so the
+    affected area follows egos as they stop and drive off again.
+
+    Returns:
+    - dict: {edge_id: (distance from the nearest stopped ego, ego id)}, empty if no ego is stopped.
+    """
+    sources = [(vehicle_id, traci.vehicle.getRoadID(vehicle_id), traci.vehicle.getLanePosition(vehicle_id))
+               for vehicle_id in traci.vehicle.getIDList()
+               if traci.vehicle.getTypeID(vehicle_id) == ego_type and traci.vehicle.isStopped(vehicle_id)]
+    if not sources:
+        return {}
+    return upu.get_upstream_search(net).search_all(sources, distance_limit, partial_inclusion)
 def save_upstream_edges_as_xml(incidents_upstream_edges, scenario, project):
     root = ET.Element("Incidents")
 